@@ -0,0 +1,5 @@
+"""离线基准测试：用本地的OpenAI兼容替身服务器驱动TinyWorld、TinyPersonFactory和TinyPerson，
+测量轮次吞吐、回应延迟分位数、每次调用的提示词token数和峰值内存，结果输出为可在不同提交间对比的JSON。
+
+    python -m benchmarks.run --agents 2 10 100 --output bench.json
+    python -m benchmarks.compare base.json bench.json"""
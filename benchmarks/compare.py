@@ -0,0 +1,50 @@
+from typing import Dict, Any, Tuple
+import sys
+import json
+
+# (指标路径, 数值越大越好)
+METRICS = (
+    ("rounds_per_s", True),
+    ("turns_per_s", True),
+    ("turn_latency_ms.p50", False),
+    ("turn_latency_ms.p95", False),
+    ("turn_latency_ms.p99", False),
+    ("prompt_tokens_per_call.mean", False),
+    ("calls", False),
+    ("peak_rss_mb", False),
+)
+
+
+def _lookup(result: Dict[str, Any], path: str):
+    value: Any = result
+    for part in path.split("."):
+        value = value.get(part) if isinstance(value, dict) else None
+    return value
+
+
+def _index(path: str) -> Dict[Tuple[str, int], Dict[str, Any]]:
+    with open(path, "r", encoding="utf-8") as f:
+        return {(result["scenario"], result["agents"]): result for result in json.load(f)["results"]}
+
+
+def compare(base_path: str, new_path: str, threshold: float = 0.1) -> int:
+    """逐项对比两次基准测试结果，打印变化并返回变差超过threshold比例的指标数"""
+    base, new = _index(base_path), _index(new_path)
+    regressions = 0
+    for key in sorted(base.keys() & new.keys()):
+        print(f"{key[0]} agents={key[1]}")
+        for metric, higher_is_better in METRICS:
+            old, current = _lookup(base[key], metric), _lookup(new[key], metric)
+            if not isinstance(old, (int, float)) or not isinstance(current, (int, float)):
+                continue
+            change = (current - old) / old if old else 0.0
+            worse = change < -threshold if higher_is_better else change > threshold
+            regressions += worse
+            print(f"  {metric:<30}{old:>12}{current:>12}{change:>+9.1%}{'  <-- 变差' if worse else ''}")
+    return regressions
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        sys.exit("用法：python -m benchmarks.compare base.json new.json [阈值]")
+    sys.exit(1 if compare(sys.argv[1], sys.argv[2], float(sys.argv[3]) if len(sys.argv) > 3 else 0.1) else 0)
@@ -0,0 +1,293 @@
+from typing import List, Dict, Any, Optional, Tuple
+import re
+import json
+import time
+import random
+import argparse
+import threading
+import multiprocessing
+from dataclasses import dataclass, asdict, field
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.request import urlopen, Request
+from virtuoso.contextbuilder import estimate_tokens
+
+
+def parse_latency(spec: str):
+    """解析延迟分布描述，返回采样函数（单位：秒）：
+    - fixed:0.05           固定延迟
+    - uniform:0.02,0.1     均匀分布
+    - lognormal:0.05,0.5   对数正态分布，参数为中位数和sigma
+    - exponential:0.05     指数分布，参数为均值"""
+    kind, _, raw = spec.partition(":")
+    args = [float(value) for value in raw.split(",") if value]
+    if kind == "fixed":
+        return lambda rng: args[0]
+    if kind == "uniform":
+        return lambda rng: rng.uniform(args[0], args[1])
+    if kind == "lognormal":
+        median, sigma = args
+        return lambda rng: median * rng.lognormvariate(0.0, sigma)
+    if kind == "exponential":
+        return lambda rng: rng.expovariate(1.0 / args[0])
+    raise ValueError(f"未知的延迟分布：{spec}")
+
+
+@dataclass
+class MockServerConfig:
+    """替身服务器的行为配置"""
+    latency: str = "fixed:0.05"  # 首个token之前的延迟分布，见parse_latency
+    tokens_per_second: float = 0.0  # 生成速度，0表示不限速
+    completion_tokens: int = 80  # 普通文本回应的token数，不超过请求的max_tokens
+    error_rate: float = 0.0  # 注入错误的概率
+    error_statuses: Tuple[int, ...] = (429, 500)  # 注入错误时随机选择的状态码
+    retry_after: Optional[float] = 0.05  # 注入429时返回的Retry-After秒数，None表示不返回
+    seed: Optional[int] = None
+
+
+@dataclass
+class _Stats:
+    requests: int = 0
+    streamed: int = 0
+    errors: Dict[str, int] = field(default_factory=dict)
+    prompt_tokens: List[int] = field(default_factory=list)
+    completion_tokens: List[int] = field(default_factory=list)
+
+
+_BATCH = re.compile(r"以下(\d+)条指令")
+_FILLER = "我们继续讨论这个问题并且认真考虑每个人的观点。"
+
+
+def _persona(index: int) -> Dict[str, Any]:
+    return {
+        "name": f"角色{index}",
+        "role": "参会者",
+        "traits": ["冷静", "好奇", "务实"],
+        "personality": {"style": "直接", "expertise": ["产品", "技术"]},
+        "interests": ["阅读", "旅行", "编程"],
+        "goals": ["了解产品", "结识同行"],
+    }
+
+
+def _filler(tokens: int) -> str:
+    return (_FILLER * (tokens // len(_FILLER) + 1))[:max(1, tokens)]
+
+
+def _content_for(params: Dict[str, Any], completion_tokens: int, rng: random.Random) -> str:
+    """按请求的类型生成能被调用方正常解析的回应内容"""
+    prompt = params["messages"][-1]["content"] if params.get("messages") else ""
+    batch = _BATCH.search(prompt)
+    if batch and "JSON数组" in prompt:
+        return json.dumps([_persona(rng.randrange(10**6)) for _ in range(int(batch.group(1)))], ensure_ascii=False)
+    if "按JSON格式返回" in prompt:
+        return json.dumps(_persona(rng.randrange(10**6)), ensure_ascii=False)
+    if (params.get("response_format") or {}).get("type") == "json_object":
+        part = _filler(completion_tokens // 3)
+        return json.dumps({"thought": part, "speech": part, "action": part}, ensure_ascii=False)
+    return _filler(completion_tokens)
+
+
+class MockChatServer(ThreadingHTTPServer):
+    """只实现POST /v1/chat/completions（含SSE流式）的OpenAI兼容服务器，
+    另外提供GET /stats读取统计、POST /stats/reset清空统计"""
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, address: Tuple[str, int], config: MockServerConfig):
+        super().__init__(address, _Handler)
+        self.config = config
+        self.sample_latency = parse_latency(config.latency)
+        self.rng = random.Random(config.seed)
+        self.stats = _Stats()
+        self.lock = threading.Lock()
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self.lock:
+            return asdict(self.stats)
+
+    def reset_stats(self):
+        with self.lock:
+            self.stats = _Stats()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True  # 头部与正文分开写出，避免Nagle算法与延迟确认叠加出约40ms的额外延迟
+    server: MockChatServer
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.rstrip("/") == "/stats":
+            self._send_json(200, self.server.snapshot())
+        else:
+            self._send_json(404, {"error": {"message": "not found"}})
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        path = self.path.rstrip("/")
+        if path == "/stats/reset":
+            self.server.reset_stats()
+            self._send_json(200, {})
+        elif path.endswith("/chat/completions"):
+            self._chat_completion(json.loads(body or b"{}"))
+        else:
+            self._send_json(404, {"error": {"message": "not found"}})
+
+    def _chat_completion(self, params: Dict[str, Any]):
+        server, config = self.server, self.server.config
+        with server.lock:
+            latency = max(0.0, server.sample_latency(server.rng))
+            failed = server.rng.random() < config.error_rate
+            status = server.rng.choice(config.error_statuses) if failed else 200
+            stream_seed = server.rng.randrange(2**32)
+        time.sleep(latency)
+
+        if failed:
+            with server.lock:
+                server.stats.errors[str(status)] = server.stats.errors.get(str(status), 0) + 1
+            headers = {"Retry-After": str(config.retry_after)} if status == 429 and config.retry_after is not None else {}
+            self._send_json(status, {"error": {"message": "injected error", "type": "mock_error"}}, headers)
+            return
+
+        prompt_tokens = sum(estimate_tokens(str(message.get("content", ""))) for message in params.get("messages", []))
+        target = min(config.completion_tokens, params.get("max_tokens") or config.completion_tokens)
+        content = _content_for(params, target, random.Random(stream_seed))
+        completion_tokens = estimate_tokens(content)
+        stream = bool(params.get("stream"))
+        with server.lock:
+            server.stats.requests += 1
+            server.stats.streamed += int(stream)
+            server.stats.prompt_tokens.append(prompt_tokens)
+            server.stats.completion_tokens.append(completion_tokens)
+
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                 "total_tokens": prompt_tokens + completion_tokens}
+        base = {"id": f"chatcmpl-mock-{stream_seed}", "created": int(time.time()), "model": params.get("model", "mock")}
+        if stream:
+            include_usage = bool((params.get("stream_options") or {}).get("include_usage"))
+            self._stream(base, content, usage if include_usage else None)
+            return
+
+        if config.tokens_per_second > 0:
+            time.sleep(completion_tokens / config.tokens_per_second)
+        self._send_json(200, dict(base, object="chat.completion", usage=usage, choices=[{
+            "index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}]))
+
+    def _stream(self, base: Dict[str, Any], content: str, usage: Optional[Dict[str, int]]):
+        """以SSE逐段发送内容，每段约8个token，按tokens_per_second控制发送速度"""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        rate = self.server.config.tokens_per_second
+        step = 8
+
+        def event(choices, **extra):
+            chunk = dict(base, object="chat.completion.chunk", choices=choices, **extra)
+            self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        for start in range(0, len(content), step):
+            piece = content[start:start + step]
+            event([{"index": 0, "delta": {"content": piece}, "finish_reason": None}])
+            if rate > 0:
+                time.sleep(estimate_tokens(piece) / rate)
+        event([{"index": 0, "delta": {}, "finish_reason": "stop"}])
+        if usage is not None:
+            event([], usage=usage)
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+    def _send_json(self, status: int, payload: Dict[str, Any], headers: Optional[Dict[str, str]] = None):
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def serve(config: MockServerConfig, host: str = "127.0.0.1", port: int = 0, ready=None):
+    """在当前进程中运行替身服务器；ready为multiprocessing队列时启动后把端口号放入队列"""
+    server = MockChatServer((host, port), config)
+    if ready is not None:
+        ready.put(server.server_address[1])
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+class MockServer:
+    """在独立进程中运行替身服务器，避免服务端占用被测进程的GIL和内存
+
+        with MockServer(MockServerConfig(latency="lognormal:0.05,0.5")) as server:
+            configure(base_url=server.base_url, api_key="mock")"""
+    def __init__(self, config: Optional[MockServerConfig] = None, host: str = "127.0.0.1", port: int = 0):
+        self.config = config or MockServerConfig()
+        self.host = host
+        self.port = port
+        self._process: Optional[multiprocessing.Process] = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}/v1"
+
+    def start(self) -> "MockServer":
+        context = multiprocessing.get_context("spawn")
+        ready = context.Queue()
+        self._process = context.Process(target=serve, args=(self.config, self.host, self.port, ready), daemon=True)
+        self._process.start()
+        self.port = ready.get(timeout=30)
+        return self
+
+    def stop(self):
+        if self._process is not None:
+            self._process.terminate()
+            self._process.join()
+            self._process = None
+
+    def stats(self) -> Dict[str, Any]:
+        with urlopen(f"http://{self.host}:{self.port}/stats") as response:
+            return json.loads(response.read())
+
+    def reset_stats(self):
+        urlopen(Request(f"http://{self.host}:{self.port}/stats/reset", data=b"", method="POST")).close()
+
+    def __enter__(self) -> "MockServer":
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def add_server_arguments(parser: argparse.ArgumentParser):
+    defaults = MockServerConfig()
+    parser.add_argument("--latency", default=defaults.latency, help="首token延迟分布，如fixed:0.05、lognormal:0.05,0.5")
+    parser.add_argument("--tokens-per-second", type=float, default=defaults.tokens_per_second)
+    parser.add_argument("--completion-tokens", type=int, default=defaults.completion_tokens)
+    parser.add_argument("--error-rate", type=float, default=defaults.error_rate)
+    parser.add_argument("--error-statuses", type=int, nargs="+", default=list(defaults.error_statuses))
+    parser.add_argument("--retry-after", type=float, default=defaults.retry_after)
+    parser.add_argument("--seed", type=int, default=defaults.seed)
+
+
+def config_from_args(args: argparse.Namespace) -> MockServerConfig:
+    return MockServerConfig(latency=args.latency, tokens_per_second=args.tokens_per_second,
+                            completion_tokens=args.completion_tokens, error_rate=args.error_rate,
+                            error_statuses=tuple(args.error_statuses), retry_after=args.retry_after, seed=args.seed)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="本地OpenAI兼容替身服务器")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    add_server_arguments(parser)
+    args = parser.parse_args()
+    print(f"替身服务器：http://{args.host}:{args.port}/v1")
+    serve(config_from_args(args), args.host, args.port)
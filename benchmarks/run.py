@@ -0,0 +1,166 @@
+from typing import List, Dict, Any, Optional
+import sys
+import json
+import time
+import platform
+import argparse
+import subprocess
+import multiprocessing
+from queue import Empty
+from dataclasses import asdict
+from .mockserver import MockServer, add_server_arguments, config_from_args
+from .scenarios import SCENARIOS, peak_rss_mb
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    """线性插值的分位数，q取0~100"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def _scenario_process(name: str, agents: int, options: Dict[str, Any], server: MockServer, queue):
+    """在独立进程中运行单个场景，保证峰值内存互不影响"""
+    from virtuoso.llmclient import configure, get_client, create_chat_completion
+    from virtuoso.llmcache import configure_cache
+    from virtuoso.ratelimit import configure_rate_limits, RetryPolicy
+
+    configure(base_url=server.base_url, api_key="mock", max_connections=max(agents, 10),
+              max_keepalive_connections=max(agents, 10))
+    configure_cache()  # 关闭响应缓存，每次调用都经过替身服务器
+    configure_rate_limits(None, RetryPolicy(waiting_time=0.01, max_waiting_time=1.0))
+    try:
+        # 预热：导入、客户端创建和首次建立连接不计入结果
+        create_chat_completion(get_client(), model="warmup", messages=[{"role": "user", "content": "warmup"}])
+        server.reset_stats()
+        result = SCENARIOS[name](agents, options)
+        result["peak_rss_mb"] = peak_rss_mb()
+        queue.put(result)
+    except Exception as e:
+        queue.put({"error": f"{type(e).__name__}: {e}"})
+
+
+def _wait_result(process, queue, timeout: Optional[float]) -> Dict[str, Any]:
+    """等待场景进程的结果；进程异常退出（例如被OOM killer杀死）或超时时返回error，不会一直阻塞"""
+    deadline = time.monotonic() + timeout if timeout else None
+    while True:
+        try:
+            return queue.get(timeout=1.0)
+        except Empty:
+            pass
+        if not process.is_alive():
+            try:  # 进程可能在退出前刚放入结果
+                return queue.get(timeout=1.0)
+            except Empty:
+                return {"error": f"场景进程异常退出，exitcode={process.exitcode}"}
+        if deadline is not None and time.monotonic() > deadline:
+            process.terminate()
+            return {"error": f"超过{timeout}秒未完成"}
+
+
+def run_scenario(server: MockServer, name: str, agents: int, options: Dict[str, Any],
+                 timeout: Optional[float] = None) -> Dict[str, Any]:
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    process = context.Process(target=_scenario_process,
+                              args=(name, agents, options, MockServer(host=server.host, port=server.port), queue))
+    process.start()
+    raw = _wait_result(process, queue, timeout)
+    process.join()
+    stats = server.stats()
+
+    result: Dict[str, Any] = {"scenario": name, "agents": agents}
+    if "error" in raw:
+        result["error"] = raw["error"]
+        return result
+    latencies = [latency * 1000 for latency in raw["latencies"]]
+    prompt_tokens = stats["prompt_tokens"]
+    result.update({
+        "elapsed_s": round(raw["elapsed"], 3),
+        "rounds_per_s": round(raw["rounds"] / raw["elapsed"], 3) if "rounds" in raw else None,
+        "rounds": raw.get("rounds"),
+        "stop_reason": raw.get("stop_reason"),
+        "turns": len(latencies),
+        "turns_per_s": round(len(latencies) / raw["elapsed"], 3),
+        "turn_latency_ms": {f"p{q}": round(percentile(latencies, q), 2) for q in (50, 95, 99)},
+        "calls": stats["requests"],
+        "prompt_tokens_per_call": {
+            "mean": round(sum(prompt_tokens) / len(prompt_tokens), 1) if prompt_tokens else None,
+            "p50": percentile(prompt_tokens, 50),
+            "max": max(prompt_tokens, default=None),
+        },
+        "completion_tokens": sum(stats["completion_tokens"]),
+        "injected_errors": stats["errors"],
+        "peak_rss_mb": raw["peak_rss_mb"],
+    })
+    return result
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="使用本地替身服务器的离线基准测试")
+    parser.add_argument("--scenarios", nargs="+", choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument("--agents", type=int, nargs="+", default=[2, 10, 100])
+    parser.add_argument("--rounds", type=int, default=3, help="world_run的轮数")
+    parser.add_argument("--scheduler", default="sequential", choices=["sequential", "parallel"])
+    parser.add_argument("--act-mode", default="sequential", choices=["sequential", "concurrent", "structured"])
+    parser.add_argument("--prompt-layout", default="inline", choices=["inline", "messages"])
+    parser.add_argument("--history-limit", type=int, help="每个智能体对话历史保留的回应数，默认不限制")
+    parser.add_argument("--no-full-history", action="store_true", help="world_run只在内存中保留最近memory_window轮")
+    parser.add_argument("--turn-policy", default="all",
+                        choices=["all", "round_robin", "addressed", "activity", "moderator"],
+                        help="world_run每轮的发言人选择策略，默认所有智能体都发言")
+    parser.add_argument("--speakers", type=int, default=2, help="除all外的策略每轮的（期望）发言人数")
+    parser.add_argument("--rooms", type=int, help="world_run把智能体平均分到这么多个房间，每人只看到同房间的发言")
+    parser.add_argument("--converge", type=float, help="world_run在平均新颖度连续低于该阈值时提前结束")
+    parser.add_argument("--timeout", type=float, help="单个场景的最长运行秒数，超时记为错误，默认不限制")
+    parser.add_argument("--output", help="结果JSON的输出路径，默认输出到标准输出")
+    add_server_arguments(parser)
+    args = parser.parse_args(argv)
+
+    server_config = config_from_args(args)
+    options = {"rounds": args.rounds, "scheduler": args.scheduler, "act_mode": args.act_mode,
+               "prompt_layout": args.prompt_layout, "history_limit": args.history_limit,
+               "keep_full_history": not args.no_full_history, "turn_policy": args.turn_policy,
+               "speakers": args.speakers, "rooms": args.rooms,
+               "converge": args.converge}
+    results = []
+    with MockServer(server_config) as server:
+        for name in args.scenarios:
+            for agents in args.agents:
+                result = run_scenario(server, name, agents, options, args.timeout)
+                print(f"{name} agents={agents}: {result.get('error') or result['turn_latency_ms']}", file=sys.stderr)
+                results.append(result)
+
+    report = {
+        "meta": {
+            "commit": _git_commit(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "options": options,
+            "server": asdict(server_config),
+        },
+        "results": results,
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
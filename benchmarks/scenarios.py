@@ -0,0 +1,142 @@
+from typing import List, Dict, Any, Callable
+import sys
+import time
+import functools
+from virtuoso.tinyperson import TinyPerson
+from virtuoso.tinypersonfactory import TinyPersonFactory
+from virtuoso.tinyworld import TinyWorld
+from virtuoso.broadcast import broadcast
+from virtuoso import metrics
+from virtuoso.clock import NoDelayClock
+from virtuoso.topology import Topology, RoomTopology
+from virtuoso.convergence import ConvergenceMonitor
+from virtuoso.turntaking import TurnPolicy, RoundRobinPolicy, AddressedPolicy, ActivityPolicy, ModeratorPolicy
+
+SCENE = "在一场科技产品展览会上，一家初创公司展示了一套虚拟现实设备，参观者围绕产品展开讨论"
+
+
+def peak_rss_mb():
+    """当前进程的峰值常驻内存（MB），不支持的平台返回None"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def _make_agents(count: int, options: Dict[str, Any]) -> List[TinyPerson]:
+    return [TinyPerson(name=f"agent{i}", role="参观者", traits=["好奇", "务实", "健谈"],
+                       personality={"style": "直接", "expertise": ["产品"], "interests": ["科技"], "goals": ["了解产品"]},
+                       act_mode=options["act_mode"], prompt_layout=options["prompt_layout"],
+                       history_limit=options.get("history_limit"))
+            for i in range(count)]
+
+
+def _turn_policy(options: Dict[str, Any]) -> TurnPolicy:
+    speakers = options.get("speakers", 2)
+    name = options.get("turn_policy", "all")
+    if name == "round_robin":
+        return RoundRobinPolicy(speakers)
+    if name == "addressed":
+        return AddressedPolicy(max_speakers=speakers, fallback=RoundRobinPolicy(speakers))
+    if name == "activity":
+        return ActivityPolicy(expected_speakers=speakers)
+    if name == "moderator":
+        return ModeratorPolicy(max_speakers=speakers, fallback=RoundRobinPolicy(speakers))
+    return RoundRobinPolicy()
+
+
+def _topology(people: List[TinyPerson], options: Dict[str, Any]) -> Topology:
+    rooms = options.get("rooms")
+    if not rooms:
+        return Topology()
+    return RoomTopology({f"room{i}": [person.name for person in people[i::rooms]] for i in range(rooms)})
+
+
+def _timed(func: Callable, latencies: List[float]) -> Callable:
+    """包装方法，把每次调用的耗时追加到latencies"""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            latencies.append(time.perf_counter() - start)
+    return wrapper
+
+
+def world_run(agents: int, options: Dict[str, Any]) -> Dict[str, Any]:
+    """TinyWorld.run：每轮由turn_policy选出的智能体各act一次，回应延迟即单个智能体一次act的耗时"""
+    latencies: List[float] = []
+    people = _make_agents(agents, options)
+    for person in people:
+        person.act = _timed(person.act, latencies)
+    world = TinyWorld(people, SCENE, scheduler=options["scheduler"], clock=NoDelayClock(), verbose=False,
+                      keep_full_history=options.get("keep_full_history", True), turn_policy=_turn_policy(options),
+                      topology=_topology(people, options),
+                      convergence=ConvergenceMonitor(options["converge"]) if options.get("converge") else None)
+    start = time.perf_counter()
+    world.run(options["rounds"])
+    elapsed = time.perf_counter() - start
+    return {"elapsed": elapsed, "rounds": world.rounds, "stop_reason": world.stop_reason, "latencies": latencies}
+
+
+def generate_person(agents: int, options: Dict[str, Any]) -> Dict[str, Any]:
+    """TinyPersonFactory.generate_person：依次生成agents个角色"""
+    latencies: List[float] = []
+    factory = TinyPersonFactory(SCENE)
+    generate = _timed(factory.generate_person, latencies)
+    start = time.perf_counter()
+    for i in range(agents):
+        generate(f"你是参观本场展会的第{i}位观众，对该虚拟设备产品非常感兴趣。")
+    return {"elapsed": time.perf_counter() - start, "latencies": latencies}
+
+
+def listen_and_act(agents: int, options: Dict[str, Any]) -> Dict[str, Any]:
+    """TinyPerson.listen_and_act：每个智能体回应一次提问"""
+    latencies: List[float] = []
+    people = _make_agents(agents, options)
+    start = time.perf_counter()
+    for person in people:
+        _timed(person.listen_and_act, latencies)("介绍下你自己，并谈谈你对这个虚拟现实设备的看法。")
+    return {"elapsed": time.perf_counter() - start, "latencies": latencies}
+
+
+def broadcast_panel(agents: int, options: Dict[str, Any]) -> Dict[str, Any]:
+    """broadcast：同一个问题最多64路并发发给所有智能体，回应延迟即单个智能体一次listen_and_act的耗时"""
+    people = _make_agents(agents, options)
+    start = time.perf_counter()
+    latencies = [answer.latency for answer in broadcast("介绍下你自己，并谈谈你对这个虚拟现实设备的看法。", people,
+                                                        concurrency=min(agents, 64))]
+    return {"elapsed": time.perf_counter() - start, "latencies": latencies}
+
+
+def broadcast_dedupe(agents: int, options: Dict[str, Any]) -> Dict[str, Any]:
+    """broadcast的去重：agents个完全相同的智能体，在1、4和64路并发下都必须只发出一次LLM调用"""
+    latencies: List[float] = []
+    sent: List[metrics.CallRecord] = []
+    on_call = lambda record: None if record.cache_hit else sent.append(record)
+    metrics.subscribe(on_call)
+    start = time.perf_counter()
+    try:
+        for concurrency in (1, 4, 64):
+            people = [TinyPerson(name="参观者", role="参观者", traits=["好奇"],
+                                 personality={"style": "直接", "expertise": ["产品"], "interests": [], "goals": []})
+                      for _ in range(agents)]
+            sent.clear()
+            latencies.extend(answer.latency for answer in broadcast("介绍下你自己。", people, concurrency=concurrency))
+            if len(sent) != 1:
+                raise AssertionError(f"{agents}个相同的智能体在{concurrency}路并发下发出了{len(sent)}次调用")
+    finally:
+        metrics.unsubscribe(on_call)
+    return {"elapsed": time.perf_counter() - start, "latencies": latencies}
+
+
+SCENARIOS: Dict[str, Callable[[int, Dict[str, Any]], Dict[str, Any]]] = {
+    "world_run": world_run,
+    "generate_person": generate_person,
+    "listen_and_act": listen_and_act,
+    "broadcast": broadcast_panel,
+    "broadcast_dedupe": broadcast_dedupe,
+}
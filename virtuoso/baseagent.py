@@ -1,30 +1,136 @@
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Iterator, AsyncIterator, Tuple
 import time
+import asyncio
+import inspect
+import threading
+import weakref
 from abc import ABC, abstractmethod
-from openai import OpenAI
-import re
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from openai import OpenAI, AsyncOpenAI
+from .llmclient import get_client, get_async_client
+from .metrics import add_queue_time, bind_context
+from .turn import Turn, TurnHistory
+
+# act() 的执行模式：sequential 依次调用三个方法，concurrent 并发调用，
+# structured 一次调用同时生成thought/speech/action三个字段
+ACT_MODES = ("sequential", "concurrent", "structured")
+
+# 异步LLM调用的全局并发上限（同一事件循环内所有智能体、所有模拟共享）。
+# asyncio.Semaphore会绑定到首次使用它的事件循环，因此按事件循环分别创建
+_async_concurrency_limit: Optional[int] = None
+_async_llm_semaphores = weakref.WeakKeyDictionary()
+_async_llm_semaphores_lock = threading.Lock()
+
+
+def set_async_concurrency_limit(limit: Optional[int]):
+    """设置异步LLM调用的全局并发上限，None表示不限制"""
+    global _async_concurrency_limit, _async_llm_semaphores
+    with _async_llm_semaphores_lock:
+        _async_concurrency_limit = limit or None
+        _async_llm_semaphores = weakref.WeakKeyDictionary()
+
+
+def _get_async_llm_semaphore() -> Optional[asyncio.Semaphore]:
+    """返回当前事件循环的并发信号量，首次使用时在该循环内创建"""
+    if _async_concurrency_limit is None:
+        return None
+    loop = asyncio.get_running_loop()
+    with _async_llm_semaphores_lock:
+        semaphore = _async_llm_semaphores.get(loop)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(_async_concurrency_limit)
+            _async_llm_semaphores[loop] = semaphore
+        return semaphore
+
+
+@asynccontextmanager
+async def async_llm_slot():
+    """在全局并发上限内占用一个异步LLM调用名额，等待名额的时间计入下一次调用记录的queue_time"""
+    semaphore = _get_async_llm_semaphore()
+    if semaphore is None:
+        yield
+    else:
+        started = time.perf_counter()
+        async with semaphore:
+            add_queue_time(time.perf_counter() - started)
+            yield
+
 
 class BaseAgent(ABC):
     """智能体基类（抽象类）"""
-    def __init__(self, name: str, role: str, traits: List[str]):
+    def __init__(self, name: str, role: str, traits: List[str], act_mode: str = "sequential",
+                 api_client: Optional[OpenAI] = None, async_api_client: Optional[AsyncOpenAI] = None,
+                 history_limit: Optional[int] = None):
+        if act_mode not in ACT_MODES:
+            raise ValueError(f"未知的act_mode: {act_mode}，可选值为{ACT_MODES}")
         self.name = name
         self.role = role
         self.traits = traits
-        self.api_client = self._initialize_api_client()
-        self.conversation_history = []  # 保存对话历史
-        
+        self.act_mode = act_mode
+        self._api_client = api_client
+        self._async_api_client = async_api_client
+        self.history_limit = history_limit
+        # 保存对话历史，最多保留最近history_limit个回应（None表示不限制）
+        self.conversation_history = TurnHistory(history_limit)
+
     def _initialize_api_client(self) -> OpenAI:
-        """初始化LLM客户端"""
-        return OpenAI(
-            api_key="",#选取合适的API密钥，如deepseek，通义千问，azure openai...
-            base_url="#",#选取合适的模型地址，如https://api.openai.com/v1/chat/completions
-        )
-    
+        """获取进程内共享的LLM客户端，API密钥和模型地址在config.ini的[OpenAI]段或环境变量中配置"""
+        return get_client()
+
+    @property
+    def api_client(self) -> OpenAI:
+        """未注入客户端时在第一次调用时才获取共享的客户端，没有配置API密钥也可以创建智能体"""
+        if self._api_client is None:
+            return self._initialize_api_client()
+        return self._api_client
+
+    @api_client.setter
+    def api_client(self, client: OpenAI):
+        self._api_client = client
+
+    @property
+    def async_api_client(self) -> AsyncOpenAI:
+        """未注入异步客户端时使用当前事件循环共享的客户端"""
+        if self._async_api_client is None:
+            return get_async_client()
+        return self._async_api_client
+
+    @async_api_client.setter
+    def async_api_client(self, client: AsyncOpenAI):
+        self._async_api_client = client
+
+    def to_dict(self) -> Dict[str, Any]:
+        """导出重建智能体所需的状态，用于世界的检查点"""
+        return {
+            "type": f"{type(self).__module__}:{type(self).__qualname__}",
+            "name": self.name,
+            "role": self.role,
+            "traits": self.traits,
+            "act_mode": self.act_mode,
+            "history_limit": self.history_limit,
+            "conversation_history": self.conversation_history.to_list(),
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any], **kwargs) -> "BaseAgent":
+        """根据to_dict导出的状态重建智能体，kwargs会传给构造函数（例如注入的LLM客户端）。
+
+        默认把data和kwargs中与构造函数参数同名的字段（name、role、traits、act_mode等）传给构造函数，再恢复对话历史；
+        构造参数与to_dict的字段对应不上的子类需要覆盖此方法。"""
+        parameters = inspect.signature(cls.__init__).parameters
+        accepts_any = any(parameter.kind is inspect.Parameter.VAR_KEYWORD for parameter in parameters.values())
+        options = {key: value for key, value in dict(data, **kwargs).items()
+                   if key not in ("self", "type", "conversation_history") and (accepts_any or key in parameters)}
+        agent = cls(**options)
+        agent.conversation_history.extend(data.get("conversation_history", []))
+        return agent
+
     @abstractmethod
     def think(self, scene: str, context: Dict[str, Any]) -> str:
         """根据场景和上下文生成思考过程"""
         pass
-    
+
     @abstractmethod
     def speak1(self, scene: str, context: Dict[str, Any]) -> str:
         """根据场景和上下文生成对话内容"""
@@ -33,22 +139,145 @@ class BaseAgent(ABC):
     def behavior(self, scene: str, context: Dict[str, Any]) -> str:
 
         pass
-    
+
+    # 异步接口默认在线程中执行同步方法，子类可覆盖为原生异步实现
+    async def athink(self, scene: str, context: Dict[str, Any]) -> str:
+        return await asyncio.to_thread(self.think, scene, context)
+
+    async def aspeak1(self, scene: str, context: Dict[str, Any]) -> str:
+        return await asyncio.to_thread(self.speak1, scene, context)
+
+    async def abehavior(self, scene: str, context: Dict[str, Any]) -> str:
+        return await asyncio.to_thread(self.behavior, scene, context)
+
+    # 流式接口默认整段返回，子类可覆盖为逐token输出
+    def stream_think(self, scene: str, context: Dict[str, Any]) -> Iterator[str]:
+        yield self.think(scene, context)
+
+    def stream_speak1(self, scene: str, context: Dict[str, Any]) -> Iterator[str]:
+        yield self.speak1(scene, context)
+
+    def stream_behavior(self, scene: str, context: Dict[str, Any]) -> Iterator[str]:
+        yield self.behavior(scene, context)
+
+    async def astream_think(self, scene: str, context: Dict[str, Any]) -> AsyncIterator[str]:
+        yield await self.athink(scene, context)
+
+    async def astream_speak1(self, scene: str, context: Dict[str, Any]) -> AsyncIterator[str]:
+        yield await self.aspeak1(scene, context)
+
+    async def astream_behavior(self, scene: str, context: Dict[str, Any]) -> AsyncIterator[str]:
+        yield await self.abehavior(scene, context)
+
+    def structured_turn(self, scene: str, context: Dict[str, Any]) -> Dict[str, str]:
+        """一次生成thought/speech/action三个字段，默认依次调用三个方法，子类可覆盖为单次调用"""
+        return {
+            "thought": self.think(scene, context),
+            "speech": self.speak1(scene, context),
+            "action": self.behavior(scene, context),
+        }
+
+    async def astructured_turn(self, scene: str, context: Dict[str, Any]) -> Dict[str, str]:
+        return await asyncio.to_thread(self.structured_turn, scene, context)
+
     def act(self, round_num: int, scene: str, context: Dict[str, Any]) -> Dict[str, str]:
         """执行完整动作流程"""
-        thought = self.think(scene, context)
-        speech = self.speak1(scene, context)
-        action = self.behavior(scene, context)
-        
+        errors = {}
+        if self.act_mode == "structured":
+            fields = self.structured_turn(scene, context)
+            thought, speech, action = fields["thought"], fields["speech"], fields["action"]
+        elif self.act_mode == "concurrent":
+            thought, speech, action = self._act_concurrently(scene, context, errors)
+        else:
+            thought = self.think(scene, context)
+            speech = self.speak1(scene, context)
+            action = self.behavior(scene, context)
+        return self._build_response(round_num, thought, speech, action, errors)
+
+    async def aact(self, round_num: int, scene: str, context: Dict[str, Any]) -> Dict[str, str]:
+        """act的异步版本"""
+        errors = {}
+        if self.act_mode == "structured":
+            fields = await self.astructured_turn(scene, context)
+            thought, speech, action = fields["thought"], fields["speech"], fields["action"]
+        elif self.act_mode == "concurrent":
+            outcomes = await asyncio.gather(
+                self.athink(scene, context),
+                self.aspeak1(scene, context),
+                self.abehavior(scene, context),
+                return_exceptions=True,
+            )
+            thought, speech, action = self._collect_results(outcomes, errors)
+        else:
+            thought = await self.athink(scene, context)
+            speech = await self.aspeak1(scene, context)
+            action = await self.abehavior(scene, context)
+        return self._build_response(round_num, thought, speech, action, errors)
+
+    def act_stream(self, round_num: int, scene: str, context: Dict[str, Any]) -> Iterator[Tuple[str, Any]]:
+        """流式执行完整动作流程。
+
+        依次产出(字段, 增量文本)，字段为thought/speech/action；最后产出("response", 响应字典)，
+        响应字典与act的返回值一致。流式模式下三个调用按顺序执行，保证输出不交错。"""
+        streams = (("thought", self.stream_think), ("speech", self.stream_speak1), ("action", self.stream_behavior))
+        texts = []
+        for field, stream in streams:
+            pieces = []
+            for delta in stream(scene, context):
+                pieces.append(delta)
+                yield field, delta
+            texts.append("".join(pieces))
+        yield "response", self._build_response(round_num, *texts, {})
+
+    async def aact_stream(self, round_num: int, scene: str,
+                          context: Dict[str, Any]) -> AsyncIterator[Tuple[str, Any]]:
+        """act_stream的异步版本"""
+        streams = (("thought", self.astream_think), ("speech", self.astream_speak1),
+                   ("action", self.astream_behavior))
+        texts = []
+        for field, stream in streams:
+            pieces = []
+            async for delta in stream(scene, context):
+                pieces.append(delta)
+                yield field, delta
+            texts.append("".join(pieces))
+        yield "response", self._build_response(round_num, *texts, {})
+
+    def _build_response(self, round_num: int, thought: str, speech: str, action: str,
+                        errors: Dict[str, str]) -> Dict[str, str]:
         # 构建完整响应
-        response = {
-            "agent": self.name,
-            "round": round_num,
-            "thought": thought,
-            "speech": speech,
-            "action": action
-        }
-        
+        response = Turn(self.name, round_num, thought, speech, action)
+        if errors:
+            response["errors"] = errors
+
         # 更新对话历史
         self.conversation_history.append(response)
-        return response
\ No newline at end of file
+        return response
+
+    def _act_concurrently(self, scene: str, context: Dict[str, Any], errors: Dict[str, str]) -> List[str]:
+        """并发调用think/speak1/behavior，结果按固定顺序返回。
+
+        三个调用互不依赖，同时发出后单轮耗时约等于最慢的一次调用。
+        某个调用失败时对应字段置为空字符串，异常信息记录到errors中，不影响其余两个结果。"""
+        calls = [self.think, self.speak1, self.behavior]
+        with ThreadPoolExecutor(max_workers=len(calls)) as pool:
+            futures = [pool.submit(bind_context(method), scene, context) for method in calls]
+        outcomes = []
+        for future in futures:
+            try:
+                outcomes.append(future.result())
+            except Exception as e:
+                outcomes.append(e)
+        return self._collect_results(outcomes, errors)
+
+    @staticmethod
+    def _collect_results(outcomes: List[Any], errors: Dict[str, str]) -> List[str]:
+        """按thought/speech/action的顺序整理并发调用结果，失败项置为空字符串"""
+        results = []
+        for field, outcome in zip(("thought", "speech", "action"), outcomes):
+            if isinstance(outcome, BaseException):
+                errors[field] = f"{type(outcome).__name__}: {outcome}"
+                results.append("")
+            else:
+                results.append(outcome)
+        return results
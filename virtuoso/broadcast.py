@@ -0,0 +1,145 @@
+from typing import List, Dict, Any, Optional, Iterator, AsyncIterator
+import os
+import csv
+import time
+import asyncio
+import warnings
+import contextvars
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, asdict, fields
+from .tinyperson import TinyPerson
+from .llmclient import coalesce_requests, RequestCoalescer
+
+
+@dataclass
+class BroadcastAnswer:
+    """一个智能体对广播问题的回答；失败时answer为None，error为异常信息"""
+    index: int  # 智能体在agents中的下标
+    agent: str
+    role: str
+    stimulus: str
+    answer: Optional[str]
+    error: Optional[str]
+    latency: float
+
+
+COLUMNS = [item.name for item in fields(BroadcastAnswer)]
+
+
+class AnswerWriter:
+    """把回答按列写入文件：.parquet使用pyarrow按批写入行组（未安装pyarrow时改为同名的.csv），其他扩展名写CSV"""
+    def __init__(self, path: str, batch_size: int = 1000):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.batch_size = batch_size
+        self._rows: List[Dict[str, Any]] = []
+        self._parquet = None
+        self._csv = None
+        if path.endswith(".parquet"):
+            try:
+                import pyarrow
+                import pyarrow.parquet
+            except ImportError:
+                path = path[:-len(".parquet")] + ".csv"
+                warnings.warn(f"未安装pyarrow，回答改为写入{path}")
+            else:
+                self._pyarrow = pyarrow
+                self._schema = pyarrow.schema([
+                    ("index", pyarrow.int64()), ("agent", pyarrow.string()), ("role", pyarrow.string()),
+                    ("stimulus", pyarrow.string()), ("answer", pyarrow.string()), ("error", pyarrow.string()),
+                    ("latency", pyarrow.float64())])
+                self._parquet = pyarrow.parquet.ParquetWriter(path, self._schema)
+        self.path = path
+        if self._parquet is None:
+            self._file = open(path, "w", encoding="utf-8", newline="")
+            self._csv = csv.DictWriter(self._file, fieldnames=COLUMNS)
+            self._csv.writeheader()
+
+    def write(self, answer: BroadcastAnswer):
+        if self._csv is not None:
+            self._csv.writerow(asdict(answer))
+            self._file.flush()
+            return
+        self._rows.append(asdict(answer))
+        if len(self._rows) >= self.batch_size:
+            self._flush()
+
+    def _flush(self):
+        if self._rows:
+            self._parquet.write_table(self._pyarrow.Table.from_pylist(self._rows, schema=self._schema))
+            self._rows = []
+
+    def close(self):
+        if self._parquet is not None:
+            self._flush()
+            self._parquet.close()
+        elif not self._file.closed:
+            self._file.close()
+
+
+def _ask(index: int, agent: TinyPerson, stimulus: str) -> BroadcastAnswer:
+    started = time.perf_counter()
+    try:
+        answer, error = agent.listen_and_act(stimulus), None
+    except Exception as e:
+        answer, error = None, f"{type(e).__name__}: {e}"
+    return BroadcastAnswer(index, agent.name, agent.role, stimulus, answer, error, time.perf_counter() - started)
+
+
+def broadcast(stimulus: str, agents: List[TinyPerson], concurrency: int = 8, output: Optional[str] = None,
+              dedupe: bool = True) -> Iterator[BroadcastAnswer]:
+    """把同一个问题发给所有智能体（listen_and_act），按完成顺序逐个产出回答。
+
+    - concurrency：同时进行的调用数；所有调用仍经过进程共享的限流器（config.ini的RPM_LIMIT/TPM_LIMIT）
+    - output：同时把回答写入该文件，见AnswerWriter
+    - dedupe：提示词完全相同的智能体（角色设定相同且没有不同的记忆）只调用一次LLM，共享同一个回答；
+      已完成的回答在本次广播内一直保留，与并发数无关
+    单个智能体失败不影响其他智能体，失败的回答error不为None。提前停止迭代时尚未开始的调用会被取消。"""
+    writer = AnswerWriter(output) if output else None
+    pool = ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(agents))))
+    try:
+        with coalesce_requests(RequestCoalescer(keep_completed=True)) if dedupe else nullcontext():
+            futures = [pool.submit(contextvars.copy_context().run, _ask, index, agent, stimulus)
+                       for index, agent in enumerate(agents)]
+        for future in as_completed(futures):
+            answer = future.result()
+            if writer is not None:
+                writer.write(answer)
+            yield answer
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+        if writer is not None:
+            writer.close()
+
+
+async def abroadcast(stimulus: str, agents: List[TinyPerson], concurrency: int = 8, output: Optional[str] = None,
+                     dedupe: bool = True) -> AsyncIterator[BroadcastAnswer]:
+    """broadcast的异步版本，使用alisten_and_act"""
+    writer = AnswerWriter(output) if output else None
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def ask(index: int, agent: TinyPerson) -> BroadcastAnswer:
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                answer, error = await agent.alisten_and_act(stimulus), None
+            except Exception as e:
+                answer, error = None, f"{type(e).__name__}: {e}"
+            return BroadcastAnswer(index, agent.name, agent.role, stimulus, answer, error,
+                                   time.perf_counter() - started)
+
+    with coalesce_requests(RequestCoalescer(keep_completed=True)) if dedupe else nullcontext():
+        tasks = [asyncio.ensure_future(ask(index, agent)) for index, agent in enumerate(agents)]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            answer = await next_done
+            if writer is not None:
+                writer.write(answer)
+            yield answer
+    finally:
+        for task in tasks:
+            task.cancel()
+        if writer is not None:
+            writer.close()
@@ -0,0 +1,69 @@
+from typing import Dict, Any, Optional
+import time
+import asyncio
+from datetime import datetime, timedelta
+
+
+class Clock:
+    """TinyWorld的时钟：决定轮与轮之间是否等待，以及写入对话记录的时间戳"""
+    def now(self) -> datetime:
+        return datetime.now()
+
+    def pace(self):
+        """一轮结束后调用"""
+        pass
+
+    async def apace(self):
+        pass
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"type": "nodelay"}
+
+
+class RealTimeClock(Clock):
+    """实时节奏：每轮结束后真实等待interval秒，适合演示"""
+    def __init__(self, interval: float = 1.0):
+        self.interval = interval
+
+    def pace(self):
+        if self.interval > 0:
+            time.sleep(self.interval)
+
+    async def apace(self):
+        if self.interval > 0:
+            await asyncio.sleep(self.interval)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"type": "realtime", "interval": self.interval}
+
+
+class NoDelayClock(Clock):
+    """批量运行：从不等待，时间戳使用真实时间"""
+
+
+class SimulatedClock(Clock):
+    """虚拟时钟：从不等待，每轮结束后模拟时间前进step，时间戳使用模拟时间，同样的输入得到同样的记录"""
+    def __init__(self, start: Optional[datetime] = None, step: timedelta = timedelta(minutes=1)):
+        self.current = start or datetime(2000, 1, 1)
+        self.step = step
+
+    def now(self) -> datetime:
+        return self.current
+
+    def pace(self):
+        self.current += self.step
+
+    async def apace(self):
+        self.pace()
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"type": "simulated", "current": self.current.isoformat(), "step": self.step.total_seconds()}
+
+
+def clock_from_dict(data: Dict[str, Any]) -> Clock:
+    """根据Clock.to_dict的结果重建时钟，用于从检查点恢复"""
+    if data["type"] == "realtime":
+        return RealTimeClock(data["interval"])
+    if data["type"] == "simulated":
+        return SimulatedClock(datetime.fromisoformat(data["current"]), timedelta(seconds=data["step"]))
+    return NoDelayClock()
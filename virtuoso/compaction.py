@@ -0,0 +1,145 @@
+from typing import List, Dict, Any, Optional
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+from openai import OpenAI
+from .llmclient import get_client, create_chat_completion
+from .contextbuilder import estimate_tokens, parse_shared_key
+from .metrics import bind_context
+
+
+def _format_rounds(rounds: List[Dict[str, Any]], agent_name: Optional[str] = None) -> str:
+    """把若干轮对话整理为摘要用的文本；指定agent_name时包含该智能体的完整回应和其他人的发言"""
+    lines = []
+    for round_data in rounds:
+        lines.append(f"第{round_data['round']}轮：")
+        for turn in round_data["results"]:
+            if agent_name is None or turn["agent"] != agent_name:
+                lines.append(f"{turn['agent']}说：{turn['speech']}；行动：{turn['action']}")
+            else:
+                lines.append(f"我的思考：{turn['thought']}；我说：{turn['speech']}；我的行动：{turn['action']}")
+    return "\n".join(lines)
+
+
+class Summarizer:
+    """用LLM把旧的摘要和新的若干轮对话合并为新的摘要"""
+    def __init__(self, api_client: Optional[OpenAI] = None, model: str = "qwen-plus", max_tokens: int = 800):
+        self.api_client = api_client
+        self.model = model
+        self.max_tokens = max_tokens
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"model": self.model, "max_tokens": self.max_tokens}
+
+    def summarize(self, scene: str, previous: str, rounds: List[Dict[str, Any]],
+                  agent_name: Optional[str] = None) -> str:
+        if agent_name is None:
+            focus = "请概括整个故事到目前为止的主要情节、各角色的立场和关系变化、尚未解决的问题。"
+        else:
+            focus = f"请以{agent_name}的视角概括其到目前为止的经历、想法、做过的事和对其他人的看法。"
+        prompt = f"""当前场景是：{scene}
+        已有的摘要：{previous or '（无）'}
+
+        新发生的对话：
+{_format_rounds(rounds, agent_name)}
+
+        {focus}把已有的摘要和新发生的对话合并为一份简洁的摘要，保留关键事实和人物名字，不超过300字。"""
+        response = create_chat_completion(
+            self.api_client or get_client(), agent=agent_name, method="summarize",
+            round_num=rounds[-1]["round"] if rounds else None,
+            model=self.model, messages=[{"role": "user", "content": prompt}],
+            temperature=0.3, max_tokens=self.max_tokens)
+        return response.choices[0].message.content.strip()
+
+
+def _visible_rounds(rounds: List[Dict[str, Any]], visible: Optional[List[str]]) -> List[Dict[str, Any]]:
+    """只保留visible中智能体的回应，visible为None时原样返回"""
+    if visible is None:
+        return rounds
+    return [dict(round_data, results=[turn for turn in round_data["results"] if turn["agent"] in visible])
+            for round_data in rounds]
+
+
+class Compactor:
+    """TinyWorld的滚动压缩：把较早的轮次合并进摘要，原始回应从内存中移除（完整记录由transcript_sinks落盘）。
+
+    - every：每隔多少轮压缩一次
+    - token_threshold：待压缩轮次的估算token数超过该值时也立即压缩
+    - keep_rounds：保留原文的最近轮数，默认与世界的memory_window相同
+    - per_agent：除全局摘要外，是否为每个智能体生成自己视角的摘要（每次压缩额外调用智能体数次LLM）
+    世界的拓扑只让智能体看到部分人的发言时，每个智能体的摘要只包含其可见的回应，并且总是生成（全局摘要不放进智能体的上下文）。
+    世界没有transcript_sinks时context["history"]中的原始轮次不移除，避免丢失唯一的完整记录。
+    摘要失败时发出警告并保留待压缩的轮次，之后再次尝试。
+    摘要保存在world.context["digest"]中，与压缩参数一起随检查点保存，恢复后继续按同样的参数压缩。"""
+    def __init__(self, summarizer: Optional[Summarizer] = None, every: int = 10,
+                 token_threshold: Optional[int] = None, keep_rounds: Optional[int] = None,
+                 per_agent: bool = True, max_workers: int = 8):
+        self.summarizer = summarizer or Summarizer()
+        self.every = every
+        self.token_threshold = token_threshold
+        self.keep_rounds = keep_rounds
+        self.per_agent = per_agent
+        self.max_workers = max_workers
+
+    def to_dict(self) -> Dict[str, Any]:
+        """压缩参数，与摘要（在world.context中）一起保存到检查点；注入的LLM客户端不会保存"""
+        return {"summarizer": self.summarizer.to_dict(), "every": self.every,
+                "token_threshold": self.token_threshold, "keep_rounds": self.keep_rounds,
+                "per_agent": self.per_agent, "max_workers": self.max_workers}
+
+    def _pending_rounds(self, world) -> List[Dict[str, Any]]:
+        """已经离开保留窗口、尚未压缩的轮次"""
+        keep = world.memory_window if self.keep_rounds is None else self.keep_rounds
+        through = world.context.get("digest", {}).get("through_round", 0)
+        return [round_data for round_data in world.context["history"]
+                if through < round_data["round"] <= world.rounds - keep]
+
+    def should_compact(self, world) -> bool:
+        pending = self._pending_rounds(world)
+        if not pending:
+            return False
+        if self.every and world.rounds % self.every == 0:
+            return True
+        return self.token_threshold is not None and estimate_tokens(str(pending)) > self.token_threshold
+
+    def compact(self, world):
+        """把待压缩的轮次合并进摘要，并从shared_memory、各智能体的conversation_history以及（有transcript_sinks时）history中移除"""
+        pending = self._pending_rounds(world)
+        if not pending:
+            return
+        digest = world.context.setdefault("digest", {"global": "", "agents": {}, "through_round": 0})
+        jobs = {None: digest["global"]}
+        if self.per_agent or world.topology.sparse:
+            jobs.update({agent.name: digest["agents"].get(agent.name, "") for agent in world.agents})
+
+        def summarize(name: Optional[str]) -> str:
+            rounds = pending if name is None else _visible_rounds(pending, world.topology.visible(name))
+            return self.summarizer.summarize(world.scene, jobs[name], rounds, name)
+
+        try:
+            with ThreadPoolExecutor(max_workers=min(self.max_workers, len(jobs))) as pool:
+                summaries = dict(zip(jobs, pool.map(bind_context(summarize), jobs)))
+        except Exception as e:
+            warnings.warn(f"压缩第{pending[0]['round']}-{pending[-1]['round']}轮失败，保留原文稍后重试："
+                          f"{type(e).__name__}: {e}")
+            return
+
+        through = pending[-1]["round"]
+        digest["global"] = summaries.pop(None)
+        digest["agents"].update(summaries)
+        digest["through_round"] = through
+        if world.transcript_sinks:
+            world.context["history"] = [round_data for round_data in world.context["history"]
+                                        if round_data["round"] > through]
+        shared_memory = world.context["shared_memory"]
+        for key in [key for key in shared_memory if (parse_shared_key(key) or (None, through + 1))[1] <= through]:
+            del shared_memory[key]
+        for agent in world.agents:
+            agent.conversation_history.retain(lambda turn: turn.get("round", through + 1) > through)
+        world.discard_unreferenced_turns()
+
+
+def compactor_from_dict(data: Dict[str, Any]) -> Compactor:
+    """根据Compactor.to_dict的结果重建压缩器，用于从检查点恢复"""
+    options = dict(data)
+    options["summarizer"] = Summarizer(**options.get("summarizer", {}))
+    return Compactor(**options)
@@ -0,0 +1,104 @@
+from typing import List, Dict, Any, Optional, Tuple
+import re
+
+# TinyWorld写入shared_memory的键格式：{agent}_contribution_{round} / {agent}_action_{round}
+_SHARED_KEY = re.compile(r"^(?P<agent>.*)_(?:contribution|action)_(?P<round>\d+)$")
+_CJK = re.compile(r"[⺀-鿿豈-﫿＀-￯]")
+# 回应中不进入提示词的字段：时间戳每次运行都不同，会让提示词无法命中响应缓存
+_NON_PROMPT_FIELDS = ("timestamp",)
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("cl100k_base")
+except Exception:  # tiktoken未安装或无法加载编码表时使用估算
+    _encoding = None
+
+
+def parse_shared_key(key: str) -> Optional[Tuple[str, int]]:
+    """解析TinyWorld写入shared_memory的键，返回(智能体名, 轮次)；其他键返回None"""
+    match = _SHARED_KEY.match(key)
+    return (match.group("agent"), int(match.group("round"))) if match else None
+
+
+def _prompt_turn(turn: Dict[str, Any]) -> Dict[str, Any]:
+    """去掉不进入提示词的字段"""
+    if not any(field in turn for field in _NON_PROMPT_FIELDS):
+        return turn
+    return {key: value for key, value in turn.items() if key not in _NON_PROMPT_FIELDS}
+
+
+def estimate_tokens(text: str) -> int:
+    """估算文本的token数：安装了tiktoken时精确计数，否则中日韩字符按1个、其余字符按4个折算1个"""
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    cjk = len(_CJK.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+class ContextBuilder:
+    """为每个智能体构建有界的上下文，避免提示词随轮数和人数无限增长。
+
+    - 窗口：shared_memory只保留最近memory_window轮的条目（recent_history本身已按窗口截取）
+    - 相关性：relevant_only=True时，只保留智能体自己的条目、提到该智能体名字的条目以及最近一轮的条目
+    - 预算：设置token_budget后，按从旧到新、从不相关到相关的顺序丢弃条目，直到估算的token数不超过预算
+    无法解析出轮次的shared_memory条目（例如手动写入的键）总是保留；回应的timestamp不进入上下文，保证重放时提示词不变。"""
+    def __init__(self, memory_window: int = 3, token_budget: Optional[int] = None,
+                 relevant_only: bool = False):
+        self.memory_window = memory_window
+        self.token_budget = token_budget
+        self.relevant_only = relevant_only
+
+    def build(self, context: Dict[str, Any], agent_name: Optional[str] = None) -> Dict[str, Any]:
+        """根据世界的当前轮次上下文构建某个智能体的上下文，返回新字典，不修改传入的上下文"""
+        round_num = context.get("round", 0)
+        oldest_round = round_num - self.memory_window
+        shared_memory = {}
+        candidates: List[Tuple[int, int, str, Any]] = []  # (轮次, 相关性, 类型, 标识)
+        for key, value in context.get("shared_memory", {}).items():
+            match = _SHARED_KEY.match(key)
+            if match is None:
+                shared_memory[key] = value
+                continue
+            entry_round = int(match.group("round"))
+            if entry_round < oldest_round:
+                continue
+            relevant = agent_name is None or self._is_relevant(
+                match.group("agent"), str(value), entry_round, round_num, agent_name)
+            if self.relevant_only and not relevant:
+                continue
+            shared_memory[key] = value
+            candidates.append((entry_round, int(relevant), "shared", key))
+
+        recent_history = [dict(round_data, results=[_prompt_turn(turn) for turn in round_data.get("results", [])])
+                          for round_data in context.get("recent_history", [])]
+        for index, round_data in enumerate(recent_history):
+            candidates.append((round_data.get("round", 0), 1, "history", index))
+
+        bounded = dict(context, shared_memory=shared_memory, recent_history=recent_history)
+        if self.token_budget is not None:
+            self._apply_budget(bounded, candidates)
+        return bounded
+
+    @staticmethod
+    def _is_relevant(author: str, text: str, entry_round: int, round_num: int, agent_name: str) -> bool:
+        return author == agent_name or agent_name in text or entry_round >= round_num - 1
+
+    def _apply_budget(self, context: Dict[str, Any], candidates: List[Tuple[int, int, str, Any]]):
+        """按优先级从低到高丢弃条目，直到上下文的估算token数不超过预算"""
+        total = estimate_tokens(str(context))
+        if total <= self.token_budget:
+            return
+        dropped_rounds = set()
+        history = context["recent_history"]
+        for entry_round, _, kind, ident in sorted(candidates, key=lambda c: (c[0], c[1], c[2] == "history")):
+            if total <= self.token_budget:
+                break
+            if kind == "shared":
+                total -= estimate_tokens(f"{ident!r}: {context['shared_memory'][ident]!r}, ")
+                del context["shared_memory"][ident]
+            else:
+                total -= estimate_tokens(f"{history[ident]!r}, ")
+                dropped_rounds.add(ident)
+        if dropped_rounds:
+            context["recent_history"] = [round_data for index, round_data in enumerate(history)
+                                         if index not in dropped_rounds]
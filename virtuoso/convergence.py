@@ -0,0 +1,142 @@
+from typing import List, Dict, Any, Optional, Callable, Set, Tuple
+import re
+from collections import deque
+import numpy as np
+
+_UNSET = object()
+_TOKEN = re.compile(r"[a-zA-Z0-9_]+|[⺀-鿿豈-﫿]")
+
+# 停止原因
+CONVERGED = "converged"  # 连续多轮的新颖度低于阈值
+GOAL = "goal"  # 目标判定函数返回True
+STALLED = "stalled"  # 本轮所有发言人都因为没有新内容而跳过
+
+
+def ngrams(text: str, n: int = 2) -> Set[Tuple[str, ...]]:
+    """文本的n-gram集合：中日韩字符按单字切分，其他按单词切分并转为小写；不足n个词时整段作为一个n-gram"""
+    tokens = [token.lower() for token in _TOKEN.findall(text)]
+    if len(tokens) < n:
+        return {tuple(tokens)} if tokens else set()
+    return {tuple(tokens[i:i + n]) for i in range(len(tokens) - n + 1)}
+
+
+class ConvergenceMonitor:
+    """判断对话是否已经收敛或停滞，供TinyWorld提前结束运行或让没有新内容的智能体跳过发言。
+
+    每轮结束后计算每个发言相对于之前window轮以及本轮更早发言的新颖度：
+    默认为发言的n-gram（中文按字的二元组）中没有出现过的比例，设置embedder（例如memory.HashingEmbedder）时为1减去与这些发言的最大余弦相似度。
+    - 观察满min_rounds轮后，连续patience轮的平均新颖度低于threshold时停止，原因为"converged"
+    - goal(world, round_results)返回True时停止，原因为"goal"
+    - quiet_threshold不为None时，新颖度低于它的智能体跳过接下来skip_rounds轮；某轮所有发言人都要跳过时停止，原因为"stalled"
+    参数和运行状态（最近window轮的发言、计数和跳过记录）随世界的检查点保存，goal和embedder需要恢复时重新传入。"""
+    def __init__(self, threshold: float = 0.3, window: int = 3, n: int = 2, patience: int = 2,
+                 min_rounds: int = 2, goal: Optional[Callable[[Any, List[Dict[str, Any]]], bool]] = None,
+                 quiet_threshold: Optional[float] = None, skip_rounds: int = 1, embedder=None):
+        self.threshold = threshold
+        self.window = window
+        self.n = n
+        self.patience = patience
+        self.min_rounds = min_rounds
+        self.goal = goal
+        self.quiet_threshold = quiet_threshold
+        self.skip_rounds = skip_rounds
+        self.embedder = embedder
+        self.history: List[Dict[str, Any]] = []  # 每轮的{"round", "novelty", "quiet"}
+        self.last_scores: Dict[str, float] = {}  # 最近一轮每个发言人的新颖度
+        self._recent: deque = deque(maxlen=window)  # 之前几轮发言的特征
+        self._recent_speeches: deque = deque(maxlen=window)  # 对应的发言原文，保存到检查点
+        self._seeded = False
+        self._low_rounds = 0
+        self._skip_until: Dict[str, int] = {}
+
+    def _features(self, speeches: List[str]) -> Any:
+        if self.embedder is not None:
+            return self.embedder.embed(speeches) if speeches else None
+        return [ngrams(speech, self.n) for speech in speeches]
+
+    def _scores(self, features: Any) -> List[float]:
+        """按顺序计算每个发言的新颖度，更早的发言（包括本轮）作为参照"""
+        if self.embedder is not None:
+            previous = [matrix for matrix in self._recent if matrix is not None]
+            seen = np.vstack(previous) if previous else np.zeros((0, 0), dtype=np.float32)
+            scores = []
+            for row, vector in enumerate(features if features is not None else []):
+                reference = np.vstack([seen, features[:row]]) if len(seen) else features[:row]
+                similarity = float(np.max(reference @ vector)) if len(reference) else 0.0
+                scores.append(max(0.0, 1.0 - similarity))
+            return scores
+        seen = set().union(*(grams for previous in self._recent for grams in previous))
+        scores = []
+        for grams in features:
+            scores.append(len(grams - seen) / len(grams) if grams else 0.0)
+            seen |= grams
+        return scores
+
+    def _remember(self, speeches: List[str], features: Any = _UNSET):
+        self._recent_speeches.append(speeches)
+        self._recent.append(self._features(speeches) if features is _UNSET else features)
+
+    def _seed(self, world):
+        """第一次观察时用世界中保留的之前几轮初始化参照（例如监控是在世界运行了几轮之后才设置的）"""
+        self._seeded = True
+        for round_data in world.context["history"][:-1][-self.window:]:
+            self._remember([turn["speech"] or "" for turn in round_data["results"]])
+
+    def observe(self, world, round_num: int, round_results: List[Dict[str, Any]]) -> Optional[str]:
+        """一轮结束后调用，返回停止原因，不需要停止时返回None"""
+        if not self._seeded:
+            self._seed(world)
+        speeches = [turn["speech"] or "" for turn in round_results]
+        features = self._features(speeches)
+        scores = self._scores(features)
+        self._remember(speeches, features)
+        self.last_scores = {turn["agent"]: score for turn, score in zip(round_results, scores)}
+        novelty = sum(scores) / len(scores) if scores else 0.0
+        quiet = []
+        if self.quiet_threshold is not None:
+            quiet = [name for name, score in self.last_scores.items() if score < self.quiet_threshold]
+            for name in quiet:
+                self._skip_until[name] = round_num + self.skip_rounds
+        self.history.append({"round": round_num, "novelty": novelty, "quiet": quiet})
+
+        if self.goal is not None and self.goal(world, round_results):
+            return GOAL
+        self._low_rounds = self._low_rounds + 1 if novelty < self.threshold else 0
+        if len(self.history) >= self.min_rounds and self._low_rounds >= self.patience:
+            return CONVERGED
+        return None
+
+    def skips(self, agent_name: str, round_num: int) -> bool:
+        """该智能体本轮是否因为上次发言没有新内容而跳过"""
+        return self._skip_until.get(agent_name, 0) >= round_num
+
+    def to_dict(self) -> Dict[str, Any]:
+        """参数和运行状态，用于世界的检查点（goal和embedder不保存）"""
+        return {"threshold": self.threshold, "window": self.window, "n": self.n, "patience": self.patience,
+                "min_rounds": self.min_rounds, "quiet_threshold": self.quiet_threshold,
+                "skip_rounds": self.skip_rounds,
+                "state": {"history": self.history, "last_scores": self.last_scores,
+                          "recent": list(self._recent_speeches), "low_rounds": self._low_rounds,
+                          "skip_until": self._skip_until}}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any], **kwargs) -> "ConvergenceMonitor":
+        """根据to_dict的结果重建监控，kwargs会传给构造函数（例如goal、embedder）"""
+        options = {key: value for key, value in data.items() if key != "state"}
+        options.update(kwargs)
+        monitor = cls(**options)
+        monitor.load_state(data.get("state", {}))
+        return monitor
+
+    def load_state(self, state: Dict[str, Any]):
+        """恢复to_dict保存的运行状态，最近几轮发言的特征按当前的n或embedder重新计算"""
+        self.history = list(state.get("history", []))
+        self.last_scores = dict(state.get("last_scores", {}))
+        self._low_rounds = state.get("low_rounds", 0)
+        self._skip_until = dict(state.get("skip_until", {}))
+        if "recent" in state:
+            self._recent.clear()
+            self._recent_speeches.clear()
+            for speeches in state["recent"]:
+                self._remember(speeches)
+            self._seeded = True
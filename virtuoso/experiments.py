@@ -0,0 +1,436 @@
+from typing import List, Dict, Any, Optional, Callable
+import os
+import re
+import sys
+import json
+import time
+import random
+import socket
+import argparse
+import itertools
+import traceback
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field, asdict
+from .tinyperson import TinyPerson
+from .tinyworld import TinyWorld
+from .clock import NoDelayClock
+from .turntaking import turn_policy_from_dict
+from .topology import topology_from_dict
+from .convergence import ConvergenceMonitor
+from .transcript import JsonlTranscriptSink
+from .metrics import Subscriber, MetricsCollector
+from .baseagent import set_async_concurrency_limit
+from .llmclient import set_sync_concurrency_limit
+from .ratelimit import RateLimiter, configure_rate_limits, get_retry_policy
+
+# 网格文件中world段允许的TinyWorld参数
+WORLD_OPTIONS = ("memory_window", "scheduler", "max_concurrency", "keep_full_history", "checkpoint_every",
+                 "turn_policy", "topology", "convergence")
+# 网格文件中agent段允许的、对所有角色生效的默认参数（角色自身的设置优先）
+AGENT_OPTIONS = ("act_mode", "prompt_layout", "history_limit")
+
+
+@dataclass
+class WorldSpec:
+    """实验网格中的一个世界：场景 × 角色组 × 温度 × 随机种子"""
+    world_id: str
+    scene_name: str
+    scene: str
+    persona_set: str
+    personas: List[Dict[str, Any]]
+    temperature: float
+    seed: int
+    rounds: int
+    world_options: Dict[str, Any] = field(default_factory=dict)
+
+
+def _slug(text: str) -> str:
+    return re.sub(r"[^\w.-]+", "_", str(text)).strip("_") or "_"
+
+
+def _named(items: Any, prefix: str) -> Dict[str, Any]:
+    """网格中的场景、角色组可以写成{名字: 值}或列表，列表按下标命名"""
+    if isinstance(items, dict):
+        return dict(items)
+    return {f"{prefix}{index}": item for index, item in enumerate(items)}
+
+
+@dataclass
+class ExperimentGrid:
+    """声明式的实验网格，展开为scenes × persona_sets × temperatures × seeds个世界。
+
+    网格文件为JSON，例如：
+        {"rounds": 5,
+         "scenes": {"expo": "在一场科技产品展览会上……"},
+         "persona_sets": {"trio": ["personas/musk.json", {"name": "jack", "role": "学生", ...}]},
+         "temperatures": [0.3, 0.7, 1.0],
+         "seeds": [1, 2, 3],
+         "world": {"memory_window": 2, "scheduler": "parallel", "turn_policy": {"type": "addressed"}},
+         "agent": {"act_mode": "structured"}}
+    角色可以直接写成TinyPerson.to_dict格式的字典，也可以是这种字典的JSON文件路径（相对于网格文件）。
+    world.turn_policy、world.topology分别为TurnPolicy.to_dict、Topology.to_dict格式的发言策略和交互拓扑，
+    world.convergence为ConvergenceMonitor的参数（例如{"threshold": 0.3}），对话收敛后提前结束该世界。"""
+    scenes: Dict[str, str]
+    persona_sets: Dict[str, List[Dict[str, Any]]]
+    temperatures: List[float] = field(default_factory=lambda: [0.7])
+    seeds: List[int] = field(default_factory=lambda: [0])
+    rounds: int = 3
+    world: Dict[str, Any] = field(default_factory=dict)
+    agent: Dict[str, Any] = field(default_factory=dict)
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any], base_dir: str = ".") -> "ExperimentGrid":
+        unknown = set(data.get("world", {})) - set(WORLD_OPTIONS)
+        if unknown:
+            raise ValueError(f"world段中未知的参数: {sorted(unknown)}，可选值为{WORLD_OPTIONS}")
+        unknown = set(data.get("agent", {})) - set(AGENT_OPTIONS)
+        if unknown:
+            raise ValueError(f"agent段中未知的参数: {sorted(unknown)}，可选值为{AGENT_OPTIONS}")
+        persona_sets = {}
+        for name, personas in _named(data["persona_sets"], "personas").items():
+            persona_sets[name] = [_load_persona(persona, base_dir) for persona in personas]
+        return cls(scenes=_named(data["scenes"], "scene"), persona_sets=persona_sets,
+                   temperatures=list(data.get("temperatures", [0.7])), seeds=list(data.get("seeds", [0])),
+                   rounds=data.get("rounds", 3), world=dict(data.get("world", {})),
+                   agent=dict(data.get("agent", {})))
+
+    @classmethod
+    def from_file(cls, path: str) -> "ExperimentGrid":
+        with open(path, "r", encoding="utf-8") as f:
+            return cls.from_dict(json.load(f), base_dir=os.path.dirname(os.path.abspath(path)))
+
+    def worlds(self) -> List[WorldSpec]:
+        specs = []
+        for (scene_name, scene), (set_name, personas), temperature, seed in itertools.product(
+                self.scenes.items(), self.persona_sets.items(), self.temperatures, self.seeds):
+            world_id = f"{_slug(scene_name)}__{_slug(set_name)}__t{temperature:g}__s{seed}"
+            specs.append(WorldSpec(world_id, scene_name, scene, set_name,
+                                   [dict(self.agent, **persona) for persona in personas],
+                                   temperature, seed, self.rounds, dict(self.world)))
+        return specs
+
+
+def _load_persona(persona: Any, base_dir: str) -> Dict[str, Any]:
+    if isinstance(persona, dict):
+        return persona
+    with open(os.path.join(base_dir, persona), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _write_json(path: str, data: Dict[str, Any]):
+    """先写临时文件再替换，其他主机不会读到半个文件"""
+    tmp_path = f"{path}.{socket.gethostname()}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2, default=str)
+    os.replace(tmp_path, path)
+
+
+def _read_json(path: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+# ---------------- 认领：多个进程、多台主机通过共享结果目录分配世界 ----------------
+
+def _claim_is_abandoned(claim_path: str, stale_after: Optional[float]) -> bool:
+    """认领者是本机已退出的进程，或认领文件超过stale_after秒没有更新（运行中每轮都会更新）"""
+    owner = _read_json(claim_path) or {}
+    if owner.get("host") == socket.gethostname() and isinstance(owner.get("pid"), int):
+        try:
+            os.kill(owner["pid"], 0)
+        except ProcessLookupError:
+            return True
+        except PermissionError:
+            pass
+    if stale_after is None:
+        return False
+    try:
+        return time.time() - os.path.getmtime(claim_path) > stale_after
+    except FileNotFoundError:
+        return False
+
+
+def _take_over(claim_path: str, stale_after: Optional[float]) -> bool:
+    """把失效的认领改名移走；多个认领者同时接管时只有改名成功的一方继续"""
+    moved = f"{claim_path}.abandoned.{socket.gethostname()}.{os.getpid()}"
+    try:
+        os.rename(claim_path, moved)
+    except FileNotFoundError:
+        return False
+    if not _claim_is_abandoned(moved, stale_after):
+        # 改名前认领已被别人接管并刷新，尽量还原
+        try:
+            os.link(moved, claim_path)
+        except OSError:
+            pass
+        os.remove(moved)
+        return False
+    os.remove(moved)
+    return True
+
+
+def try_claim(directory: str, stale_after: Optional[float] = None, retry_failed: bool = False) -> bool:
+    """以O_EXCL创建认领文件，成功者负责运行该世界；已完成（或已失败且不重试）的世界不会被认领"""
+    os.makedirs(directory, exist_ok=True)
+    if os.path.exists(os.path.join(directory, "result.json")):
+        return False
+    if not retry_failed and os.path.exists(os.path.join(directory, "error.json")):
+        return False
+    claim_path = os.path.join(directory, "claim")
+    owner = {"host": socket.gethostname(), "pid": os.getpid(), "claimed_at": time.time()}
+    for _ in range(2):
+        try:
+            fd = os.open(claim_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            if _claim_is_abandoned(claim_path, stale_after) and _take_over(claim_path, stale_after):
+                continue
+            return False
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(owner, f)
+        return True
+    return False
+
+
+def release_claim(directory: str):
+    try:
+        os.remove(os.path.join(directory, "claim"))
+    except FileNotFoundError:
+        pass
+
+
+class _ClaimHeartbeat(Subscriber):
+    """每轮结束时更新认领文件的修改时间，其他主机据此判断认领是否失效"""
+    def __init__(self, claim_path: str):
+        self.claim_path = claim_path
+
+    def on_round_end(self, round_num: int, results: List[Dict[str, Any]]):
+        try:
+            os.utime(self.claim_path)
+        except FileNotFoundError:
+            pass
+
+
+# ---------------- 分片：进程池中的每个工作进程 ----------------
+
+# 当前分片（工作进程）的并发预算，由_init_shard设置
+_shard_concurrency: Optional[int] = None
+
+
+def _init_shard(concurrency: Optional[int], requests_per_minute: Optional[float],
+                tokens_per_minute: Optional[float]):
+    """工作进程初始化：设置本分片的并发上限和限流配额，同步和异步调用都受并发上限约束"""
+    global _shard_concurrency
+    _shard_concurrency = concurrency
+    set_async_concurrency_limit(concurrency)
+    set_sync_concurrency_limit(concurrency)
+    if requests_per_minute or tokens_per_minute:
+        configure_rate_limits(RateLimiter(requests_per_minute, tokens_per_minute), get_retry_policy())
+
+
+def _build_world(spec: WorldSpec, directory: str, subscribers: List[Subscriber]) -> TinyWorld:
+    """创建世界；目录中有上次中断留下的检查点时从检查点继续（对话记录中可能重复中断前最后几轮）"""
+    checkpoint_path = os.path.join(directory, "checkpoint.json.gz")
+    resuming = os.path.exists(checkpoint_path)
+    if not resuming:
+        agents = [TinyPerson.from_dict(dict(persona, temperature=spec.temperature, seed=spec.seed))
+                  for persona in spec.personas]
+    options = dict(spec.world_options, clock=NoDelayClock(), verbose=False, subscribers=subscribers,
+                   transcript_sinks=[JsonlTranscriptSink(os.path.join(directory, "transcript.jsonl"))],
+                   checkpoint_path=checkpoint_path)
+    if "turn_policy" in options:
+        options["turn_policy"] = turn_policy_from_dict(options["turn_policy"])
+    if "topology" in options:
+        options["topology"] = topology_from_dict(options["topology"])
+    if "convergence" in options:
+        options["convergence"] = ConvergenceMonitor(**options["convergence"])
+    if _shard_concurrency and spec.world_options.get("scheduler") == "parallel":
+        options.setdefault("max_concurrency", _shard_concurrency)
+    if resuming:
+        return TinyWorld.resume(checkpoint_path, **options)
+    return TinyWorld(agents, spec.scene, **options)
+
+
+def run_world(spec: WorldSpec, results_dir: str, stale_after: Optional[float] = None,
+              retry_failed: bool = False) -> Dict[str, Any]:
+    """认领并运行一个世界，结果写入results_dir/<world_id>/。
+
+    异常只影响当前世界：写入error.json并释放认领，返回status为failed的结果；未认领到时status为skipped。"""
+    directory = os.path.join(results_dir, spec.world_id)
+    if not try_claim(directory, stale_after, retry_failed):
+        return {"world_id": spec.world_id, "status": "skipped"}
+    error_path = os.path.join(directory, "error.json")
+    if os.path.exists(error_path):
+        os.remove(error_path)
+    _write_json(os.path.join(directory, "spec.json"), asdict(spec))
+    random.seed(spec.seed)
+    collector = MetricsCollector()
+    started = time.perf_counter()
+    world = None
+    outcome = {"world_id": spec.world_id, "scene": spec.scene_name, "persona_set": spec.persona_set,
+               "temperature": spec.temperature, "seed": spec.seed, "host": socket.gethostname(),
+               "pid": os.getpid()}
+    try:
+        world = _build_world(spec, directory, [collector, _ClaimHeartbeat(os.path.join(directory, "claim"))])
+        if world.stop_reason is None:
+            world.run(max(0, spec.rounds - world.rounds))
+        world.checkpoint(world.checkpoint_path)
+        outcome.update(status="completed", rounds=world.rounds, stop_reason=world.stop_reason,
+                       elapsed=time.perf_counter() - started, calls=asdict(collector.total))
+        _write_json(os.path.join(directory, "result.json"), outcome)
+    except Exception as e:
+        outcome.update(status="failed", rounds=world.rounds if world else 0, elapsed=time.perf_counter() - started,
+                       error=f"{type(e).__name__}: {e}", traceback=traceback.format_exc())
+        _write_json(error_path, outcome)
+        release_claim(directory)
+    finally:
+        if world is not None:
+            world.close()
+    return outcome
+
+
+# ---------------- 调度与汇总 ----------------
+
+def collect_results(results_dir: str) -> List[Dict[str, Any]]:
+    """汇总结果目录中所有世界的result.json/error.json，写入results_dir/results.jsonl并返回"""
+    rows = []
+    for name in sorted(os.listdir(results_dir)) if os.path.isdir(results_dir) else []:
+        directory = os.path.join(results_dir, name)
+        if not os.path.isdir(directory):
+            continue
+        row = _read_json(os.path.join(directory, "result.json")) or _read_json(os.path.join(directory, "error.json"))
+        if row is not None:
+            row.pop("traceback", None)
+            rows.append(row)
+    tmp_path = os.path.join(results_dir, f"results.jsonl.{socket.gethostname()}.{os.getpid()}.tmp")
+    if os.path.isdir(results_dir):
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for row in rows:
+                f.write(json.dumps(row, ensure_ascii=False, default=str) + "\n")
+        os.replace(tmp_path, os.path.join(results_dir, "results.jsonl"))
+    return rows
+
+
+class ExperimentRunner:
+    """把实验网格中的世界分片到进程池中运行。
+
+    - workers：工作进程（分片）数，每个进程同一时间运行一个世界
+    - concurrency：每个分片的LLM并发预算，用作parallel调度下世界的max_concurrency以及同步、异步调用的并发上限
+    - requests_per_minute/tokens_per_minute：本机的限流配额，平均分给各个分片
+    - stale_after：其他主机的认领超过该秒数未更新时视为失效并接管，None表示只接管本机已退出进程的认领
+    多台主机共享同一个results_dir（例如NFS）并各自运行同一个网格即可分担工作，每个世界只会被一个进程认领。
+    工作进程异常退出（例如被OOM killer杀死）会使整个进程池失效，此时释放失效的认领并重建进程池，
+    同一个世界最多尝试max_attempts次；进程池在任何世界开始运行前失效时，所有未完成的世界都计入一次尝试。"""
+    def __init__(self, grid: ExperimentGrid, results_dir: str, workers: Optional[int] = None,
+                 concurrency: Optional[int] = 4, requests_per_minute: Optional[float] = None,
+                 tokens_per_minute: Optional[float] = None, stale_after: Optional[float] = None,
+                 retry_failed: bool = False, max_attempts: int = 2,
+                 progress: Optional[Callable[[int, int, Dict[str, Any]], None]] = None):
+        self.grid = grid
+        self.results_dir = results_dir
+        self.workers = workers or os.cpu_count() or 1
+        self.concurrency = concurrency
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.stale_after = stale_after
+        self.retry_failed = retry_failed
+        self.max_attempts = max_attempts
+        self.progress = progress
+
+    def _shard_args(self) -> tuple:
+        share = lambda limit: limit / self.workers if limit else None
+        return self.concurrency, share(self.requests_per_minute), share(self.tokens_per_minute)
+
+    def run(self) -> List[Dict[str, Any]]:
+        """运行所有未完成的世界，返回本次运行的各世界结果（被其他进程认领的世界status为skipped）。
+
+        多台主机各自运行时，本机的结果不包括其他主机运行的世界，完整结果用collect_results汇总。"""
+        os.makedirs(self.results_dir, exist_ok=True)
+        pending = {spec.world_id: spec for spec in self.grid.worlds()
+                   if not os.path.exists(os.path.join(self.results_dir, spec.world_id, "result.json"))}
+        total, outcomes, attempts = len(pending), [], {}
+        while pending:
+            broken = []
+            with ProcessPoolExecutor(max_workers=min(self.workers, len(pending)),
+                                     mp_context=multiprocessing.get_context("spawn"),
+                                     initializer=_init_shard, initargs=self._shard_args()) as pool:
+                futures = {pool.submit(run_world, spec, self.results_dir, self.stale_after, self.retry_failed): spec
+                           for spec in pending.values()}
+                for future in as_completed(futures):
+                    spec = futures[future]
+                    try:
+                        outcome = future.result()
+                    except BrokenProcessPool:
+                        broken.append(spec)
+                        continue
+                    except Exception as e:
+                        outcome = {"world_id": spec.world_id, "status": "failed", "error": f"{type(e).__name__}: {e}"}
+                    self._finish(pending, outcomes, total, spec, outcome)
+            # 释放已退出进程留下的认领，这些世界是进程池失效的嫌疑者，各记一次尝试；
+            # 没有任何嫌疑者时（例如进程池在认领之前就失效），所有受影响的世界各记一次，避免无限重建进程池
+            suspects = []
+            for spec in broken:
+                directory = os.path.join(self.results_dir, spec.world_id)
+                claim_path = os.path.join(directory, "claim")
+                if os.path.exists(claim_path) and _claim_is_abandoned(claim_path, None):
+                    release_claim(directory)
+                    suspects.append(spec)
+            for spec in suspects or broken:
+                attempts[spec.world_id] = attempts.get(spec.world_id, 0) + 1
+                if attempts[spec.world_id] >= self.max_attempts:
+                    directory = os.path.join(self.results_dir, spec.world_id)
+                    outcome = {"world_id": spec.world_id, "status": "failed",
+                               "error": f"工作进程{'' if spec in suspects else '在世界开始运行前'}异常退出，"
+                                        f"已尝试{attempts[spec.world_id]}次"}
+                    os.makedirs(directory, exist_ok=True)
+                    _write_json(os.path.join(directory, "error.json"), outcome)
+                    self._finish(pending, outcomes, total, spec, outcome)
+        return outcomes
+
+    def _finish(self, pending: Dict[str, WorldSpec], outcomes: List[Dict[str, Any]], total: int,
+                spec: WorldSpec, outcome: Dict[str, Any]):
+        pending.pop(spec.world_id, None)
+        outcomes.append(outcome)
+        if self.progress:
+            self.progress(len(outcomes), total, outcome)
+
+
+def _print_progress(done: int, total: int, outcome: Dict[str, Any]):
+    detail = outcome.get("error") or (f"{outcome['elapsed']:.1f}s" if "elapsed" in outcome else "")
+    print(f"[{done}/{total}] {outcome['world_id']} {outcome['status']} {detail}".rstrip(), flush=True)
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="按实验网格批量运行TinyWorld")
+    parser.add_argument("grid", help="实验网格JSON文件")
+    parser.add_argument("--output", default="experiment_results", help="结果目录，多台主机可共享同一目录")
+    parser.add_argument("--workers", type=int, default=None, help="工作进程数，默认为CPU核数")
+    parser.add_argument("--concurrency", type=int, default=4, help="每个工作进程的LLM并发预算")
+    parser.add_argument("--rpm", type=float, default=None, help="本机每分钟请求数上限，平均分给各工作进程")
+    parser.add_argument("--tpm", type=float, default=None, help="本机每分钟token数上限，平均分给各工作进程")
+    parser.add_argument("--stale-after", type=float, default=None,
+                        help="其他主机的认领超过该秒数未更新时接管")
+    parser.add_argument("--retry-failed", action="store_true", help="重新运行之前失败的世界")
+    parser.add_argument("--collect-only", action="store_true", help="只汇总已有结果到results.jsonl")
+    args = parser.parse_args(argv)
+
+    if not args.collect_only:
+        runner = ExperimentRunner(ExperimentGrid.from_file(args.grid), args.output, workers=args.workers,
+                                  concurrency=args.concurrency, requests_per_minute=args.rpm,
+                                  tokens_per_minute=args.tpm, stale_after=args.stale_after,
+                                  retry_failed=args.retry_failed, progress=_print_progress)
+        runner.run()
+    rows = collect_results(args.output)
+    counts = {}
+    for row in rows:
+        counts[row["status"]] = counts.get(row["status"], 0) + 1
+    print(f"{len(rows)}个世界：{counts}，汇总见{os.path.join(args.output, 'results.jsonl')}")
+    return 0 if not counts.get("failed") else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,190 @@
+from typing import Dict, Any, Optional
+import os
+import time
+import json
+import sqlite3
+import hashlib
+import threading
+import configparser
+from pathlib import Path
+
+# 缓存模式：write_through 命中直接返回、未命中调用后写入；read_only 只读不写；bypass 不读不写
+CACHE_MODES = ("write_through", "read_only", "bypass")
+
+# 参与缓存键计算的调用参数；其余非空参数（如response_format）也会一并计入
+KEY_PARAMS = ("model", "messages", "temperature", "max_tokens", "seed")
+
+
+def cache_key(params: Dict[str, Any]) -> str:
+    """根据调用参数计算内容寻址的缓存键"""
+    payload = {name: params.get(name) for name in KEY_PARAMS}
+    payload.update({name: value for name, value in params.items()
+                    if name not in KEY_PARAMS and value is not None})
+    raw = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    """基于SQLite的LLM响应持久化缓存。
+
+    键为调用参数的哈希，值为完整响应的JSON。支持按条数、总字节数和存活时间淘汰，
+    多线程共享同一连接，多进程通过WAL模式共享同一个文件。
+    只有write_through模式会修改文件（写入、更新访问时间、删除和淘汰）；其他模式以只读方式打开，文件保持不变。"""
+    def __init__(self, path: str = "openai_api_cache.sqlite", mode: str = "write_through",
+                 max_entries: Optional[int] = None, max_bytes: Optional[int] = None,
+                 max_age: Optional[float] = None):
+        if mode not in CACHE_MODES:
+            raise ValueError(f"未知的缓存模式: {mode}，可选值为{CACHE_MODES}")
+        self.path = path
+        self.mode = mode
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_age = max_age  # 秒
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._writes_since_eviction = 0
+        if mode != "write_through":
+            # 文件不存在时相当于空缓存，用内存数据库代替，不创建文件
+            target = f"{Path(path).resolve().as_uri()}?mode=ro" if os.path.exists(path) else ":memory:"
+            self._conn = sqlite3.connect(target, uri=True, check_same_thread=False, timeout=30)
+            if target != ":memory:":
+                return
+        else:
+            self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+            "created_at REAL NOT NULL, accessed_at REAL NOT NULL)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed_at)")
+        self._conn.commit()
+
+    @classmethod
+    def from_ini(cls, path: Optional[str], section: str = "OpenAI") -> Optional["LLMCache"]:
+        """按config.ini的CACHE_*配置创建缓存，CACHE_API_CALLS未开启时返回None"""
+        if not path:
+            return None
+        parser = configparser.ConfigParser()
+        parser.read(path, encoding="utf-8")
+        if not parser.has_section(section) or not parser[section].getboolean("CACHE_API_CALLS", False):
+            return None
+        options = parser[section]
+
+        def optional(key, cast):
+            raw = options.get(key, "").strip()
+            return cast(raw) if raw else None
+
+        return cls(
+            path=options.get("CACHE_FILE_NAME", "openai_api_cache.sqlite").strip(),
+            mode=options.get("CACHE_MODE", "write_through").strip(),
+            max_entries=optional("CACHE_MAX_ENTRIES", int),
+            max_bytes=optional("CACHE_MAX_BYTES", int),
+            max_age=optional("CACHE_MAX_AGE", float),
+        )
+
+    def get(self, key: str) -> Optional[str]:
+        if self.mode == "bypass":
+            return None
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None or (self.max_age is not None and now - row[1] > self.max_age):
+                self.misses += 1
+                return None
+            if self.mode == "write_through":  # 按最近访问淘汰
+                self._conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+                self._conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, key: str, value: str):
+        if self.mode != "write_through":
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, size, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?)", (key, value, len(value.encode("utf-8")), now, now))
+            self._writes_since_eviction += 1
+            if self._writes_since_eviction >= 100:
+                self._evict_locked(now)
+            self._conn.commit()
+
+    def delete(self, key: str):
+        """删除一条响应，例如调用方发现缓存的响应无法解析时，之后相同的调用会重新请求"""
+        if self.mode != "write_through":
+            return
+        with self._lock:
+            self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self._conn.commit()
+
+    def evict(self):
+        """按存活时间、条数和总字节数淘汰最久未访问的条目"""
+        if self.mode != "write_through":
+            return
+        with self._lock:
+            self._evict_locked(time.time())
+            self._conn.commit()
+
+    def _evict_locked(self, now: float):
+        self._writes_since_eviction = 0
+        if self.max_age is not None:
+            self._conn.execute("DELETE FROM responses WHERE created_at < ?", (now - self.max_age,))
+        if self.max_entries is not None:
+            self._conn.execute(
+                "DELETE FROM responses WHERE key IN (SELECT key FROM responses "
+                "ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)", (self.max_entries,))
+        if self.max_bytes is not None:
+            total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+            if total > self.max_bytes:
+                rows = self._conn.execute("SELECT key, size FROM responses ORDER BY accessed_at").fetchall()
+                stale = []
+                for key, size in rows:
+                    if total <= self.max_bytes:
+                        break
+                    stale.append((key,))
+                    total -= size
+                self._conn.executemany("DELETE FROM responses WHERE key = ?", stale)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            if self.mode == "write_through":
+                self._evict_locked(time.time())
+                self._conn.commit()
+            self._conn.close()
+
+
+_cache: Optional[LLMCache] = None
+_cache_loaded = False
+_cache_lock = threading.Lock()
+
+
+def configure_cache(cache: Optional[LLMCache] = None, **options):
+    """设置进程内共享的响应缓存：传入LLMCache实例，或传入LLMCache的构造参数；不传参数则关闭缓存"""
+    global _cache, _cache_loaded
+    with _cache_lock:
+        _cache = cache if cache is not None else (LLMCache(**options) if options else None)
+        _cache_loaded = True
+
+
+def get_cache() -> Optional[LLMCache]:
+    """获取进程内共享的响应缓存，首次调用时按当前目录下config.ini的CACHE_*配置创建"""
+    global _cache, _cache_loaded
+    with _cache_lock:
+        if not _cache_loaded:
+            _cache = LLMCache.from_ini("config.ini" if os.path.exists("config.ini") else None)
+            _cache_loaded = True
+        return _cache
+
+
+def discard_response(params: Dict[str, Any]):
+    """从共享的响应缓存中删除这组调用参数的响应（调用方解析响应失败时使用，重试时不会再拿到同一个错误的响应）"""
+    cache = get_cache()
+    if cache is not None:
+        cache.delete(cache_key(params))
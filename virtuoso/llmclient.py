@@ -0,0 +1,546 @@
+from typing import Dict, Any, Optional, Iterator, AsyncIterator, Callable, List, Tuple
+import time
+import json
+import os
+import asyncio
+import threading
+import warnings
+import weakref
+import contextvars
+import configparser
+from concurrent.futures import Future
+from contextlib import contextmanager
+from dataclasses import dataclass, replace
+import httpx
+from openai import OpenAI, AsyncOpenAI, DefaultHttpxClient, DefaultAsyncHttpxClient
+from openai.types.chat import ChatCompletion
+from .llmcache import get_cache, cache_key
+from .ratelimit import get_rate_limiter, get_retry_policy
+from .contextbuilder import estimate_tokens
+from .metrics import CallRecord, emit, take_queue_time, current_world
+
+
+@dataclass(frozen=True)
+class LLMClientConfig:
+    """LLM客户端配置，对应config.ini中的[OpenAI]段"""
+    api_key: Optional[str] = None  # 为空时由OpenAI SDK读取OPENAI_API_KEY环境变量
+    base_url: Optional[str] = None  # 为空时由OpenAI SDK读取OPENAI_BASE_URL环境变量
+    timeout: float = 60.0
+    connect_timeout: float = 10.0
+    max_connections: int = 100
+    max_keepalive_connections: int = 20
+    keepalive_expiry: float = 30.0
+
+    # config.ini中的键名与字段的对应关系
+    INI_KEYS = {
+        "API_KEY": ("api_key", str),
+        "BASE_URL": ("base_url", str),
+        "TIMEOUT": ("timeout", float),
+        "CONNECT_TIMEOUT": ("connect_timeout", float),
+        "MAX_CONNECTIONS": ("max_connections", int),
+        "MAX_KEEPALIVE_CONNECTIONS": ("max_keepalive_connections", int),
+        "KEEPALIVE_EXPIRY": ("keepalive_expiry", float),
+    }
+
+    @classmethod
+    def from_ini(cls, path: str, section: str = "OpenAI") -> "LLMClientConfig":
+        """从ini文件读取配置，缺失的键使用默认值"""
+        parser = configparser.ConfigParser()
+        parser.read(path, encoding="utf-8")
+        if not parser.has_section(section):
+            return cls()
+        values = {}
+        for key, (field, cast) in cls.INI_KEYS.items():
+            raw = parser[section].get(key, "").strip()
+            if raw:
+                values[field] = cast(raw)
+        return cls(**values)
+
+    def httpx_limits(self) -> httpx.Limits:
+        return httpx.Limits(
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.max_keepalive_connections,
+            keepalive_expiry=self.keepalive_expiry,
+        )
+
+    def httpx_timeout(self) -> httpx.Timeout:
+        return httpx.Timeout(self.timeout, connect=self.connect_timeout)
+
+
+def load_config(path: Optional[str] = None) -> LLMClientConfig:
+    """读取配置：优先使用指定路径，其次是当前目录下的config.ini，都不存在时使用默认值"""
+    if path is None:
+        path = "config.ini" if os.path.exists("config.ini") else None
+    return LLMClientConfig.from_ini(path) if path else LLMClientConfig()
+
+
+class LLMClientRegistry:
+    """进程级LLM客户端注册表。
+
+    所有智能体、工厂和世界共享同一个OpenAI客户端（即同一个HTTP连接池），
+    避免每个智能体各建一个连接池带来的重复TLS握手和空闲连接。
+    异步客户端的连接池绑定在事件循环上，因此按事件循环分别缓存。"""
+    def __init__(self, config: Optional[LLMClientConfig] = None):
+        self._config = config
+        self._lock = threading.Lock()
+        self._client: Optional[OpenAI] = None
+        self._async_clients = weakref.WeakKeyDictionary()
+        self._default_async_client: Optional[AsyncOpenAI] = None
+        self._injected_async_client: Optional[AsyncOpenAI] = None
+
+    @property
+    def config(self) -> LLMClientConfig:
+        if self._config is None:
+            self._config = load_config()
+        return self._config
+
+    def configure(self, config: Optional[LLMClientConfig] = None, path: Optional[str] = None, **overrides):
+        """更新配置，已创建的客户端会被丢弃，下次获取时按新配置重建"""
+        with self._lock:
+            base = config or (load_config(path) if path else self.config)
+            self._config = replace(base, **overrides) if overrides else base
+            self._reset_locked()
+
+    def set_client(self, client: Optional[OpenAI] = None, async_client: Optional[AsyncOpenAI] = None):
+        """注入自定义客户端（例如指向本地替身服务器的客户端）"""
+        with self._lock:
+            self._client = client
+            self._injected_async_client = async_client
+
+    def reset(self):
+        with self._lock:
+            self._reset_locked()
+
+    def _reset_locked(self):
+        self._client = None
+        self._async_clients = weakref.WeakKeyDictionary()
+        self._default_async_client = None
+        self._injected_async_client = None
+
+    def get_client(self) -> OpenAI:
+        with self._lock:
+            if self._client is None:
+                config = self.config
+                self._client = OpenAI(
+                    api_key=config.api_key,
+                    base_url=config.base_url,
+                    timeout=config.httpx_timeout(),
+                    max_retries=0,  # 重试由ratelimit.RetryPolicy统一处理
+                    http_client=DefaultHttpxClient(limits=config.httpx_limits(), timeout=config.httpx_timeout()),
+                )
+            return self._client
+
+    def get_async_client(self) -> AsyncOpenAI:
+        with self._lock:
+            if self._injected_async_client is not None:
+                return self._injected_async_client
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                loop = None
+            if loop is None:
+                if self._default_async_client is None:
+                    self._default_async_client = self._new_async_client()
+                return self._default_async_client
+            client = self._async_clients.get(loop)
+            if client is None:
+                client = self._async_clients[loop] = self._new_async_client()
+            return client
+
+    def _new_async_client(self) -> AsyncOpenAI:
+        config = self.config
+        return AsyncOpenAI(
+            api_key=config.api_key,
+            base_url=config.base_url,
+            timeout=config.httpx_timeout(),
+            max_retries=0,
+            http_client=DefaultAsyncHttpxClient(limits=config.httpx_limits(), timeout=config.httpx_timeout()),
+        )
+
+
+# 进程内默认注册表
+registry = LLMClientRegistry()
+
+
+def configure(config: Optional[LLMClientConfig] = None, path: Optional[str] = None, **overrides):
+    """配置进程内共享的LLM客户端，例如 configure(path="config.ini") 或 configure(base_url="http://127.0.0.1:8000/v1")"""
+    registry.configure(config, path, **overrides)
+
+
+def set_client(client: Optional[OpenAI] = None, async_client: Optional[AsyncOpenAI] = None):
+    registry.set_client(client, async_client)
+
+
+def get_client() -> OpenAI:
+    """获取进程内共享的同步LLM客户端"""
+    return registry.get_client()
+
+
+def get_async_client() -> AsyncOpenAI:
+    """获取当前事件循环共享的异步LLM客户端"""
+    return registry.get_async_client()
+
+
+def _estimate_request_tokens(params: Dict[str, Any]) -> int:
+    """预估一次请求消耗的token数（提示词估算值加上max_tokens），用于TPM限流"""
+    prompt = json.dumps(params.get("messages", []), ensure_ascii=False)
+    return estimate_tokens(prompt) + (params.get("max_tokens") or 0)
+
+
+def _usage_tokens(response: Any) -> Optional[int]:
+    usage = getattr(response, "usage", None)
+    return getattr(usage, "total_tokens", None)
+
+
+_sync_llm_semaphore: Optional[threading.BoundedSemaphore] = None
+
+
+def set_sync_concurrency_limit(limit: Optional[int]):
+    """设置同步LLM调用的进程内并发上限（所有线程共享），None表示不限制；流式请求只在建立连接期间占用名额"""
+    global _sync_llm_semaphore
+    _sync_llm_semaphore = threading.BoundedSemaphore(limit) if limit else None
+
+
+def _create(client: OpenAI, params: Dict[str, Any], record: CallRecord) -> Any:
+    semaphore = _sync_llm_semaphore
+    if semaphore is None:
+        return client.chat.completions.create(**params)
+    started = time.perf_counter()
+    with semaphore:
+        record.queue_time += time.perf_counter() - started
+        return client.chat.completions.create(**params)
+
+
+def _send(client: OpenAI, params: Dict[str, Any], record: CallRecord) -> Any:
+    """经过限流和并发上限并按重试策略发送请求；流式请求只重试建立连接的阶段。等待和重试次数记入record"""
+    limiter, policy = get_rate_limiter(), get_retry_policy()
+    estimated = _estimate_request_tokens(params) if limiter is not None else 0
+    for attempt in range(1, policy.max_attempts + 1):
+        if limiter is not None:
+            record.queue_time += limiter.acquire(estimated)
+        try:
+            response = _create(client, params, record)
+        except Exception as e:
+            if attempt >= policy.max_attempts or not policy.is_retryable(e):
+                raise
+            record.retries += 1
+            time.sleep(policy.delay(attempt, e))
+            continue
+        if limiter is not None and not params.get("stream"):
+            limiter.settle(estimated, _usage_tokens(response))
+        return response
+
+
+async def _asend(client: AsyncOpenAI, params: Dict[str, Any], record: CallRecord) -> Any:
+    """_send的异步版本"""
+    limiter, policy = get_rate_limiter(), get_retry_policy()
+    estimated = _estimate_request_tokens(params) if limiter is not None else 0
+    for attempt in range(1, policy.max_attempts + 1):
+        if limiter is not None:
+            record.queue_time += await limiter.aacquire(estimated)
+        try:
+            response = await client.chat.completions.create(**params)
+        except Exception as e:
+            if attempt >= policy.max_attempts or not policy.is_retryable(e):
+                raise
+            record.retries += 1
+            await asyncio.sleep(policy.delay(attempt, e))
+            continue
+        if limiter is not None and not params.get("stream"):
+            limiter.settle(estimated, _usage_tokens(response))
+        return response
+
+
+class _LeaderCancelled(Exception):
+    """发送请求的调用者被取消或中断，正在等待的调用者改为自己发送"""
+
+
+class RequestCoalescer:
+    """合并参数完全相同的请求：第一个调用者发送请求，同时发出相同请求的调用者直接共享它的响应。
+
+    失败的请求从合并表中移除并把异常交给正在等待的调用者，之后相同的请求重新发送。
+    keep_completed为False时成功的请求同样移除（长期存在的合并器不会无限增长，复用已完成的响应需开启响应缓存）；
+    为True时合并器在整个生命周期内保留已完成的响应，适用于一次广播这样有界的作用域。"""
+    def __init__(self, keep_completed: bool = False):
+        self.keep_completed = keep_completed
+        self._futures: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.coalesced = 0
+
+    def claim(self, key: str) -> Tuple[Future, bool]:
+        """返回(共享的Future, 是否由当前调用者发送请求)"""
+        with self._lock:
+            self.requests += 1
+            future = self._futures.get(key)
+            if future is not None:
+                self.coalesced += 1
+                return future, False
+            future = self._futures[key] = Future()
+            return future, True
+
+    def resolve(self, key: str, future: Future, response: Any = None, error: Optional[BaseException] = None):
+        with self._lock:
+            if (error is not None or not self.keep_completed) and self._futures.get(key) is future:
+                del self._futures[key]
+        if error is None:
+            future.set_result(response)
+        elif isinstance(error, Exception):
+            future.set_exception(error)
+        else:  # 取消或中断不代表请求本身失败
+            future.set_exception(_LeaderCancelled(f"{type(error).__name__}: {error}"))
+
+
+# 当前线程或协程所在的请求合并作用域，见coalesce_requests
+_coalescer = contextvars.ContextVar("virtuoso_request_coalescer", default=None)
+
+
+@contextmanager
+def coalesce_requests(coalescer: Optional[RequestCoalescer] = None):
+    """在作用域内合并参数完全相同的非流式请求，被合并的调用在metrics中记为命中缓存。
+
+    作用域通过contextvars传递：协程自动继承，线程池中的任务需要用contextvars.copy_context().run提交。"""
+    coalescer = coalescer or RequestCoalescer()
+    token = _coalescer.set(coalescer)
+    try:
+        yield coalescer
+    finally:
+        _coalescer.reset(token)
+
+
+def _new_record(params: Dict[str, Any], agent: Optional[str], method: Optional[str],
+                round_num: Optional[int], streamed: bool = False) -> CallRecord:
+    return CallRecord(agent=agent, method=method, round=round_num, model=params.get("model", ""),
+                      queue_time=take_queue_time(), streamed=streamed, world=current_world())
+
+
+def _finish_record(record: CallRecord, started: float, response: Optional[ChatCompletion] = None,
+                   error: Optional[Exception] = None):
+    """补全调用记录并交给metrics钩子"""
+    record.wall_time = time.perf_counter() - started
+    usage = getattr(response, "usage", None)
+    if usage is not None:
+        record.prompt_tokens = usage.prompt_tokens
+        record.completion_tokens = usage.completion_tokens
+    if error is not None:
+        record.error = f"{type(error).__name__}: {error}"
+    emit(record)
+
+
+def _settle_stream(params: Dict[str, Any], response: ChatCompletion):
+    limiter = get_rate_limiter()
+    if limiter is not None:
+        limiter.settle(_estimate_request_tokens(params), _usage_tokens(response))
+
+
+def _store(cache, key: str, response: ChatCompletion):
+    """写入响应缓存；写入失败只发出警告，不影响已经成功（并已计费）的调用"""
+    try:
+        cache.put(key, response.model_dump_json())
+    except Exception as e:
+        warnings.warn(f"写入响应缓存失败：{type(e).__name__}: {e}")
+
+
+def create_chat_completion(client: OpenAI, agent: Optional[str] = None, method: Optional[str] = None,
+                           round_num: Optional[int] = None, **params) -> ChatCompletion:
+    """所有chat.completions.create调用的统一入口，命中响应缓存时不发起网络请求。
+
+    agent/method/round_num只用于标记metrics中的调用记录，不会发送给服务端。"""
+    record = _new_record(params, agent, method, round_num)
+    started = time.perf_counter() - record.queue_time  # 计入进入本函数之前的排队时间
+    cache = get_cache()
+    key = cache_key(params) if cache is not None else None
+    if key is not None:
+        cached = cache.get(key)
+        if cached is not None:
+            response = ChatCompletion.model_validate_json(cached)
+            record.cache_hit = True
+            _finish_record(record, started, response)
+            return response
+    coalescer = _coalescer.get()
+    if coalescer is not None:
+        shared_key = key or cache_key(params)
+        shared, leader = coalescer.claim(shared_key)
+        if not leader:
+            try:
+                response = shared.result()
+            except _LeaderCancelled:
+                coalescer = None  # 发送方被取消，改为自己发送
+            except Exception as e:
+                _finish_record(record, started, error=e)
+                raise
+            else:
+                record.cache_hit = True
+                _finish_record(record, started, response)
+                return response
+    try:
+        response = _send(client, params, record)
+    except BaseException as e:  # 包括取消，否则等待同一请求的调用者会一直挂起
+        if coalescer is not None:
+            coalescer.resolve(shared_key, shared, error=e)
+        _finish_record(record, started, error=e)
+        raise
+    if key is not None:  # 先写入缓存再放行等待的调用者，之后相同的请求不会既错过合并又错过缓存
+        _store(cache, key, response)
+    if coalescer is not None:
+        coalescer.resolve(shared_key, shared, response)
+    _finish_record(record, started, response)
+    return response
+
+
+async def acreate_chat_completion(client: AsyncOpenAI, agent: Optional[str] = None, method: Optional[str] = None,
+                                  round_num: Optional[int] = None, **params) -> ChatCompletion:
+    """create_chat_completion的异步版本"""
+    record = _new_record(params, agent, method, round_num)
+    started = time.perf_counter() - record.queue_time
+    cache = get_cache()
+    key = cache_key(params) if cache is not None else None
+    if key is not None:
+        cached = await asyncio.to_thread(cache.get, key)
+        if cached is not None:
+            response = ChatCompletion.model_validate_json(cached)
+            record.cache_hit = True
+            _finish_record(record, started, response)
+            return response
+    coalescer = _coalescer.get()
+    if coalescer is not None:
+        shared_key = key or cache_key(params)
+        shared, leader = coalescer.claim(shared_key)
+        if not leader:
+            try:
+                response = await asyncio.wrap_future(shared)
+            except _LeaderCancelled:
+                coalescer = None  # 发送方被取消，改为自己发送
+            except Exception as e:
+                _finish_record(record, started, error=e)
+                raise
+            else:
+                record.cache_hit = True
+                _finish_record(record, started, response)
+                return response
+    try:
+        response = await _asend(client, params, record)
+    except BaseException as e:  # 包括取消，否则等待同一请求的调用者会一直挂起
+        if coalescer is not None:
+            coalescer.resolve(shared_key, shared, error=e)
+        _finish_record(record, started, error=e)
+        raise
+    if key is not None:
+        try:
+            await asyncio.to_thread(_store, cache, key, response)  # SQLite调用会阻塞，不在事件循环中执行
+        except BaseException:  # 写入缓存期间被取消时响应仍然有效，照常交给等待的调用者
+            if coalescer is not None:
+                coalescer.resolve(shared_key, shared, response)
+            raise
+    if coalescer is not None:
+        coalescer.resolve(shared_key, shared, response)
+    _finish_record(record, started, response)
+    return response
+
+
+def _assemble_completion(params: Dict[str, Any], pieces: List[str], usage: Any,
+                         finish_reason: Optional[str]) -> ChatCompletion:
+    """把流式返回的片段拼成完整的ChatCompletion，便于缓存和统计"""
+    return ChatCompletion.model_validate({
+        "id": "stream",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": params.get("model", ""),
+        "choices": [{
+            "index": 0,
+            "finish_reason": finish_reason or "stop",
+            "message": {"role": "assistant", "content": "".join(pieces)},
+        }],
+        "usage": usage.model_dump() if usage is not None else None,
+    })
+
+
+def _stream_params(params: Dict[str, Any]) -> Dict[str, Any]:
+    return dict(params, stream=True, stream_options={"include_usage": True})
+
+
+def stream_chat_completion(client: OpenAI, on_complete: Optional[Callable[[ChatCompletion], None]] = None,
+                           agent: Optional[str] = None, method: Optional[str] = None,
+                           round_num: Optional[int] = None, **params) -> Iterator[str]:
+    """流式调用，逐段产出文本增量；结束后把拼好的完整响应交给on_complete并写入缓存。
+
+    命中缓存时整段内容作为一个增量返回。"""
+    record = _new_record(params, agent, method, round_num, streamed=True)
+    started = time.perf_counter() - record.queue_time
+    cache = get_cache()
+    key = cache_key(params) if cache is not None else None
+    if key is not None:
+        cached = cache.get(key)
+        if cached is not None:
+            response = ChatCompletion.model_validate_json(cached)
+            record.cache_hit = True
+            _finish_record(record, started, response)
+            yield response.choices[0].message.content or ""
+            if on_complete is not None:
+                on_complete(response)
+            return
+    pieces, usage, finish_reason = [], None, None
+    try:
+        for chunk in _send(client, _stream_params(params), record):
+            if chunk.usage is not None:
+                usage = chunk.usage
+            if not chunk.choices:
+                continue
+            choice = chunk.choices[0]
+            finish_reason = choice.finish_reason or finish_reason
+            if choice.delta.content:
+                pieces.append(choice.delta.content)
+                yield choice.delta.content
+    except Exception as e:
+        _finish_record(record, started, error=e)
+        raise
+    response = _assemble_completion(params, pieces, usage, finish_reason)
+    _settle_stream(params, response)
+    _finish_record(record, started, response)
+    if key is not None:
+        _store(cache, key, response)
+    if on_complete is not None:
+        on_complete(response)
+
+
+async def astream_chat_completion(client: AsyncOpenAI,
+                                  on_complete: Optional[Callable[[ChatCompletion], None]] = None,
+                                  agent: Optional[str] = None, method: Optional[str] = None,
+                                  round_num: Optional[int] = None, **params) -> AsyncIterator[str]:
+    """stream_chat_completion的异步版本"""
+    record = _new_record(params, agent, method, round_num, streamed=True)
+    started = time.perf_counter() - record.queue_time
+    cache = get_cache()
+    key = cache_key(params) if cache is not None else None
+    if key is not None:
+        cached = await asyncio.to_thread(cache.get, key)
+        if cached is not None:
+            response = ChatCompletion.model_validate_json(cached)
+            record.cache_hit = True
+            _finish_record(record, started, response)
+            yield response.choices[0].message.content or ""
+            if on_complete is not None:
+                on_complete(response)
+            return
+    pieces, usage, finish_reason = [], None, None
+    try:
+        async for chunk in await _asend(client, _stream_params(params), record):
+            if chunk.usage is not None:
+                usage = chunk.usage
+            if not chunk.choices:
+                continue
+            choice = chunk.choices[0]
+            finish_reason = choice.finish_reason or finish_reason
+            if choice.delta.content:
+                pieces.append(choice.delta.content)
+                yield choice.delta.content
+    except Exception as e:
+        _finish_record(record, started, error=e)
+        raise
+    response = _assemble_completion(params, pieces, usage, finish_reason)
+    _settle_stream(params, response)
+    _finish_record(record, started, response)
+    if key is not None:
+        await asyncio.to_thread(_store, cache, key, response)
+    if on_complete is not None:
+        on_complete(response)
@@ -0,0 +1,191 @@
+from typing import List, Dict, Any, Optional, Tuple
+import os
+import re
+import zlib
+import threading
+import warnings
+import configparser
+import numpy as np
+from openai import OpenAI
+from .llmclient import get_client
+
+_WORD = re.compile(r"[a-zA-Z0-9_]+")
+_CJK = re.compile(r"[⺀-鿿豈-﫿]")
+
+
+class HashingEmbedder:
+    """离线嵌入：把中日韩字符的单字和双字、拉丁字母单词哈希到固定维度并归一化，不需要网络和模型"""
+    def __init__(self, dim: int = 1024):
+        self.dim = dim
+
+    def _features(self, text: str) -> List[str]:
+        chars = _CJK.findall(text)
+        words = [word.lower() for word in _WORD.findall(text)]
+        return chars + [a + b for a, b in zip(chars, chars[1:])] + words
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature in self._features(text):
+                digest = zlib.crc32(feature.encode("utf-8"))
+                vectors[row, digest % self.dim] += 1.0 if digest & 0x80000000 else -1.0
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.where(norms == 0, 1.0, norms)
+
+
+class OpenAIEmbedder:
+    """通过OpenAI兼容的embeddings接口嵌入文本，默认使用进程内共享的客户端"""
+    def __init__(self, model: str = "text-embedding-3-small", api_client: Optional[OpenAI] = None,
+                 batch_size: int = 64):
+        self.model = model
+        self.api_client = api_client
+        self.batch_size = batch_size
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        client = self.api_client or get_client()
+        vectors = []
+        for start in range(0, len(texts), self.batch_size):
+            response = client.embeddings.create(model=self.model, input=texts[start:start + self.batch_size])
+            vectors.extend(item.embedding for item in sorted(response.data, key=lambda item: item.index))
+        matrix = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        return matrix / np.where(norms == 0, 1.0, norms)
+
+
+class FallbackEmbedder:
+    """先使用primary嵌入，primary出错（例如服务不支持embeddings接口或没有配置API密钥）时发出警告，之后一直使用fallback"""
+    def __init__(self, primary, fallback=None):
+        self.primary = primary
+        self.fallback = fallback or HashingEmbedder()
+        self.active = primary
+        self._lock = threading.Lock()
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        active = self.active
+        if active is self.fallback:
+            return self.fallback.embed(texts)
+        try:
+            return active.embed(texts)
+        except Exception as e:
+            with self._lock:
+                if self.active is not self.fallback:
+                    warnings.warn(f"嵌入失败（{type(e).__name__}: {e}），改用{type(self.fallback).__name__}")
+                    self.active = self.fallback
+            return self.fallback.embed(texts)
+
+
+def load_embedder(path: Optional[str] = None, section: str = "OpenAI"):
+    """按config.ini的EMBEDDING_MODEL创建嵌入器，调用出错时回退到离线的HashingEmbedder；未配置时直接使用HashingEmbedder"""
+    if path is None:
+        path = "config.ini" if os.path.exists("config.ini") else None
+    parser = configparser.ConfigParser()
+    if path:
+        parser.read(path, encoding="utf-8")
+    model = parser[section].get("EMBEDDING_MODEL", "").strip() if parser.has_section(section) else ""
+    return FallbackEmbedder(OpenAIEmbedder(model)) if model else HashingEmbedder()
+
+
+class EpisodicMemory:
+    """智能体的情景记忆：每条记忆的嵌入向量按行存放在NumPy矩阵中，按余弦相似度检索top-k。
+
+    新记忆先进入待嵌入队列，下一次检索时批量嵌入，避免每个回应都单独发起一次嵌入请求。
+    capacity限制保留的条数，达到后记忆和向量矩阵作为环形缓冲区使用，新记忆覆盖最旧的一条。
+    嵌入器切换导致向量维度变化时（例如回退到离线嵌入），所有记忆按新的嵌入器重新嵌入。"""
+    def __init__(self, embedder=None, top_k: int = 3, capacity: Optional[int] = None):
+        self.embedder = embedder or load_embedder()
+        self.top_k = top_k
+        self.capacity = capacity
+        # 按槽位存放，达到capacity后_start指向最旧的一条；检索只关心槽位，不需要按时间顺序
+        self._texts: List[str] = []
+        self._rounds: List[Optional[int]] = []
+        self._start = 0
+        self._vectors: Optional[np.ndarray] = None  # 与槽位对应的嵌入向量，行数按需倍增（最多capacity行）
+        self._pending = 0  # 最新的几条记忆尚未嵌入
+        self._lock = threading.Lock()
+
+    @property
+    def texts(self) -> List[str]:
+        """按时间顺序排列的记忆文本"""
+        return self._texts[self._start:] + self._texts[:self._start]
+
+    @property
+    def rounds(self) -> List[Optional[int]]:
+        return self._rounds[self._start:] + self._rounds[:self._start]
+
+    def __len__(self) -> int:
+        return len(self._texts)
+
+    def add(self, text: str, round_num: Optional[int] = None):
+        with self._lock:
+            if self.capacity is not None and len(self._texts) >= self.capacity:
+                if self.capacity <= 0:
+                    return
+                self._texts[self._start] = text
+                self._rounds[self._start] = round_num
+                self._start = (self._start + 1) % self.capacity
+            else:
+                self._texts.append(text)
+                self._rounds.append(round_num)
+            self._pending = min(self._pending + 1, len(self._texts))
+
+    def _newest_slots(self, count: int) -> List[int]:
+        size = len(self._texts)
+        return [(self._start + size - count + offset) % size for offset in range(count)]
+
+    def _embed_pending(self):
+        """批量嵌入待处理的记忆，写入各自槽位对应的行"""
+        if not self._pending:
+            return
+        slots = self._newest_slots(self._pending)
+        vectors = self.embedder.embed([self._texts[slot] for slot in slots])
+        if self._vectors is not None and self._vectors.shape[1] != vectors.shape[1]:
+            self._reembed_all()
+            return
+        size = len(self._texts)
+        if self._vectors is None or self._vectors.shape[0] < size:
+            rows = max(size, 16, 2 * (self._vectors.shape[0] if self._vectors is not None else 0))
+            grown = np.zeros((min(rows, self.capacity) if self.capacity else rows, vectors.shape[1]),
+                             dtype=np.float32)
+            if self._vectors is not None:
+                grown[:self._vectors.shape[0]] = self._vectors
+            self._vectors = grown
+        self._vectors[slots] = vectors
+        self._pending = 0
+
+    def _reembed_all(self):
+        self._vectors, self._pending = None, len(self._texts)
+        self._embed_pending()
+
+    def search(self, query: str, top_k: Optional[int] = None,
+               exclude_rounds: Optional[set] = None) -> List[Tuple[float, str, Optional[int]]]:
+        """返回与query最相关的记忆[(相似度, 文本, 轮次)]，按相似度从高到低；exclude_rounds中的轮次不参与检索"""
+        top_k = self.top_k if top_k is None else top_k
+        with self._lock:
+            if not self._texts or top_k <= 0:
+                return []
+            self._embed_pending()
+            query_vector = self.embedder.embed([query])[0]
+            if query_vector.shape[0] != self._vectors.shape[1]:
+                self._reembed_all()
+            scores = self._vectors[:len(self._texts)] @ query_vector
+            if exclude_rounds:
+                mask = np.fromiter((round_num in exclude_rounds for round_num in self._rounds), dtype=bool,
+                                   count=len(self._rounds))
+                scores = np.where(mask, -np.inf, scores)
+            candidates = min(top_k, int(np.isfinite(scores).sum()))
+            if candidates == 0:
+                return []
+            best = np.argpartition(-scores, candidates - 1)[:candidates]
+            best = best[np.argsort(-scores[best])]
+            return [(float(scores[i]), self._texts[i], self._rounds[i]) for i in best]
+
+    def to_dict(self) -> Dict[str, Any]:
+        """导出记忆文本和轮次；恢复时重新嵌入"""
+        return {"top_k": self.top_k, "capacity": self.capacity, "texts": self.texts, "rounds": self.rounds}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any], embedder=None) -> "EpisodicMemory":
+        memory = cls(embedder, top_k=data.get("top_k", 3), capacity=data.get("capacity"))
+        for text, round_num in zip(data.get("texts", []), data.get("rounds", [])):
+            memory.add(text, round_num)
+        return memory
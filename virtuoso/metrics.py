@@ -0,0 +1,283 @@
+from typing import List, Dict, Any, Optional, Callable, Tuple
+import os
+import json
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+from dataclasses import dataclass, asdict, field
+from .transcript import _AppendFile
+
+
+@dataclass
+class CallRecord:
+    """单次LLM调用的记录，由llmclient在每次调用结束（包括命中缓存和失败）时发出"""
+    agent: Optional[str] = None
+    method: Optional[str] = None
+    round: Optional[int] = None
+    model: str = ""
+    wall_time: float = 0.0  # 从发起调用到拿到完整响应的秒数，包括排队、限流等待和重试
+    queue_time: float = 0.0  # 其中等待异步并发名额和限流器的秒数
+    prompt_tokens: Optional[int] = None  # 取自响应的usage，服务端未返回时为None
+    completion_tokens: Optional[int] = None
+    cache_hit: bool = False
+    retries: int = 0
+    streamed: bool = False
+    error: Optional[str] = None
+    timestamp: float = field(default_factory=time.time)
+    world: Optional[str] = None  # 发起调用的TinyWorld的world_id，不在世界的运行中发起时为None
+
+
+# 进程级调用钩子：每个LLM调用结束后依次调用，钩子抛出的异常不会影响调用本身
+_hooks: Tuple[Callable[[CallRecord], None], ...] = ()
+_hooks_lock = threading.Lock()
+# 当前协程在进入llmclient之前已经排队等待的秒数（例如等待async_llm_slot的名额）
+_pending_queue_time = contextvars.ContextVar("virtuoso_pending_queue_time", default=0.0)
+# 当前正在运行的TinyWorld，写入CallRecord.world，同一进程中同时运行的多个世界据此区分各自的调用
+_current_world = contextvars.ContextVar("virtuoso_current_world", default=None)
+
+
+def subscribe(callback: Callable[[CallRecord], None]):
+    """注册调用钩子，之后每次LLM调用结束都会以CallRecord调用callback"""
+    global _hooks
+    with _hooks_lock:
+        _hooks = _hooks + (callback,)
+
+
+def unsubscribe(callback: Callable[[CallRecord], None]):
+    global _hooks
+    with _hooks_lock:
+        _hooks = tuple(hook for hook in _hooks if hook != callback)
+
+
+def has_hooks() -> bool:
+    return bool(_hooks)
+
+
+def emit(record: CallRecord):
+    for hook in _hooks:
+        try:
+            hook(record)
+        except Exception:
+            pass
+
+
+@contextmanager
+def world_scope(world_id: str):
+    """在作用域内发起的LLM调用记为属于world_id的世界；协程自动继承，线程池任务需要通过bind_context提交"""
+    token = _current_world.set(world_id)
+    try:
+        yield
+    finally:
+        _current_world.reset(token)
+
+
+def current_world() -> Optional[str]:
+    return _current_world.get()
+
+
+def bind_context(func: Callable) -> Callable:
+    """返回在当前contextvars上下文的副本中执行func的函数，提交到线程池后仍保留世界标记等上下文"""
+    context = contextvars.copy_context()
+
+    def run(*args, **kwargs):
+        return context.copy().run(func, *args, **kwargs)
+    return run
+
+
+def add_queue_time(seconds: float):
+    """记录当前协程在发起调用前的排队时间，计入下一次调用的queue_time"""
+    _pending_queue_time.set(_pending_queue_time.get() + seconds)
+
+
+def take_queue_time() -> float:
+    seconds = _pending_queue_time.get()
+    if seconds:
+        _pending_queue_time.set(0.0)
+    return seconds
+
+
+class Subscriber:
+    """TinyWorld的事件订阅者基类，按需重写其中的方法。
+
+    on_call只会收到属于该世界中智能体的调用。"""
+    def on_round_start(self, round_num: int):
+        pass
+
+    def on_turn(self, turn: Dict[str, Any]):
+        pass
+
+    def on_round_end(self, round_num: int, results: List[Dict[str, Any]]):
+        pass
+
+    def on_call(self, record: CallRecord):
+        pass
+
+    def on_stop(self, round_num: int, reason: str):
+        """世界在完成round_num轮后提前停止，reason见convergence模块"""
+        pass
+
+    def close(self):
+        pass
+
+
+class ConsoleSubscriber(Subscriber):
+    """在控制台输出每轮标题和每个智能体的回应（TinyWorld的verbose输出）"""
+    def __init__(self, scene: str):
+        self.scene = scene
+
+    def on_round_start(self, round_num: int):
+        print(f"\n{'='*20} {self.scene} Round {round_num} {'='*20}")
+
+    def on_turn(self, turn: Dict[str, Any]):
+        print(f"{turn['agent']}:  {turn['thought']}")
+        print(f"{turn['agent']}:  {turn['speech']}")
+        print(f"{turn['agent']}:  {turn['action']}")
+
+    def on_stop(self, round_num: int, reason: str):
+        print(f"\n{'='*20} {self.scene} 在第{round_num}轮后停止：{reason} {'='*20}")
+
+
+@dataclass
+class CallStats:
+    """一组调用的累计值"""
+    calls: int = 0
+    errors: int = 0
+    cache_hits: int = 0
+    retries: int = 0
+    wall_time: float = 0.0
+    max_wall_time: float = 0.0
+    queue_time: float = 0.0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cost: float = 0.0
+
+    def add(self, record: CallRecord, cost: float = 0.0):
+        self.calls += 1
+        self.errors += record.error is not None
+        self.cache_hits += record.cache_hit
+        self.retries += record.retries
+        self.wall_time += record.wall_time
+        self.max_wall_time = max(self.max_wall_time, record.wall_time)
+        self.queue_time += record.queue_time
+        self.prompt_tokens += record.prompt_tokens or 0
+        self.completion_tokens += record.completion_tokens or 0
+        self.cost += cost
+
+
+class MetricsCollector(Subscriber):
+    """按世界、智能体、轮次和(智能体, 方法)汇总LLM调用。
+
+    prices为{模型: (每千提示词token价格, 每千生成token价格)}，设置后按模型计算费用；
+    命中缓存的调用不计费。"""
+    def __init__(self, prices: Optional[Dict[str, Tuple[float, float]]] = None):
+        self.prices = prices or {}
+        self.total = CallStats()
+        self.by_agent: Dict[str, CallStats] = {}
+        self.by_round: Dict[int, CallStats] = {}
+        self.by_method: Dict[Tuple[str, str], CallStats] = {}
+        self.rounds = 0
+        self.round_times: Dict[int, float] = {}
+        self._round_started: Dict[int, float] = {}
+        self._lock = threading.Lock()
+
+    def _cost(self, record: CallRecord) -> float:
+        price = self.prices.get(record.model)
+        if price is None or record.cache_hit:
+            return 0.0
+        return ((record.prompt_tokens or 0) * price[0] + (record.completion_tokens or 0) * price[1]) / 1000
+
+    def on_call(self, record: CallRecord):
+        cost = self._cost(record)
+        agent, method = record.agent or "", record.method or ""
+        with self._lock:
+            self.total.add(record, cost)
+            self.by_agent.setdefault(agent, CallStats()).add(record, cost)
+            self.by_method.setdefault((agent, method), CallStats()).add(record, cost)
+            if record.round is not None:
+                self.by_round.setdefault(record.round, CallStats()).add(record, cost)
+
+    def on_round_start(self, round_num: int):
+        self._round_started[round_num] = time.perf_counter()
+
+    def on_round_end(self, round_num: int, results: List[Dict[str, Any]]):
+        started = self._round_started.pop(round_num, None)
+        with self._lock:
+            self.rounds += 1
+            if started is not None:
+                self.round_times[round_num] = time.perf_counter() - started
+
+    def summary(self) -> Dict[str, Any]:
+        """以字典返回当前的汇总结果，便于打印或写入JSON"""
+        with self._lock:
+            return {
+                "rounds": self.rounds,
+                "round_seconds": dict(self.round_times),
+                "total": asdict(self.total),
+                "by_agent": {agent: asdict(stats) for agent, stats in self.by_agent.items()},
+                "by_round": {round_num: asdict(stats) for round_num, stats in self.by_round.items()},
+                "by_method": {f"{agent}.{method}": asdict(stats) for (agent, method), stats in self.by_method.items()},
+            }
+
+    def write_prometheus(self, path: str, prefix: str = "virtuoso"):
+        """按Prometheus文本格式写出汇总结果，供node_exporter的textfile collector采集；先写临时文件再替换，避免读到半个文件"""
+        metrics = (
+            ("llm_calls_total", "counter", "LLM调用次数", "calls"),
+            ("llm_errors_total", "counter", "失败的LLM调用次数", "errors"),
+            ("llm_cache_hits_total", "counter", "命中响应缓存的调用次数", "cache_hits"),
+            ("llm_retries_total", "counter", "重试次数", "retries"),
+            ("llm_wall_seconds_total", "counter", "调用总耗时", "wall_time"),
+            ("llm_queue_seconds_total", "counter", "排队与限流等待总耗时", "queue_time"),
+            ("llm_prompt_tokens_total", "counter", "提示词token数", "prompt_tokens"),
+            ("llm_completion_tokens_total", "counter", "生成token数", "completion_tokens"),
+            ("llm_cost_total", "counter", "按prices估算的费用", "cost"),
+        )
+        with self._lock:
+            lines = []
+            for name, kind, help_text, attr in metrics:
+                lines.append(f"# HELP {prefix}_{name} {help_text}")
+                lines.append(f"# TYPE {prefix}_{name} {kind}")
+                for (agent, method), stats in sorted(self.by_method.items()):
+                    labels = f'agent="{_escape(agent)}",method="{_escape(method)}"'
+                    lines.append(f"{prefix}_{name}{{{labels}}} {getattr(stats, attr)}")
+            lines.append(f"# HELP {prefix}_rounds_total 已完成的轮数")
+            lines.append(f"# TYPE {prefix}_rounds_total counter")
+            lines.append(f"{prefix}_rounds_total {self.rounds}")
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp_path, path)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class JsonlTraceSubscriber(Subscriber):
+    """把每次调用和每轮的开始/结束追加为一行JSON，可边运行边tail"""
+    def __init__(self, path: str, fsync_every: int = 50, fsync_interval: float = 5.0):
+        self.path = path
+        self._file = _AppendFile(path, fsync_every, fsync_interval)
+        self._lock = threading.Lock()
+
+    def _write(self, record: Dict[str, Any]):
+        with self._lock:
+            self._file.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+
+    def on_call(self, record: CallRecord):
+        self._write(dict(asdict(record), type="call"))
+
+    def on_round_start(self, round_num: int):
+        self._write({"type": "round_start", "round": round_num, "timestamp": time.time()})
+
+    def on_round_end(self, round_num: int, results: List[Dict[str, Any]]):
+        self._write({"type": "round_end", "round": round_num, "timestamp": time.time()})
+
+    def on_stop(self, round_num: int, reason: str):
+        self._write({"type": "stop", "round": round_num, "reason": reason, "timestamp": time.time()})
+
+    def close(self):
+        self._file.close()
@@ -0,0 +1,298 @@
+from typing import List, Dict, Any, Optional, Union
+import os
+import re
+import json
+import socket
+import time
+import hashlib
+import threading
+from pydantic import BaseModel, ConfigDict, ValidationError
+from .tinyperson import TinyPerson
+
+INDEX_FILE = ".index.json"
+INDEX_VERSION = 1
+INDEX_WRITE_INTERVAL = 1.0  # save之后最多每隔这么多秒写一次索引，其余由flush写出
+
+
+class RichPersona(BaseModel):
+    """agents/目录中的完整角色设定（与experiment1.py的PersonaModel一致），其他字段原样保留"""
+    model_config = ConfigDict(extra="allow")
+    name: str
+    age: int
+    gender: str
+    nationality: str
+    occupation: Dict[str, str]
+    long_term_goals: List[str]
+    personality: Dict[str, Any]
+    style: str = ""
+    skills: List[str] = []
+    preferences: Dict[str, Any] = {}
+
+
+class RichAgentFile(BaseModel):
+    model_config = ConfigDict(extra="allow")
+    type: str = "TinyPerson"
+    persona: RichPersona
+
+
+class SimplePersona(BaseModel):
+    """TinyPerson.to_dict格式的角色（工厂生成的角色以这种格式保存）"""
+    model_config = ConfigDict(extra="allow")
+    name: str
+    role: str
+    traits: List[str]
+    personality: Dict[str, Any]
+
+
+class PersonaValidationError(ValueError):
+    """角色文件不符合任何一种角色格式"""
+
+
+def generation_key(scene: str, instruction: str, occurrence: int = 0) -> str:
+    """工厂生成角色时的场景和指令对应的键，用于判断角色是否已经生成过。
+
+    occurrence为同一批指令中相同指令的序号（第几次出现，从0开始），重复的指令各自对应不同的角色。"""
+    text = f"{scene}\n{instruction}" if occurrence == 0 else f"{scene}\n{instruction}\n{occurrence}"
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def _summary(data: Dict[str, Any]) -> Dict[str, Any]:
+    """不做校验地从原始JSON中提取索引字段"""
+    persona = data.get("persona") if isinstance(data.get("persona"), dict) else data
+    occupation = persona.get("occupation")
+    if isinstance(occupation, dict):
+        occupation = occupation.get("title")
+    personality = persona.get("personality") if isinstance(persona.get("personality"), dict) else {}
+    traits = persona.get("traits") or personality.get("traits") or []
+    generation = data.get("generation") or {}
+    return {
+        "name": persona.get("name"),
+        "occupation": occupation or persona.get("role"),
+        "nationality": persona.get("nationality"),
+        "traits": [str(trait) for trait in traits] if isinstance(traits, list) else [],
+        "generation": (generation_key(generation["scene"], generation["instruction"],
+                                      generation.get("occurrence", 0))
+                       if "scene" in generation and "instruction" in generation else None),
+    }
+
+
+def _validate(data: Dict[str, Any]) -> Dict[str, Any]:
+    """校验角色文件并转换为TinyPerson.from_dict接受的格式"""
+    errors = []
+    if "persona" in data:
+        try:
+            persona = RichAgentFile.model_validate(data).persona
+        except ValidationError as e:
+            errors.append(e)
+        else:
+            occupation = persona.occupation
+            role = occupation.get("title", "")
+            if occupation.get("organization"):
+                role = f"{role}（{occupation['organization']}）"
+            return {
+                "name": persona.name,
+                "role": role,
+                "traits": list(persona.personality.get("traits", [])),
+                "personality": {
+                    "style": persona.style,
+                    "expertise": persona.skills,
+                    "interests": persona.preferences.get("interests", []),
+                    "goals": persona.long_term_goals,
+                },
+                "profile": persona.model_dump(),
+            }
+    try:
+        return SimplePersona.model_validate(data).model_dump()
+    except ValidationError as e:
+        errors.append(e)
+    raise PersonaValidationError("\n".join(str(error) for error in errors))
+
+
+class PersonaLibrary:
+    """角色库：一个目录中的角色JSON文件，按名字、职业、国籍和性格特质建立索引。
+
+    索引记录每个文件的大小和修改时间，打开时只重新读取新增或修改过的文件，上万个角色的库也能在毫秒级完成加载。
+    索引默认保存在目录下的.index.json中，也可以通过index_path指定其他位置；默认的索引只在save（以及之后的flush）时写出，
+    只读使用时索引只在内存中建立，不会改动角色目录；指定了index_path时，refresh发现的变化也会写入该位置。角色文件在第一次使用时才读取和校验，校验结果缓存在内存中。
+    每个角色的键是文件名（不含.json），同名角色可以共存。
+    索引写入不及时（例如进程在flush之前退出）只会让下次打开时多读取几个文件，不会丢失角色。"""
+    def __init__(self, directory: str, refresh: bool = True, index_path: Optional[str] = None):
+        self.directory = directory
+        self._index_path = index_path or os.path.join(directory, INDEX_FILE)
+        self._cache_index = index_path is not None  # 调用方指定的索引位置：refresh之后也写出索引
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._validated: Dict[str, Dict[str, Any]] = {}
+        self._by_name: Optional[Dict[str, str]] = None  # 名字/生成键到角色键的映射，索引变化后重建
+        self._by_generation: Optional[Dict[str, str]] = None
+        self._dirty = False  # 有save之后尚未写出的索引
+        self._index_written = 0.0
+        self._lock = threading.RLock()
+        self._load_index()
+        if refresh:
+            self.refresh()
+
+    @property
+    def index_path(self) -> str:
+        return self._index_path
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def _load_index(self):
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                index = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return
+        if index.get("version") == INDEX_VERSION:
+            self._entries = index["entries"]
+
+    def _save_index(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.index_path)), exist_ok=True)
+        tmp_path = f"{self.index_path}.{socket.gethostname()}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": INDEX_VERSION, "entries": self._entries}, f, ensure_ascii=False,
+                      separators=(",", ":"))
+        os.replace(tmp_path, self.index_path)
+        self._dirty = False
+        self._index_written = time.monotonic()
+
+    def flush(self):
+        """写出save之后尚未保存的索引"""
+        with self._lock:
+            if self._dirty:
+                self._save_index()
+
+    def _changed(self, key: str):
+        self._validated.pop(key, None)
+        self._by_name = self._by_generation = None
+
+    def refresh(self) -> int:
+        """按文件大小和修改时间同步内存中的索引，返回重新读取的文件数"""
+        with self._lock:
+            seen, changed = set(), 0
+            try:
+                with os.scandir(self.directory) as scan:
+                    entries = list(scan)
+            except FileNotFoundError:
+                entries = []
+            for entry in entries:
+                if not entry.name.endswith(".json") or entry.name.startswith("."):
+                    continue
+                key = entry.name[:-len(".json")]
+                seen.add(key)
+                stat = entry.stat()
+                indexed = self._entries.get(key)
+                if indexed and indexed["size"] == stat.st_size and indexed["mtime_ns"] == stat.st_mtime_ns:
+                    continue
+                try:
+                    with open(entry.path, "r", encoding="utf-8") as f:
+                        summary = _summary(json.load(f))
+                except (json.JSONDecodeError, UnicodeDecodeError, AttributeError):
+                    continue
+                self._entries[key] = dict(summary, size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+                self._changed(key)
+                changed += 1
+            removed = set(self._entries) - seen
+            for key in removed:
+                del self._entries[key]
+                self._changed(key)
+            if self._cache_index and (changed or removed or not os.path.exists(self.index_path)):
+                self._save_index()
+            return changed
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key_or_name: str) -> bool:
+        return self._resolve(key_or_name) is not None
+
+    def keys(self) -> List[str]:
+        return sorted(self._entries)
+
+    def entry(self, key: str) -> Dict[str, Any]:
+        """索引中的信息（name、occupation、nationality、traits），不读取角色文件"""
+        return self._entries[key]
+
+    def _build_lookups(self):
+        with self._lock:
+            if self._by_name is None:
+                by_name, by_generation = {}, {}
+                for key in sorted(self._entries, reverse=True):  # 同名时取键最小的
+                    entry = self._entries[key]
+                    by_name[entry["name"]] = key
+                    if entry.get("generation"):
+                        by_generation[entry["generation"]] = key
+                self._by_name, self._by_generation = by_name, by_generation
+
+    def _resolve(self, key_or_name: str) -> Optional[str]:
+        if key_or_name in self._entries:
+            return key_or_name
+        self._build_lookups()
+        return self._by_name.get(key_or_name)
+
+    def find(self, name: Optional[str] = None, occupation: Optional[str] = None,
+             nationality: Optional[str] = None, trait: Optional[str] = None,
+             limit: Optional[int] = None) -> List[str]:
+        """按索引筛选角色，返回键的列表。name、nationality不区分大小写完全匹配，occupation、trait为子串匹配"""
+        def matches(entry: Dict[str, Any]) -> bool:
+            if name is not None and (entry["name"] or "").lower() != name.lower():
+                return False
+            if nationality is not None and (entry["nationality"] or "").lower() != nationality.lower():
+                return False
+            if occupation is not None and occupation.lower() not in (entry["occupation"] or "").lower():
+                return False
+            return trait is None or any(trait.lower() in item.lower() for item in entry["traits"])
+
+        keys = [key for key in sorted(self._entries) if matches(self._entries[key])]
+        return keys[:limit] if limit is not None else keys
+
+    def find_generated(self, scene: str, instruction: str, occurrence: int = 0) -> Optional[str]:
+        """工厂按该场景和指令生成过的角色的键，occurrence见generation_key"""
+        self._build_lookups()
+        return self._by_generation.get(generation_key(scene, instruction, occurrence))
+
+    def data(self, key_or_name: str) -> Dict[str, Any]:
+        """读取并校验角色文件（只在第一次使用时进行），返回TinyPerson.from_dict格式的字典"""
+        key = self._resolve(key_or_name)
+        if key is None:
+            raise KeyError(key_or_name)
+        with self._lock:
+            if key not in self._validated:
+                with open(self._path(key), "r", encoding="utf-8") as f:
+                    self._validated[key] = _validate(json.load(f))
+            return self._validated[key]
+
+    def get(self, key_or_name: str, **kwargs) -> TinyPerson:
+        """创建一个新的TinyPerson实例，kwargs会传给TinyPerson（例如act_mode、注入的LLM客户端）"""
+        data = self.data(key_or_name)
+        return TinyPerson.from_dict({key: value for key, value in data.items() if key != "profile"}, **kwargs)
+
+    def save(self, person: Union[TinyPerson, Dict[str, Any]], key: Optional[str] = None,
+             generation: Optional[Dict[str, str]] = None) -> str:
+        """把角色写入库中，返回它的键。TinyPerson只保存角色设定，不保存对话历史和记忆；
+        generation为工厂生成该角色时的{"scene", "instruction", "occurrence"}，occurrence为0时可以省略"""
+        data = dict(person.to_dict() if isinstance(person, TinyPerson) else person)
+        for transient in ("conversation_history", "memory"):
+            data.pop(transient, None)
+        if generation is not None:
+            data["generation"] = generation
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            if key is None:
+                base = re.sub(r"[^\w.-]+", "_", str(_summary(data)["name"] or "persona")).strip("_.") or "persona"
+                key, suffix = base, 2
+                while key in self._entries or os.path.exists(self._path(key)):
+                    key, suffix = f"{base}-{suffix}", suffix + 1
+            path = self._path(key)
+            tmp_path = f"{path}.{socket.gethostname()}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False, indent=4)
+            os.replace(tmp_path, path)
+            stat = os.stat(path)
+            self._entries[key] = dict(_summary(data), size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+            self._changed(key)
+            self._dirty = True
+            if time.monotonic() - self._index_written >= INDEX_WRITE_INTERVAL:
+                self._save_index()
+        return key
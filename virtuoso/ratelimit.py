@@ -0,0 +1,170 @@
+from typing import Optional
+import os
+import time
+import random
+import asyncio
+import threading
+import configparser
+from email.utils import parsedate_to_datetime
+import openai
+
+
+class TokenBucket:
+    """令牌桶：容量为每分钟的配额，按每秒capacity/60的速度匀速补充。
+
+    reserve先扣减令牌（允许欠账），返回需要等待的秒数，调用方等待后即可发出请求；
+    这样多个线程或协程按预约顺序依次放行，不会在令牌补充的瞬间一拥而上。"""
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount: float) -> float:
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= amount
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def refund(self, amount: float):
+        """归还（amount为负时补扣）令牌，用于按实际用量修正预估值"""
+        with self._lock:
+            self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class RateLimiter:
+    """进程内共享的请求数/token数限流器（RPM/TPM），为None的维度不限制"""
+    def __init__(self, requests_per_minute: Optional[float] = None, tokens_per_minute: Optional[float] = None):
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+
+    def _reserve(self, tokens: int) -> float:
+        wait = 0.0
+        if self.requests is not None:
+            wait = max(wait, self.requests.reserve(1))
+        if self.tokens is not None:
+            wait = max(wait, self.tokens.reserve(tokens))
+        return wait
+
+    def acquire(self, tokens: int) -> float:
+        """等待直到可以发出一个预计消耗tokens个token的请求，返回等待的秒数"""
+        wait = self._reserve(tokens)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    async def aacquire(self, tokens: int) -> float:
+        wait = self._reserve(tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return wait
+
+    def settle(self, estimated: int, actual: Optional[int]):
+        """请求完成后按实际token用量修正预估值"""
+        if self.tokens is not None and actual is not None:
+            self.tokens.refund(estimated - actual)
+
+
+class RetryPolicy:
+    """带随机抖动的指数退避重试策略，优先遵循服务端返回的Retry-After"""
+    RETRYABLE_STATUS = (408, 409, 429)
+
+    def __init__(self, max_attempts: int = 5, waiting_time: float = 2.0, backoff_factor: float = 5.0,
+                 max_waiting_time: float = 60.0):
+        self.max_attempts = max(1, max_attempts)
+        self.waiting_time = waiting_time
+        self.backoff_factor = backoff_factor
+        self.max_waiting_time = max_waiting_time
+
+    def is_retryable(self, error: Exception) -> bool:
+        if isinstance(error, (openai.APIConnectionError, openai.APITimeoutError)):
+            return True
+        if isinstance(error, openai.APIStatusError):
+            return error.status_code in self.RETRYABLE_STATUS or error.status_code >= 500
+        return False
+
+    def delay(self, attempt: int, error: Exception) -> float:
+        """第attempt次失败后的等待秒数"""
+        retry_after = _retry_after(error)
+        if retry_after is not None:
+            return min(retry_after, self.max_waiting_time)
+        base = min(self.waiting_time * self.backoff_factor ** (attempt - 1), self.max_waiting_time)
+        return base / 2 + random.uniform(0, base / 2)
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    """解析响应头中的retry-after-ms / retry-after（秒数或HTTP日期）"""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        value = headers.get("retry-after")
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+_limiter: Optional[RateLimiter] = None
+_retry_policy: Optional[RetryPolicy] = None
+_loaded = False
+_lock = threading.Lock()
+
+
+def _load_from_ini(path: Optional[str], section: str = "OpenAI"):
+    """按config.ini的RPM_LIMIT/TPM_LIMIT/MAX_ATTEMPTS/WAITING_TIME/EXPONENTIAL_BACKOFF_FACTOR创建限流器和重试策略"""
+    parser = configparser.ConfigParser()
+    if path:
+        parser.read(path, encoding="utf-8")
+    options = parser[section] if parser.has_section(section) else {}
+
+    def optional(key, cast):
+        raw = options.get(key, "").strip()
+        return cast(raw) if raw else None
+
+    rpm, tpm = optional("RPM_LIMIT", float), optional("TPM_LIMIT", float)
+    limiter = RateLimiter(rpm, tpm) if rpm or tpm else None
+    retry_options = {
+        "max_attempts": optional("MAX_ATTEMPTS", int),
+        "waiting_time": optional("WAITING_TIME", float),
+        "backoff_factor": optional("EXPONENTIAL_BACKOFF_FACTOR", float),
+        "max_waiting_time": optional("MAX_WAITING_TIME", float),
+    }
+    return limiter, RetryPolicy(**{key: value for key, value in retry_options.items() if value is not None})
+
+
+def configure_rate_limits(limiter: Optional[RateLimiter] = None, retry_policy: Optional[RetryPolicy] = None):
+    """设置进程内共享的限流器和重试策略；limiter为None表示不限流，retry_policy为None时使用默认策略"""
+    global _limiter, _retry_policy, _loaded
+    with _lock:
+        _limiter = limiter
+        _retry_policy = retry_policy or RetryPolicy()
+        _loaded = True
+
+
+def _ensure_loaded():
+    global _limiter, _retry_policy, _loaded
+    with _lock:
+        if not _loaded:
+            _limiter, _retry_policy = _load_from_ini("config.ini" if os.path.exists("config.ini") else None)
+            _loaded = True
+
+
+def get_rate_limiter() -> Optional[RateLimiter]:
+    _ensure_loaded()
+    return _limiter
+
+
+def get_retry_policy() -> RetryPolicy:
+    _ensure_loaded()
+    return _retry_policy
@@ -3,7 +3,37 @@ import time
 from abc import ABC, abstractmethod
 from openai import OpenAI
 import re
+import json
 from .baseagent import*
+from collections import deque
+import os
+import threading
+from .contextbuilder import estimate_tokens, parse_shared_key
+from .llmclient import (create_chat_completion, acreate_chat_completion,
+                        stream_chat_completion, astream_chat_completion)
+
+# structured模式下模型需要返回的字段，以及补问之后仍然缺失时用于单独生成的方法
+STRUCTURED_FIELDS = {"thought": "think", "speech": "speak1", "action": "behavior"}
+
+
+def _structured_retry_messages(messages: List[Dict[str, str]], content: Optional[str],
+                               missing: List[str]) -> List[Dict[str, str]]:
+    """structured模式输出无效或缺少字段时的补问消息：原消息加上上一次的输出和只针对missing字段的要求
+    （请求参数不同，不会命中同一条缓存）"""
+    names = "、".join(missing)
+    problem = ("上面的输出不是有效的JSON对象。" if len(missing) == len(STRUCTURED_FIELDS)
+               else f"上面的输出缺少{names}字段或字段内容无效。")
+    return messages + [
+        {"role": "assistant", "content": content or ""},
+        {"role": "user", "content": f"{problem}请只输出一个JSON对象，包含{names}字段，字段内容为非空字符串。"},
+    ]
+
+
+# 提示词布局：inline 把角色设定和上下文拼成一条用户消息；
+# messages 角色设定作为固定的system消息，对话历史按时间顺序展开为消息列表，指令放在最后，
+# 相邻调用共享尽可能长的前缀，便于服务端的前缀/KV缓存命中
+PROMPT_LAYOUTS = ("inline", "messages")
+
 
 class TinyPerson(BaseAgent):
     """
@@ -13,39 +43,162 @@ class TinyPerson(BaseAgent):
     参见和其他类似方法，
     并且通过act方法执行动作。 
     还提供了listen_and_act等便利方法。"""
-    def __init__(self, name: str, role: str, traits: List[str], personality: Dict[str, Any]):
-        super().__init__(name, role, traits)
+    def __init__(self, name: str, role: str, traits: List[str], personality: Dict[str, Any],
+                 act_mode: str = "sequential", api_client: Optional[OpenAI] = None,
+                 async_api_client: Optional[AsyncOpenAI] = None, prompt_layout: str = "inline",
+                 memory: Optional["EpisodicMemory"] = None, history_limit: Optional[int] = None,
+                 temperature: float = 0.7, seed: Optional[int] = None):
+        super().__init__(name, role, traits, act_mode=act_mode, api_client=api_client,
+                         async_api_client=async_api_client, history_limit=history_limit)
+        if prompt_layout not in PROMPT_LAYOUTS:
+            raise ValueError(f"未知的prompt_layout: {prompt_layout}，可选值为{PROMPT_LAYOUTS}")
         self.personality = personality
         self.interests = personality.get("interests", [])
         self.goals = personality.get("goals", [])
+        self.prompt_layout = prompt_layout
+        # 采样参数；seed会作为请求的seed参数发送（服务端支持时可复现），None表示不发送
+        self.temperature = temperature
+        self.seed = seed
+        # 最近的LLM调用统计（方法名、提示词token数等）；measure_prefix为True时还计算与同一方法上一次请求共享的前缀比例
+        self.call_stats = deque(maxlen=1000)
+        self.measure_prefix = False
+        self._last_requests: Dict[str, str] = {}  # 每个方法上一次请求的文本，只在measure_prefix为True时保存
+        self._stats_lock = threading.Lock()
+        # 长期情景记忆（memory.EpisodicMemory）：每个回应存入记忆，构建提示词时检索最相关的几条
+        self.memory = memory
+        self._recall_cache = None
+        self.refresh_persona()
+
+    def refresh_persona(self):
+        """预先编译角色设定中不随对话变化的文本，修改name/role/traits/personality后需重新调用"""
+        style = self.personality.get('style', '')
+        self._persona = {
+            "traits": ', '.join(self.traits),
+            "expertise": ', '.join(self.personality.get('expertise', [])),
+            "interests": ', '.join(self.interests),
+            "goals": ', '.join(self.goals),
+        }
+        self._system_message = {"role": "system", "content": (
+            f"你正在扮演{self.name}，一位{self.role}。你的核心特质是：{self._persona['traits']}。\n"
+            f"个性风格：{style}\n"
+            f"专业领域：{self._persona['expertise']}\n"
+            f"兴趣爱好：{self._persona['interests']}\n"
+            f"当前目标：{self._persona['goals']}\n"
+            f"请始终以该角色的身份进行思考、对话和行动，保持自然，不要刻意强调角色设定，不要模板化。")}
+        self._instructions = {
+            "think": ("请按照以下格式输出角色当前事件下的思考：\n"
+                      f"[思考中....] 进行内部思考，以及对其他人的看法，考虑当前对话场景和对话上下文历史，以及其他人物的行动和你的行动，符合角色设定和{self.goals}目标。\n"
+                      f"你可以结合你的{style}风格进行思考，保持自然的思考方式，别太刻意按照模板来。"),
+            "speak1": ("请按照以下格式输出角色当前事件下的对话：\n"
+                       "[对话中....]  输出符合角色设定的对话内容，要求符合当前对话主题，结合上下文信息，"
+                       f"保持上下文连贯和自然的对话风格，结合你的{style}沟通方式，不要刻意强调你的角色设定，不要模板化，更专注于当前场景事件。\n"
+                       f"你的对话内容应该符合角色设定和{self.goals}目标。"),
+            "behavior": ("请按照以下格式输出角色当下的行动：\n"
+                         f"[行动中....]  输出符合角色设定的行动内容，角色接下来具体的行动和将要做的事，要求符合当前对话主题，结合上下文信息，符合角色{self.goals}目标，"
+                         "保持上下文连贯和自然的行为逻辑，不要太刻意模板化，同时不要上文做了什么事，下一步突然做别的事了。"),
+            "act": ("请以JSON对象输出角色在当前事件下的思考、对话和行动，包含以下三个字符串字段：\n"
+                    f"- thought：[思考中....] 进行内部思考，以及对其他人的看法，考虑当前对话场景和对话上下文历史，以及其他人物的行动和你的行动，符合角色设定和{self.goals}目标。\n"
+                    f"- speech：[对话中....] 输出符合角色设定的对话内容，要求符合当前对话主题，结合上下文信息，保持上下文连贯和自然的对话风格，结合你的{style}沟通方式。\n"
+                    f"- action：[行动中....] 输出角色接下来具体的行动和将要做的事，符合角色{self.goals}目标，保持上下文连贯和自然的行为逻辑。"),
+            "speak": f"需要结合{style}的风格进行回应，并自然融入专业领域知识。另外保持自然的说话方式，别太刻意按照模板来说话。",
+        }
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = super().to_dict()
+        data["personality"] = self.personality
+        data["prompt_layout"] = self.prompt_layout
+        data["temperature"] = self.temperature
+        data["seed"] = self.seed
+        if self.memory is not None:
+            data["memory"] = self.memory.to_dict()
+        return data
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any], **kwargs) -> "TinyPerson":
+        if "memory" in data and "memory" not in kwargs:
+            from .memory import EpisodicMemory
+            kwargs["memory"] = EpisodicMemory.from_dict(data["memory"])
+        agent = cls(data["name"], data["role"], data["traits"], data["personality"],
+                    act_mode=data.get("act_mode", "sequential"),
+                    prompt_layout=data.get("prompt_layout", "inline"),
+                    temperature=data.get("temperature", 0.7), seed=data.get("seed"),
+                    **dict({"history_limit": data.get("history_limit")}, **kwargs))
+        agent.conversation_history.extend(data.get("conversation_history", []))
+        return agent
 
     def listen_and_act(self, stimulus: str) -> str:
         """接收环境刺激并生成回应"""
-        context = {
+        reply = self.speak(scene="互动对话", context=self._stimulus_context(stimulus))
+        self._remember(f"收到的提问：{stimulus}\n我的回答：{reply}")
+        return reply
+
+    async def alisten_and_act(self, stimulus: str) -> str:
+        """listen_and_act的异步版本"""
+        reply = await self.aspeak(scene="互动对话", context=self._stimulus_context(stimulus))
+        self._remember(f"收到的提问：{stimulus}\n我的回答：{reply}")
+        return reply
+
+    def _build_response(self, round_num: int, thought: str, speech: str, action: str,
+                        errors: Dict[str, str]) -> Dict[str, str]:
+        response = super()._build_response(round_num, thought, speech, action, errors)
+        self._remember(f"[第{round_num}轮] 我的思考：{thought}\n我说：{speech}\n我的行动：{action}", round_num)
+        return response
+
+    def _remember(self, text: str, round_num: Optional[int] = None):
+        if self.memory is not None:
+            self.memory.add(text, round_num)
+
+    def _recall(self, scene: str, context: Dict[str, Any]) -> Dict[str, Any]:
+        """从长期记忆中检索与当前刺激最相关的记忆，放入上下文的relevant_memories；
+        recent_history中已有的轮次不重复检索。同一轮的多次调用复用检索结果。"""
+        if self.memory is None or len(self.memory) == 0:
+            return context
+        round_num = context.get("round")
+        query_parts = [context.get("current_stimulus") or scene]
+        recent_rounds = set()
+        for round_data in context.get("recent_history", []):
+            recent_rounds.add(round_data.get("round"))
+            if round_data is context["recent_history"][-1]:
+                query_parts.extend(turn["speech"] for turn in round_data.get("results", []))
+        for key, value in context.get("shared_memory", {}).items():
+            parsed = parse_shared_key(key)
+            if parsed is not None and parsed[1] == round_num:
+                query_parts.append(str(value))
+        query = "\n".join(query_parts)
+        cache_key = (query, len(self.memory))
+        if self._recall_cache is None or self._recall_cache[0] != cache_key:
+            memories = [text for _, text, _ in self.memory.search(query, exclude_rounds=recent_rounds)]
+            self._recall_cache = (cache_key, memories)
+        memories = self._recall_cache[1]
+        return dict(context, relevant_memories=memories) if memories else context
+
+    def _stimulus_context(self, stimulus: str) -> Dict[str, Any]:
+        return {
             "current_stimulus": stimulus,
             "personality": self.personality,
             "interests": self.interests,
             "goals": self.goals
         }
-        return self.speak(scene="互动对话", context=context)
     
     def _build_prompt(self, scene: str, context: Dict[str, Any]) -> str:
         # 扩展提示模板
-        prompt = f"""你正在扮演{self.name}，一位{self.role}。核心特质：{', '.join(self.traits)}
+        prompt = f"""你正在扮演{self.name}，一位{self.role}。核心特质：{self._persona['traits']}
         个性风格：{self.personality['style']}
-        专业领域：{', '.join(self.personality.get('expertise', []))}
-        兴趣爱好：{', '.join(self.interests)}
-        当前目标：{', '.join(self.goals)}
+        专业领域：{self._persona['expertise']}
+        兴趣爱好：{self._persona['interests']}
+        当前目标：{self._persona['goals']}
         
         当前场景：{scene}
         收到的提问：{context.get('current_stimulus', '')}
         需要结合{self.personality['style']}的风格进行回应，并自然融入专业领域知识。另外保持自然的说话方式，别太刻意按照模板来说话。
         """
+        if context.get("relevant_memories"):
+            prompt += f"相关的记忆：{context['relevant_memories']}\n"
         return prompt
         
     def _build_prompt_think(self, scene: str, context: Dict[str, Any]) -> str:
         """构建LLM提示词"""
-        return f"""你正在扮演{self.name}，一位{self.role}。你的核心特质是：{', '.join(self.traits)}。
+        return f"""你正在扮演{self.name}，一位{self.role}。你的核心特质是：{self._persona['traits']}。
         
         当前场景是：{scene}
         上下文记录：{context}
@@ -58,7 +211,7 @@ class TinyPerson(BaseAgent):
     
     def _build_prompt_speak(self, scene: str, context: Dict[str, Any]) -> str:
         """构建LLM提示词"""
-        return f"""你正在扮演{self.name}，一位{self.role}。你的核心特质是：{', '.join(self.traits)}。
+        return f"""你正在扮演{self.name}，一位{self.role}。你的核心特质是：{self._persona['traits']}。
         
         当前场景是：{scene}
         上下文记录：{context}
@@ -72,7 +225,7 @@ class TinyPerson(BaseAgent):
     
     def _build_prompt_act(self, scene: str, context: Dict[str, Any]) -> str:
         """构建LLM提示词"""
-        return f"""你正在扮演{self.name}，一位{self.role}。你的核心特质是：{', '.join(self.traits)}。
+        return f"""你正在扮演{self.name}，一位{self.role}。你的核心特质是：{self._persona['traits']}。
         
         当前场景是：{scene}
         上下文记录：{context}
@@ -82,61 +235,285 @@ class TinyPerson(BaseAgent):
         保持上下文连贯和自然的行为逻辑，不要太刻意模板化，同时不要上文做了什么事，下一步突然做别的事了。
         """
     
-    def think(self, scene: str, context: Dict[str, Any]) -> str:
-        """通过LLM生成思考过程"""
-        prompt = self._build_prompt_think(scene, context)
-        messages = [{"role": "user", "content": prompt}]
+    def _build_prompt_structured(self, scene: str, context: Dict[str, Any]) -> str:
+        """构建一次生成思考、对话和行动的LLM提示词"""
+        return f"""你正在扮演{self.name}，一位{self.role}。你的核心特质是：{self._persona['traits']}。
         
-        response = self.api_client.chat.completions.create(
-            model="qwen-plus",
-            messages=messages,
-            temperature=0.7,
-            max_tokens=300,
-           
-        )
+        当前场景是：{scene}
+        上下文记录：{context}
         
+        请以JSON对象输出角色在当前事件下的思考、对话和行动，包含以下三个字符串字段：
+        - thought：[思考中....] 进行内部思考，以及对其他人的看法，考虑当前对话场景和对话上下文历史，以及其他人物的行动和你的行动，符合角色设定和{self.goals}目标。
+        - speech：[对话中....] 输出符合角色设定的对话内容，要求符合当前对话主题，结合上下文信息，保持上下文连贯和自然的对话风格，结合你的{self.personality['style']}沟通方式，不要刻意强调你的角色设定，不要模板化。
+        - action：[行动中....] 输出角色接下来具体的行动和将要做的事，符合角色{self.goals}目标，保持上下文连贯和自然的行为逻辑，不要上文做了什么事，下一步突然做别的事了。
+        """
+
+    # inline布局下各方法对应的提示词构建方法
+    _INLINE_BUILDERS = {
+        "think": "_build_prompt_think",
+        "speak1": "_build_prompt_speak",
+        "behavior": "_build_prompt_act",
+        "act": "_build_prompt_structured",
+        "speak": "_build_prompt",
+    }
+
+    def _messages(self, method: str, scene: str, context: Dict[str, Any]) -> List[Dict[str, str]]:
+        """按prompt_layout构建某个方法的消息列表"""
+        context = self._recall(scene, context)
+        if self.prompt_layout == "inline":
+            return [{"role": "user", "content": getattr(self, self._INLINE_BUILDERS[method])(scene, context)}]
+
+        messages = [self._system_message, {"role": "user", "content": f"当前场景是：{scene}"}]
+        if method == "speak":
+            if context.get("relevant_memories"):
+                messages.append(self._memories_message(context["relevant_memories"]))
+            messages.append({"role": "user", "content": f"收到的提问：{context.get('current_stimulus', '')}\n"
+                                                        f"{self._instructions['speak']}"})
+            return messages
+        messages.extend(self._context_messages(context))
+        messages.append({"role": "user", "content": f"当前是第{context.get('round', '')}轮。\n{self._instructions[method]}"})
+        return messages
+
+    def _context_messages(self, context: Dict[str, Any]) -> List[Dict[str, str]]:
+        """把上下文按时间顺序展开为消息：自己的回应作为assistant消息，其他人的发言和行动作为user消息。
+
+        压缩得到的摘要在最前面，旧的轮次在前、新的轮次在后，相邻轮次的请求只在末尾追加内容；recent_history未覆盖的共享记忆
+        （例如本轮已发言的人）以及其他上下文字段附在历史之后。"""
+        messages = []
+        if context.get("digest"):
+            messages.append({"role": "user", "content": f"此前的剧情摘要：{context['digest']}"})
+        if context.get("personal_digest"):
+            messages.append({"role": "user", "content": f"你此前经历的摘要：{context['personal_digest']}"})
+        covered = set()
+        for round_data in context.get("recent_history", []):
+            round_num = round_data.get("round")
+            for turn in round_data.get("results", []):
+                covered.add((turn["agent"], round_num))
+                if turn["agent"] == self.name:
+                    content = f"[第{round_num}轮] [思考] {turn['thought']}\n[对话] {turn['speech']}\n[行动] {turn['action']}"
+                    messages.append({"role": "assistant", "content": content})
+                else:
+                    content = f"[第{round_num}轮] {turn['agent']}：{turn['speech']}\n[{turn['agent']}的行动] {turn['action']}"
+                    messages.append({"role": "user", "content": content})
+        shared = [f"{key}：{value}" for key, value in context.get("shared_memory", {}).items()
+                  if parse_shared_key(key) not in covered]
+        if shared:
+            messages.append({"role": "user", "content": "共享记忆：\n" + "\n".join(shared)})
+        for key, value in context.items():
+            if key not in ("scene", "round", "shared_memory", "recent_history", "current_stimulus",
+                           "relevant_memories", "digest", "personal_digest"):
+                messages.append({"role": "user", "content": f"{key}：{value}"})
+        if context.get("relevant_memories"):
+            messages.append(self._memories_message(context["relevant_memories"]))
+        return messages
+
+    @staticmethod
+    def _memories_message(memories: List[str]) -> Dict[str, str]:
+        return {"role": "user", "content": "相关的记忆：\n" + "\n".join(memories)}
+
+    def _request_params(self, messages: List[Dict[str, str]], max_tokens: int,
+                        json_mode: bool = False) -> Dict[str, Any]:
+        """构建chat.completions.create的调用参数，同步与异步接口共用"""
+        params = {
+            "model": "qwen-plus",
+            "messages": messages,
+            "temperature": self.temperature,
+            "max_tokens": max_tokens,
+        }
+        if self.seed is not None:
+            params["seed"] = self.seed
+        if json_mode:
+            params["response_format"] = {"type": "json_object"}
+        return params
+
+    def _complete(self, method: str, messages: List[Dict[str, str]], max_tokens: int,
+                  json_mode: bool = False, round_num: Optional[int] = None) -> str:
+        response = create_chat_completion(self.api_client, agent=self.name, method=method, round_num=round_num,
+                                          **self._request_params(messages, max_tokens, json_mode))
+        self._record_call(method, messages, response)
+        return response.choices[0].message.content
+
+    async def _acomplete(self, method: str, messages: List[Dict[str, str]], max_tokens: int,
+                         json_mode: bool = False, round_num: Optional[int] = None) -> str:
+        async with async_llm_slot():
+            response = await acreate_chat_completion(
+                self.async_api_client, agent=self.name, method=method, round_num=round_num,
+                **self._request_params(messages, max_tokens, json_mode))
+        self._record_call(method, messages, response)
         return response.choices[0].message.content
+
+    def _stream(self, method: str, messages: List[Dict[str, str]], max_tokens: int,
+                round_num: Optional[int] = None) -> Iterator[str]:
+        """流式调用，逐段产出文本增量"""
+        yield from stream_chat_completion(
+            self.api_client, on_complete=lambda response: self._record_call(method, messages, response),
+            agent=self.name, method=method, round_num=round_num, **self._request_params(messages, max_tokens))
+
+    async def _astream(self, method: str, messages: List[Dict[str, str]], max_tokens: int,
+                       round_num: Optional[int] = None) -> AsyncIterator[str]:
+        async with async_llm_slot():
+            async for delta in astream_chat_completion(
+                    self.async_api_client, on_complete=lambda response: self._record_call(method, messages, response),
+                    agent=self.name, method=method, round_num=round_num,
+                    **self._request_params(messages, max_tokens)):
+                yield delta
+
+    def _record_call(self, method: str, messages: List[Dict[str, str]], response: Any):
+        """记录单次调用的统计信息。
+
+        prompt_tokens取自服务端返回的usage，缺失时使用估算值；cached_tokens是服务端报告的命中前缀缓存的token数（不支持时为None）。
+        prefix_ratio是本次请求与该智能体同一方法上一次请求共享前缀占本次请求的比例，需要序列化并比较整段提示词，
+        只在measure_prefix为True时计算，否则为None。"""
+        usage = getattr(response, "usage", None)
+        request_text = json.dumps(messages, ensure_ascii=False) if usage is None or self.measure_prefix else ""
+        prefix_ratio = None
+        if self.measure_prefix:
+            with self._stats_lock:
+                previous = self._last_requests.get(method, "")
+                self._last_requests[method] = request_text
+            shared_prefix = len(os.path.commonprefix([request_text, previous]))
+            prefix_ratio = shared_prefix / len(request_text) if request_text else 0.0
+        details = getattr(usage, "prompt_tokens_details", None)
+        self.call_stats.append({
+            "method": method,
+            "prompt_tokens": usage.prompt_tokens if usage else estimate_tokens(request_text),
+            "completion_tokens": usage.completion_tokens if usage else None,
+            "estimated": usage is None,
+            "prefix_ratio": prefix_ratio,
+            "cached_tokens": getattr(details, "cached_tokens", None),
+        })
+
+    @property
+    def last_prompt_tokens(self) -> Optional[int]:
+        """最近一次调用的提示词token数"""
+        return self.call_stats[-1]["prompt_tokens"] if self.call_stats else None
+
+    def think(self, scene: str, context: Dict[str, Any]) -> str:
+        """通过LLM生成思考过程"""
+        return self._complete("think", self._messages("think", scene, context), max_tokens=300,
+                              round_num=context.get("round"))
     
     def speak1(self, scene: str, context: Dict[str, Any]) -> str:
         """通过LLM生成对话内容"""
-        prompt = self._build_prompt_speak(scene, context)
-        messages = [{"role": "user", "content": prompt}]
-        
-        response = self.api_client.chat.completions.create(
-            model="qwen-plus",
-            messages=messages,
-            temperature=0.7,
-            max_tokens=600,
-            
-        )
-        
-        return response.choices[0].message.content
+        return self._complete("speak1", self._messages("speak1", scene, context), max_tokens=600,
+                              round_num=context.get("round"))
     
     def behavior(self, scene: str, context: Dict[str, Any]) -> str:
         """通过LLM生成行为内容"""
-        prompt = self._build_prompt_act(scene, context)
-        messages = [{"role": "user", "content": prompt}]
-        
-        response = self.api_client.chat.completions.create(
-            model="qwen-plus",
-            messages=messages,
-            temperature=0.7,
-            max_tokens=600,
-          
-        )
-        
-        return response.choices[0].message.content
+        return self._complete("behavior", self._messages("behavior", scene, context), max_tokens=600,
+                              round_num=context.get("round"))
     
     def speak(self, scene: str, context: Dict[str, Any]) -> str:
         """通过LLM生成日常对话内容"""
-        prompt = self._build_prompt(scene, context)
-        messages = [{"role": "user", "content": prompt}]
-        
-        response = self.api_client.chat.completions.create(
-            model="qwen-plus",
-            messages=messages,
-            temperature=0.7,
-            max_tokens=500
-        )
-        
-        return response.choices[0].message.content
\ No newline at end of file
+        return self._complete("speak", self._messages("speak", scene, context), max_tokens=500,
+                              round_num=context.get("round"))
+
+    async def athink(self, scene: str, context: Dict[str, Any]) -> str:
+        return await self._acomplete("think", self._messages("think", scene, context), max_tokens=300,
+                                     round_num=context.get("round"))
+
+    async def aspeak1(self, scene: str, context: Dict[str, Any]) -> str:
+        return await self._acomplete("speak1", self._messages("speak1", scene, context), max_tokens=600,
+                                     round_num=context.get("round"))
+
+    async def abehavior(self, scene: str, context: Dict[str, Any]) -> str:
+        return await self._acomplete("behavior", self._messages("behavior", scene, context), max_tokens=600,
+                                     round_num=context.get("round"))
+
+    async def aspeak(self, scene: str, context: Dict[str, Any]) -> str:
+        return await self._acomplete("speak", self._messages("speak", scene, context), max_tokens=500,
+                                     round_num=context.get("round"))
+
+    def structured_turn(self, scene: str, context: Dict[str, Any]) -> Dict[str, str]:
+        """一次LLM调用生成thought/speech/action。
+
+        有字段缺失或格式错误时，把上一次的输出和只针对这些字段的要求追加到对话中，以JSON模式补问一次，
+        一个字段出错只多一次调用；补问之后仍然缺失的字段再用对应方法单独生成。"""
+        messages = self._messages("act", scene, context)
+        content = self._complete("act", messages, max_tokens=1500, json_mode=True, round_num=context.get("round"))
+        fields = self._validate_structured(content)
+        missing = [field for field in STRUCTURED_FIELDS if field not in fields]
+        if missing:
+            content = self._complete("act", _structured_retry_messages(messages, content, missing), max_tokens=1500,
+                                     json_mode=True, round_num=context.get("round"))
+            retried = self._validate_structured(content)
+            fields.update((field, retried[field]) for field in missing if field in retried)
+        for field, method in STRUCTURED_FIELDS.items():
+            if field not in fields:
+                fields[field] = getattr(self, method)(scene, context)
+        return fields
+
+    async def astructured_turn(self, scene: str, context: Dict[str, Any]) -> Dict[str, str]:
+        messages = self._messages("act", scene, context)
+        content = await self._acomplete("act", messages, max_tokens=1500, json_mode=True,
+                                        round_num=context.get("round"))
+        fields = self._validate_structured(content)
+        missing = [field for field in STRUCTURED_FIELDS if field not in fields]
+        if missing:
+            content = await self._acomplete("act", _structured_retry_messages(messages, content, missing),
+                                            max_tokens=1500, json_mode=True, round_num=context.get("round"))
+            retried = self._validate_structured(content)
+            fields.update((field, retried[field]) for field in missing if field in retried)
+        for field, method in STRUCTURED_FIELDS.items():
+            if field not in fields:
+                fields[field] = await getattr(self, "a" + method)(scene, context)
+        return fields
+
+    @staticmethod
+    def _validate_structured(content: Optional[str]) -> Dict[str, str]:
+        """解析structured模式的JSON输出，只保留内容为非空字符串的字段"""
+        data = None
+        if content:
+            try:
+                data = json.loads(content)
+            except json.JSONDecodeError:
+                match = re.search(r'\{.*\}', content, re.DOTALL)
+                if match:
+                    try:
+                        data = json.loads(match.group())
+                    except json.JSONDecodeError:
+                        data = None
+        if not isinstance(data, dict):
+            return {}
+        return {field: value.strip() for field, value in data.items()
+                if field in STRUCTURED_FIELDS and isinstance(value, str) and value.strip()}
+
+    def stream_think(self, scene: str, context: Dict[str, Any]) -> Iterator[str]:
+        """逐token生成思考过程"""
+        return self._stream("think", self._messages("think", scene, context), max_tokens=300,
+                            round_num=context.get("round"))
+
+    def stream_speak1(self, scene: str, context: Dict[str, Any]) -> Iterator[str]:
+        """逐token生成对话内容"""
+        return self._stream("speak1", self._messages("speak1", scene, context), max_tokens=600,
+                            round_num=context.get("round"))
+
+    def stream_behavior(self, scene: str, context: Dict[str, Any]) -> Iterator[str]:
+        """逐token生成行为内容"""
+        return self._stream("behavior", self._messages("behavior", scene, context), max_tokens=600,
+                            round_num=context.get("round"))
+
+    def stream_speak(self, scene: str, context: Dict[str, Any]) -> Iterator[str]:
+        """逐token生成日常对话内容"""
+        return self._stream("speak", self._messages("speak", scene, context), max_tokens=500,
+                            round_num=context.get("round"))
+
+    def astream_think(self, scene: str, context: Dict[str, Any]) -> AsyncIterator[str]:
+        return self._astream("think", self._messages("think", scene, context), max_tokens=300,
+                             round_num=context.get("round"))
+
+    def astream_speak1(self, scene: str, context: Dict[str, Any]) -> AsyncIterator[str]:
+        return self._astream("speak1", self._messages("speak1", scene, context), max_tokens=600,
+                             round_num=context.get("round"))
+
+    def astream_behavior(self, scene: str, context: Dict[str, Any]) -> AsyncIterator[str]:
+        return self._astream("behavior", self._messages("behavior", scene, context), max_tokens=600,
+                             round_num=context.get("round"))
+
+    def astream_speak(self, scene: str, context: Dict[str, Any]) -> AsyncIterator[str]:
+        return self._astream("speak", self._messages("speak", scene, context), max_tokens=500,
+                             round_num=context.get("round"))
+
+    def listen_and_act_stream(self, stimulus: str) -> Iterator[str]:
+        """listen_and_act的流式版本"""
+        return self.stream_speak(scene="互动对话", context=self._stimulus_context(stimulus))
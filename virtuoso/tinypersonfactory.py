@@ -1,12 +1,68 @@
 from typing import List, Dict, Any, Optional
 import time
 from abc import ABC, abstractmethod
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI
 import re
+import ast
+import json
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from .llmclient import get_client, get_async_client, create_chat_completion, acreate_chat_completion
+from .llmcache import discard_response
 from .baseagent import*
 from .tinyperson import*
+from .personas import PersonaLibrary
 
 
+# 生成角色时必须具备的属性
+REQUIRED_ATTRIBUTES = ("name", "role", "traits", "personality", "interests", "goals")
+# 每个角色预留的输出token数，以及一次调用的输出上限；per_call超出上限可容纳的角色数时拆成多次调用
+PERSON_TOKENS = 500
+MAX_BATCH_TOKENS = 8000
+
+
+class PersonaGenerationError(Exception):
+    """批量生成角色时部分指令重试后仍然失败；people中失败的位置为None，errors记录各指令的异常"""
+    def __init__(self, people: List[Optional["TinyPerson"]], errors: Dict[int, Exception]):
+        super().__init__(f"{len(errors)}/{len(people)}个角色生成失败")
+        self.people = people
+        self.errors = errors
+
+
+def _parse_json_fragment(content: str, pattern: str) -> Any:
+    """从模型输出中提取JSON片段，兼容模型输出Python字面量（单引号等）的情况"""
+    raw_json = re.search(pattern, content, re.DOTALL).group()
+    try:
+        return json.loads(raw_json)
+    except json.JSONDecodeError:
+        return ast.literal_eval(raw_json)
+
+
+def _variant(instruction: str, occurrence: int) -> str:
+    """同一指令第二次及之后出现时在提示中注明，让模型生成不同的角色，相应的调用也不会命中同一条缓存"""
+    if occurrence == 0:
+        return instruction
+    return f"{instruction}（按这条指令生成的第{occurrence + 1}个角色，与之前生成的角色不同）"
+
+
+def _parse_or_discard(params: Dict[str, Any], response: Any, parse) -> Any:
+    """解析响应内容；解析失败时从响应缓存中删除这次调用的响应再抛出异常，否则重试只会拿回同一个错误的响应"""
+    try:
+        return parse(response.choices[0].message.content)
+    except Exception:
+        discard_response(params)
+        raise
+
+
+def _occurrences(instructions: List[str]) -> List[int]:
+    """每条指令在之前出现过的次数，相同的指令据此对应角色库中不同的角色"""
+    seen: Dict[str, int] = {}
+    occurrences = []
+    for instruction in instructions:
+        occurrences.append(seen.get(instruction, 0))
+        seen[instruction] = occurrences[-1] + 1
+    return occurrences
 
 
 class TinyPersonFactory:
@@ -15,18 +71,35 @@ class TinyPersonFactory:
     根据此类可扩展用例：
     - 生成不同场景下的TinyPerson实例
     - 使用生成的一系列TinyPerson实例进行对话模拟
-    - 自动化对话调研"""
-    def __init__(self, base_scene: str):
+    - 自动化对话调研
+
+    设置library时，生成的角色会保存到角色库中，之后相同场景和指令直接从角色库读取，不再调用LLM；
+    批量生成时同一条指令出现多次，每次出现各自对应库中的一个角色，不会得到多个相同的角色。"""
+    def __init__(self, base_scene: str, api_client: Optional[OpenAI] = None,
+                 async_api_client: Optional[AsyncOpenAI] = None, library: Optional[PersonaLibrary] = None):
         self.base_scene = base_scene
-        self.api_client = OpenAI(
-            api_key="#",
-            base_url="#",
-        )
+        self._api_client = api_client
+        self._async_api_client = async_api_client
+        self.library = library
     
-    def _parse_instruction(self, instruction: str) -> Dict[str, Any]:
-        """使用LLM解析生成指令"""
+    @property
+    def api_client(self) -> OpenAI:
+        """未注入客户端时在第一次调用时才获取共享的客户端"""
+        if self._api_client is None:
+            return get_client()
+        return self._api_client
+
+    @property
+    def async_api_client(self) -> AsyncOpenAI:
+        """未注入异步客户端时使用当前事件循环共享的客户端"""
+        if self._async_api_client is None:
+            return get_async_client()
+        return self._async_api_client
+
+    def _request_params(self, instruction: str, occurrence: int = 0) -> Dict[str, Any]:
+        """构建解析指令的调用参数，同步与异步接口共用"""
         prompt = f"""请根据以下指令和主题场景生成符合指令主题以及适合出现在当前场景下的模拟角色，并按照下面要求提取人物属性：
-        指令：{instruction}
+        指令：{_variant(instruction, occurrence)}
         场景：{self.base_scene}
         
         按JSON格式返回包含以下字段的结构：
@@ -37,23 +110,77 @@ class TinyPersonFactory:
         - interests（3个兴趣爱好）
         - goals（2个当前目标）"""
         
-        response = self.api_client.chat.completions.create(
-            model="qwen-plus",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.4,
-            max_tokens=500,
-            #stream=True
+        return {
+            "model": "qwen-plus",
+            "messages": [{"role": "user", "content": prompt}],
+            "temperature": 0.4,
+            "max_tokens": PERSON_TOKENS,
+            #"stream": True
+        }
 
-        )
-        
-        # 提取并清理JSON内容
-        raw_json = re.search(r'\{.*\}', response.choices[0].message.content, re.DOTALL).group()
-        return eval(raw_json)
+    @staticmethod
+    def _extract_attributes(content: str) -> Dict[str, Any]:
+        # 提取并清理JSON内容，缺少必需属性时视为解析失败
+        attributes = _parse_json_fragment(content, r'\{.*\}')
+        if (not isinstance(attributes, dict) or any(key not in attributes for key in REQUIRED_ATTRIBUTES)
+                or not isinstance(attributes["personality"], dict)):
+            raise ValueError(f"角色属性缺失或格式错误: {content[:100]}")
+        return attributes
+    
+    def _parse_instruction(self, instruction: str, occurrence: int = 0) -> Dict[str, Any]:
+        """使用LLM解析生成指令，响应无法解析时从缓存中删除，重试时重新请求"""
+        params = self._request_params(instruction, occurrence)
+        response = create_chat_completion(self.api_client, method="generate_person", **params)
+        return _parse_or_discard(params, response, self._extract_attributes)
+
+    async def _aparse_instruction(self, instruction: str, occurrence: int = 0) -> Dict[str, Any]:
+        """_parse_instruction的异步版本"""
+        params = self._request_params(instruction, occurrence)
+        async with async_llm_slot():
+            response = await acreate_chat_completion(self.async_api_client, method="generate_person", **params)
+        return _parse_or_discard(params, response, self._extract_attributes)
     
     def generate_person(self, instruction: str) -> TinyPerson:
         """生成TinyPerson实例"""
-        attributes = self._parse_instruction(instruction)
-        
+        return self._generate_person(instruction)
+
+    async def agenerate_person(self, instruction: str) -> TinyPerson:
+        """generate_person的异步版本"""
+        return await self._agenerate_person(instruction)
+
+    def _generate_person(self, instruction: str, occurrence: int = 0) -> TinyPerson:
+        person = self._from_library(instruction, occurrence)
+        if person is None:
+            person = self._save_to_library(self._build_person(self._parse_instruction(instruction, occurrence)),
+                                           instruction, occurrence)
+        return person
+
+    async def _agenerate_person(self, instruction: str, occurrence: int = 0) -> TinyPerson:
+        person = self._from_library(instruction, occurrence)
+        if person is None:
+            person = self._save_to_library(self._build_person(await self._aparse_instruction(instruction, occurrence)),
+                                           instruction, occurrence)
+        return person
+
+    def _from_library(self, instruction: str, occurrence: int = 0) -> Optional[TinyPerson]:
+        """角色库中已有按该场景和指令生成的角色时直接读取，occurrence为该指令在本批中第几次出现"""
+        if self.library is None:
+            return None
+        key = self.library.find_generated(self.base_scene, instruction, occurrence)
+        if key is None:
+            return None
+        return self.library.get(key, api_client=self._api_client, async_api_client=self._async_api_client)
+
+    def _save_to_library(self, person: TinyPerson, instruction: str, occurrence: int = 0) -> TinyPerson:
+        if self.library is not None:
+            generation = {"scene": self.base_scene, "instruction": instruction}
+            if occurrence:
+                generation["occurrence"] = occurrence
+            self.library.save(person, generation=generation)
+        return person
+
+    def _build_person(self, attributes: Dict[str, Any]) -> TinyPerson:
+        """用解析出的属性构建TinyPerson，生成的角色沿用工厂的LLM客户端"""
         return TinyPerson(
             name=attributes["name"],
             role=attributes["role"],
@@ -63,5 +190,184 @@ class TinyPersonFactory:
                 "expertise": attributes["personality"]["expertise"],
                 "interests": attributes["interests"],
                 "goals": attributes["goals"]
-            }
-        )
\ No newline at end of file
+            },
+            api_client=self._api_client,
+            async_api_client=self._async_api_client
+        )
+
+    def generate_people(self, instructions: List[str], concurrency: int = 4, per_call: int = 1,
+                        max_retries: int = 2, progress_callback=None) -> List[TinyPerson]:
+        """批量生成TinyPerson实例，返回顺序与instructions一致。
+
+        - concurrency：同时进行的LLM调用数
+        - per_call：每次调用让模型一次生成的角色数（JSON数组），缺失或格式错误的条目单独重试；
+          最多为MAX_BATCH_TOKENS // PERSON_TOKENS，超出时拆成多次调用
+        - max_retries：单个角色失败后的重试次数
+        - progress_callback(完成数, 总数, 指令)：每生成一个角色调用一次
+        重试后仍有失败时抛出PersonaGenerationError，其中包含已生成的部分结果。"""
+        people: List[Optional[TinyPerson]] = [None] * len(instructions)
+        errors: Dict[int, Exception] = {}
+        progress = _Progress(len(instructions), progress_callback)
+        occurrences = _occurrences(instructions)
+        pending = self._fill_from_library(instructions, occurrences, people, progress)
+
+        def generate_one(index: int):
+            for _ in range(max_retries + 1):
+                try:
+                    people[index] = self._generate_person(instructions[index], occurrences[index])
+                    errors.pop(index, None)
+                    break
+                except Exception as e:
+                    errors[index] = e
+            progress.advance(instructions[index])
+
+        def generate_batch(indices: List[int]):
+            try:
+                batch = self._parse_instructions([instructions[i] for i in indices],
+                                                 [occurrences[i] for i in indices])
+            except Exception:
+                batch = []
+            for position, index in enumerate(indices):
+                person = self._try_build_person(batch[position] if position < len(batch) else None)
+                if person is None:
+                    generate_one(index)
+                else:
+                    people[index] = self._save_to_library(person, instructions[index], occurrences[index])
+                    progress.advance(instructions[index])
+
+        per_call = min(per_call, MAX_BATCH_TOKENS // PERSON_TOKENS)
+        with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+            if per_call > 1:
+                groups = [pending[start:start + per_call] for start in range(0, len(pending), per_call)]
+                list(pool.map(generate_batch, groups))
+            else:
+                list(pool.map(generate_one, pending))
+        if self.library is not None:
+            self.library.flush()
+
+        if errors:
+            raise PersonaGenerationError(people, errors)
+        return people
+
+    async def agenerate_people(self, instructions: List[str], concurrency: int = 4, per_call: int = 1,
+                               max_retries: int = 2, progress_callback=None) -> List[TinyPerson]:
+        """generate_people的异步版本"""
+        people: List[Optional[TinyPerson]] = [None] * len(instructions)
+        errors: Dict[int, Exception] = {}
+        progress = _Progress(len(instructions), progress_callback)
+        occurrences = _occurrences(instructions)
+        pending = self._fill_from_library(instructions, occurrences, people, progress)
+        semaphore = asyncio.Semaphore(max(1, concurrency))
+
+        async def generate_one(index: int):
+            for _ in range(max_retries + 1):
+                try:
+                    async with semaphore:
+                        people[index] = await self._agenerate_person(instructions[index], occurrences[index])
+                    errors.pop(index, None)
+                    break
+                except Exception as e:
+                    errors[index] = e
+            progress.advance(instructions[index])
+
+        async def generate_batch(indices: List[int]):
+            try:
+                async with semaphore:
+                    batch = await self._aparse_instructions([instructions[i] for i in indices],
+                                                            [occurrences[i] for i in indices])
+            except Exception:
+                batch = []
+            retries = []
+            for position, index in enumerate(indices):
+                person = self._try_build_person(batch[position] if position < len(batch) else None)
+                if person is None:
+                    retries.append(generate_one(index))
+                else:
+                    people[index] = self._save_to_library(person, instructions[index], occurrences[index])
+                    progress.advance(instructions[index])
+            await asyncio.gather(*retries)
+
+        per_call = min(per_call, MAX_BATCH_TOKENS // PERSON_TOKENS)
+        if per_call > 1:
+            await asyncio.gather(*(generate_batch(pending[start:start + per_call])
+                                   for start in range(0, len(pending), per_call)))
+        else:
+            await asyncio.gather(*(generate_one(index) for index in pending))
+        if self.library is not None:
+            self.library.flush()
+
+        if errors:
+            raise PersonaGenerationError(people, errors)
+        return people
+
+    def _fill_from_library(self, instructions: List[str], occurrences: List[int],
+                           people: List[Optional[TinyPerson]], progress: "_Progress") -> List[int]:
+        """从角色库填入已经生成过的角色，返回仍需生成的下标"""
+        pending = []
+        for index, instruction in enumerate(instructions):
+            people[index] = self._from_library(instruction, occurrences[index])
+            if people[index] is None:
+                pending.append(index)
+            else:
+                progress.advance(instruction)
+        return pending
+
+    def _batch_request_params(self, instructions: List[str], occurrences: List[int]) -> Dict[str, Any]:
+        """构建一次生成多个角色的调用参数"""
+        numbered = "\n".join(f"        {i}. {_variant(instruction, occurrence)}"
+                             for i, (instruction, occurrence) in enumerate(zip(instructions, occurrences), 1))
+        prompt = f"""请根据以下{len(instructions)}条指令和主题场景，分别生成符合指令主题以及适合出现在当前场景下的模拟角色，并按照下面要求提取人物属性：
+        指令：
+{numbered}
+        场景：{self.base_scene}
+        
+        按JSON数组格式返回，数组中第i个元素对应第i条指令，每个元素是包含以下字段的结构：
+        - name（根据场景生成合理名字）
+        - role（职业身份）
+        - traits（3个性格特质）
+        - personality（包含style沟通风格和expertise专业领域）
+        - interests（3个兴趣爱好）
+        - goals（2个当前目标）"""
+
+        return {
+            "model": "qwen-plus",
+            "messages": [{"role": "user", "content": prompt}],
+            "temperature": 0.4,
+            "max_tokens": min(PERSON_TOKENS * len(instructions), MAX_BATCH_TOKENS),
+        }
+
+    def _parse_instructions(self, instructions: List[str], occurrences: List[int]) -> List[Any]:
+        """一次调用解析多条指令，返回与指令顺序一致的属性列表（可能缺项或格式错误）"""
+        params = self._batch_request_params(instructions, occurrences)
+        response = create_chat_completion(self.api_client, method="generate_people", **params)
+        return _parse_or_discard(params, response, lambda content: _parse_json_fragment(content, r'\[.*\]'))
+
+    async def _aparse_instructions(self, instructions: List[str], occurrences: List[int]) -> List[Any]:
+        params = self._batch_request_params(instructions, occurrences)
+        async with async_llm_slot():
+            response = await acreate_chat_completion(self.async_api_client, method="generate_people", **params)
+        return _parse_or_discard(params, response, lambda content: _parse_json_fragment(content, r'\[.*\]'))
+
+    def _try_build_person(self, attributes: Any) -> Optional[TinyPerson]:
+        """属性缺失或格式错误时返回None"""
+        if not isinstance(attributes, dict) or any(key not in attributes for key in REQUIRED_ATTRIBUTES):
+            return None
+        try:
+            return self._build_person(attributes)
+        except (KeyError, TypeError):
+            return None
+
+
+class _Progress:
+    """线程安全的进度计数，每完成一个角色回调一次"""
+    def __init__(self, total: int, callback):
+        self.total = total
+        self.done = 0
+        self.callback = callback
+        self._lock = threading.Lock()
+
+    def advance(self, instruction: str):
+        with self._lock:
+            self.done += 1
+            if self.callback is not None:
+                self.callback(self.done, self.total, instruction)
@@ -1,65 +1,416 @@
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Iterator, AsyncIterator, Union
 import time
+import os
+import gzip
+import json
+import uuid
+import importlib
+import asyncio
+import queue
+import threading
+import warnings
+from contextlib import contextmanager
+from collections import namedtuple
 from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
 from openai import OpenAI
 import re
 from .baseagent import*
 from .tinyperson import*
+from .contextbuilder import ContextBuilder, parse_shared_key
+from .clock import Clock, RealTimeClock, clock_from_dict
+from .compaction import Compactor, compactor_from_dict
+from .turntaking import TurnPolicy, RoundRobinPolicy, turn_policy_from_dict
+from .topology import Topology, ContextIndex, topology_from_dict, MAX_INBOX
+from .convergence import ConvergenceMonitor, STALLED
+from .turn import Turn, TurnLog, TurnHistory
+from .transcript import TranscriptSink, format_round_header, format_turn
+from .metrics import CallRecord, Subscriber, ConsoleSubscriber, bind_context, world_scope
+from . import metrics
+
+
+# 每轮内智能体的调度方式：sequential 依次执行，parallel 同一轮内并发执行
+SCHEDULERS = ("sequential", "parallel")
+
+# 流式运行时产出的事件：某个智能体的某个字段（thought/speech/action）新生成的文本
+WorldEvent = namedtuple("WorldEvent", ["agent", "field", "delta"])
 
 
 class TinyWorld:
     """对话世界模拟器"""
-    def __init__(self, agents: List[BaseAgent], scene: str, memory_window: int = 3):
+    def __init__(self, agents: List[BaseAgent], scene: str, memory_window: int = 3,
+                 scheduler: str = "sequential", max_concurrency: Optional[int] = None,
+                 api_client: Optional[OpenAI] = None, async_api_client: Optional[AsyncOpenAI] = None,
+                 context_builder: Optional[ContextBuilder] = None,
+                 transcript_sinks: Optional[List[TranscriptSink]] = None, keep_full_history: bool = True,
+                 checkpoint_every: Optional[int] = None, checkpoint_path: Optional[str] = None,
+                 clock: Optional[Clock] = None, subscribers: Optional[List[Subscriber]] = None,
+                 verbose: bool = True, compactor: Optional[Compactor] = None,
+                 turn_policy: Optional[TurnPolicy] = None, topology: Optional[Topology] = None,
+                 convergence: Optional[ConvergenceMonitor] = None):
+        if scheduler not in SCHEDULERS:
+            raise ValueError(f"未知的scheduler: {scheduler}，可选值为{SCHEDULERS}")
         self.agents = agents
         self.scene = scene
+        # 运行期间发起的LLM调用都带有这个标记，订阅者只收到本世界的调用
+        self.world_id = uuid.uuid4().hex
         self.memory_window = memory_window
+        self.scheduler = scheduler
+        self.max_concurrency = max_concurrency  # parallel模式下的最大并发数，None表示不限制
+        # 为每个智能体裁剪上下文，默认只按memory_window窗口截取shared_memory
+        self.context_builder = context_builder or ContextBuilder(memory_window)
+        # 轮间节奏与时间戳：默认每轮真实等待1秒模拟自然对话间隔，批量运行可使用NoDelayClock或SimulatedClock
+        self.clock = clock or RealTimeClock(1.0)
         self.rounds = 0
+        # 世界中所有智能体的回应保存在同一个日志中，智能体的对话历史只保存下标
+        self.turn_log = TurnLog()
+        # 注入的LLM客户端会替换所有智能体的客户端，便于整个世界指向同一个服务
+        for agent in agents:
+            if isinstance(agent.conversation_history, TurnHistory):
+                agent.conversation_history.attach(self.turn_log)
+            if api_client is not None:
+                agent.api_client = api_client
+            if async_api_client is not None:
+                agent.async_api_client = async_api_client
         self.context = {
             "scene": scene,
             "history": [],
             "shared_memory": {}
         }
+        # 每个回应完成后立即追加写入的对话记录输出端
+        self.transcript_sinks = list(transcript_sinks or [])
+        # 为False时context["history"]和shared_memory只保留最近memory_window轮，完整记录由transcript_sinks落盘，内存占用不随轮数增长
+        self.keep_full_history = keep_full_history
+        for sink in self.transcript_sinks:
+            sink.begin(scene)
+        # 每checkpoint_every轮自动写一次检查点到checkpoint_path
+        if checkpoint_every and not checkpoint_path:
+            raise ValueError("设置checkpoint_every时必须同时指定checkpoint_path")
+        self.checkpoint_every = checkpoint_every
+        self.checkpoint_path = checkpoint_path
+        # 事件订阅者：轮次开始/结束、每个回应以及本世界智能体的每次LLM调用；verbose为True时在控制台输出对话
+        self.verbose = verbose
+        self.subscribers: List[Subscriber] = ([ConsoleSubscriber(scene)] if verbose else []) + list(subscribers or [])
+        # 滚动压缩：较早的轮次合并为摘要放入上下文，原始回应从内存中移除，提示词和内存不随轮数增长
+        self.compactor = compactor
+        # 每轮由哪些智能体行动，默认所有智能体按顺序行动；只选部分发言人时每轮的调用数与发言人数成正比
+        self.turn_policy = turn_policy or RoundRobinPolicy()
+        # 谁能看到谁的发言：默认所有人互相可见；房间或邻居图下每个智能体的上下文只包含可见智能体的回应，
+        # sequential调度时互不可见的组（例如不同房间）同时执行
+        self.topology = topology or Topology()
+        self._context_index: Optional[ContextIndex] = None
+        self._record_lock = threading.Lock()
+        # 对话收敛、达成目标或停滞时提前结束run/stream，原因记录在stop_reason中（跑满轮数时为None）
+        self.convergence = convergence
+        self.stop_reason: Optional[str] = None
         
     def run(self, num_rounds: int) -> List[Dict[str, Any]]:
         """运行指定轮数的对话"""
         results = []
         
-        for round_num in range(1, num_rounds + 1):
-            print(f"\n{'='*20} {self.scene} Round {round_num} {'='*20}")
+        self.stop_reason = None
+        with self._observing_calls():
+            for round_num in self._round_numbers(num_rounds):
+                speakers = self._active_speakers(round_num, self.turn_policy.select(self, round_num))
+                if self.stop_reason is not None:
+                    break
+                current_context = self._begin_round(round_num)
             
-            # 构建当前轮次上下文
-            current_context = {
-                "scene": self.scene,
-                "round": round_num,
-                "shared_memory": self.context["shared_memory"],
-                "recent_history": self._get_recent_history()
-            }
+                if self.scheduler == "parallel":
+                    round_results = self._run_round_parallel(round_num, current_context, speakers)
+                else:
+                    round_results = self._run_round_sequential(round_num, current_context, speakers)
             
-            round_results = []
-            for agent in self.agents:
-                response = agent.act(round_num, self.scene, current_context)
-                round_results.append(response)
-                print(f"{agent.name}:  {response['thought']}")
-                print(f"{agent.name}:  {response['speech']}")
-                print(f"{agent.name}:  {response['action']}")
-                
-                # 更新共享记忆
-                self.context["shared_memory"].update({
-                    f"{agent.name}_contribution_{round_num}": response["speech"],
-                    f"{agent.name}_action_{round_num}": response["action"]
-                })
-            
-            # 保存本轮结果
-            self.context["history"].append({
-                "round": round_num,
-                "results": round_results
-            })
-            results.extend(round_results)
-            self.rounds += 1
-            time.sleep(1)  # 模拟自然对话间隔
+                self._finish_round(round_num, round_results)
+                results.extend(round_results)
+                self.clock.pace()
+                self._after_round()
+                if self.stop_reason is not None:
+                    break
             
         return results
+
+    def stream(self, num_rounds: int) -> Iterator[WorldEvent]:
+        """以流式方式运行指定轮数的对话，逐段产出WorldEvent(agent, field, delta)。
+
+        适合界面或日志实时展示发言；对话记录、共享记忆等与run完全一致。
+        parallel调度下同一轮各智能体的事件交错产出，每个智能体自身的事件保持顺序。"""
+        self.stop_reason = None
+        with self._observing_calls():
+            for round_num in self._round_numbers(num_rounds):
+                speakers = self._active_speakers(round_num, self.turn_policy.select(self, round_num))
+                if self.stop_reason is not None:
+                    break
+                current_context = self._begin_round(round_num)
+
+                if self.scheduler == "parallel":
+                    round_results = yield from self._stream_round_parallel(round_num, current_context, speakers)
+                else:
+                    round_results = []
+                    for agent in speakers:
+                        for field, delta in agent.act_stream(round_num, self.scene,
+                                                             self._agent_context(agent, current_context)):
+                            if field == "response":
+                                round_results.append(delta)
+                                self._record_response(agent, round_num, delta)
+                            else:
+                                yield WorldEvent(agent.name, field, delta)
+
+                self._finish_round(round_num, round_results)
+                self.clock.pace()
+                self._after_round()
+                if self.stop_reason is not None:
+                    break
+
+    def _stream_round_parallel(self, round_num: int, current_context: Dict[str, Any], speakers: List[BaseAgent]):
+        """_run_round_parallel的流式版本，各线程把事件放入队列，由调用方所在线程统一产出"""
+        snapshot = dict(current_context, shared_memory=dict(current_context["shared_memory"]))
+        events = queue.Queue()
+        round_results = [None] * len(speakers)
+
+        def act(index: int, agent: BaseAgent):
+            try:
+                for field, delta in agent.act_stream(round_num, self.scene, self._agent_context(agent, snapshot)):
+                    events.put((index, field, delta))
+            except Exception as e:
+                events.put((index, "error", e))
+            finally:
+                events.put((index, None, None))
+
+        workers = self.max_concurrency or len(speakers) or 1
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for index, agent in enumerate(speakers):
+                pool.submit(bind_context(act), index, agent)
+            pending = len(speakers)
+            while pending:
+                index, field, delta = events.get()
+                if field is None:
+                    pending -= 1
+                elif field == "error":
+                    raise delta
+                elif field == "response":
+                    round_results[index] = delta
+                else:
+                    yield WorldEvent(speakers[index].name, field, delta)
+        for agent, response in zip(speakers, round_results):
+            self._record_response(agent, round_num, response)
+        return round_results
+
+    def _run_round_sequential(self, round_num: int, current_context: Dict[str, Any],
+                              speakers: List[BaseAgent]) -> List[Dict[str, Any]]:
+        """本轮的发言人依次执行act，后发言的人能看到同一轮之前的发言。
+
+        拓扑把发言人分成互相看不到对方发言的多组（例如不同房间）时，各组在线程中同时执行、组内仍依次执行，
+        结果与完全依次执行相同；订阅者和对话记录在全部完成后按speakers的顺序收到回应。"""
+        groups = self.topology.components(speakers)
+        if len(groups) <= 1:
+            round_results = []
+            for agent in speakers:
+                response = agent.act(round_num, self.scene, self._agent_context(agent, current_context))
+                round_results.append(response)
+                self._record_response(agent, round_num, response)
+            return round_results
+
+        def run_group(group: List[BaseAgent]) -> List[Dict[str, Any]]:
+            responses = []
+            for agent in group:
+                response = agent.act(round_num, self.scene, self._agent_context(agent, current_context))
+                with self._record_lock:
+                    self._remember_response(agent, round_num, response)
+                responses.append(response)
+            return responses
+
+        with ThreadPoolExecutor(max_workers=self.max_concurrency or len(groups)) as pool:
+            group_results = list(pool.map(bind_context(run_group), groups))
+        return self._publish_grouped(speakers, groups, group_results)
+
+    def _publish_grouped(self, speakers: List[BaseAgent], groups: List[List[BaseAgent]],
+                         group_results: List[List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+        """把分组执行的结果还原为speakers的顺序并通知订阅者"""
+        responses = {id(agent): response for group, results in zip(groups, group_results)
+                     for agent, response in zip(group, results)}
+        round_results = [responses[id(agent)] for agent in speakers]
+        for response in round_results:
+            self._publish_response(response)
+        return round_results
+
+    def _active_speakers(self, round_num: int, speakers: List[BaseAgent]) -> List[BaseAgent]:
+        """去掉收敛监控要求本轮跳过的智能体；本轮所有发言人都要跳过时以"stalled"停止"""
+        if self.convergence is None:
+            return speakers
+        active = [agent for agent in speakers if not self.convergence.skips(agent.name, round_num)]
+        if speakers and not active:
+            self._stop(STALLED)
+        return active
+
+    def _stop(self, reason: str):
+        self.stop_reason = reason
+        self._notify("on_stop", self.rounds, reason)
+
+    def _round_numbers(self, num_rounds: int) -> range:
+        """本次运行的轮次编号，从恢复或上次运行结束时的轮次之后继续"""
+        return range(self.rounds + 1, self.rounds + num_rounds + 1)
+
+    def _begin_round(self, round_num: int) -> Dict[str, Any]:
+        """通知订阅者新一轮开始并构建当前轮次上下文"""
+        self._notify("on_round_start", round_num)
+        context = self._build_round_context(round_num)
+        self._context_index = ContextIndex(context) if self.topology.sparse else None
+        return context
+
+    def _build_round_context(self, round_num: int) -> Dict[str, Any]:
+        """构建当前轮次上下文"""
+        context = {
+            "scene": self.scene,
+            "round": round_num,
+            "shared_memory": self.context["shared_memory"],
+            "recent_history": self._get_recent_history()
+        }
+        digest = self.context.get("digest")
+        if digest and digest["global"] and not self.topology.sparse:  # 全局摘要包含互相不可见的发言
+            context["digest"] = digest["global"]
+        return context
+
+    def _agent_context(self, agent: BaseAgent, current_context: Dict[str, Any]) -> Dict[str, Any]:
+        """按拓扑只保留该智能体可见的回应，再按context_builder的窗口、相关性和token预算裁剪，
+        并附上该智能体自己的摘要和未读消息"""
+        if self._context_index is not None:
+            current_context = self._context_index.view(current_context, self.topology.visible(agent.name))
+        context = self.context_builder.build(current_context, agent.name)
+        messages = self.context.get("inbox", {}).get(agent.name)
+        if messages:
+            context["messages"] = [f"{message['from']}：{message['text']}" for message in messages]
+        digest = self.context.get("digest")
+        if digest and digest["agents"].get(agent.name):
+            context["personal_digest"] = digest["agents"][agent.name]
+        return context
+
+    def _run_round_parallel(self, round_num: int, current_context: Dict[str, Any],
+                            speakers: List[BaseAgent]) -> List[Dict[str, Any]]:
+        """同一轮内本轮的发言人并发执行act。
+
+        所有发言人拿到同一份上下文快照，全部完成后再按speakers的顺序输出并合并shared_memory，
+        保证对话记录可复现。"""
+        snapshot = dict(current_context, shared_memory=dict(current_context["shared_memory"]))
+        workers = self.max_concurrency or len(speakers) or 1
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            round_results = list(pool.map(
+                bind_context(lambda agent: agent.act(round_num, self.scene, self._agent_context(agent, snapshot))),
+                speakers))
+        for agent, response in zip(speakers, round_results):
+            self._record_response(agent, round_num, response)
+        return round_results
+
+    def _record_response(self, agent: BaseAgent, round_num: int, response: Dict[str, Any]):
+        """把单个智能体的回应更新到共享记忆并通知订阅者"""
+        self._remember_response(agent, round_num, response)
+        self._publish_response(response)
+
+    def _remember_response(self, agent: BaseAgent, round_num: int, response: Dict[str, Any]):
+        """更新共享记忆，该智能体的未读消息已在本次行动中看到，从收件箱中移除"""
+        response.setdefault("timestamp", self.clock.now().isoformat())
+        entries = {
+            f"{agent.name}_contribution_{round_num}": response["speech"],
+            f"{agent.name}_action_{round_num}": response["action"]
+        }
+        self.context["shared_memory"].update(entries)
+        if self._context_index is not None:
+            for key, value in entries.items():
+                self._context_index.add(key, value)
+        inbox = self.context.get("inbox")
+        if inbox:
+            inbox.pop(agent.name, None)
+
+    def _publish_response(self, response: Dict[str, Any]):
+        self._notify("on_turn", response)
+        for sink in self.transcript_sinks:
+            sink.write_turn(response)
+
+    def send_message(self, recipients: Union[str, List[str]], text: str, sender: str = "系统"):
+        """给智能体发送消息，收件人下一次行动时在上下文的messages中看到。
+
+        recipients可以是智能体名、拓扑中的分组名（例如房间名）或它们的列表，可用于在房间之间传递信息。"""
+        names = []
+        for recipient in [recipients] if isinstance(recipients, str) else recipients:
+            names.extend(self.topology.members(recipient) or [recipient])
+        unknown = set(names) - {agent.name for agent in self.agents}
+        if unknown:
+            raise ValueError(f"未知的收件人: {sorted(unknown)}")
+        self._deliver(names, {"from": sender, "text": text})
+
+    def _deliver(self, names: List[str], message: Dict[str, str]):
+        inbox = self.context.setdefault("inbox", {})
+        for name in names:
+            messages = inbox.setdefault(name, [])
+            messages.append(message)
+            del messages[:-MAX_INBOX]
+
+    def _finish_round(self, round_num: int, round_results: List[Dict[str, Any]]):
+        """保存本轮结果"""
+        self.context["history"].append({
+            "round": round_num,
+            "results": round_results
+        })
+        for names, message in self.topology.messages(round_results):
+            self._deliver(names, message)
+        if not self.keep_full_history and self.compactor is None:  # 设置了compactor时由压缩移除旧轮次
+            del self.context["history"][:-self.memory_window or None]
+            oldest_round = round_num - self.memory_window + 1
+            shared_memory = self.context["shared_memory"]
+            for key in [key for key in shared_memory
+                        if (parse_shared_key(key) or ("", oldest_round))[1] < oldest_round]:
+                del shared_memory[key]
+        self.discard_unreferenced_turns()
+        self.rounds += 1
+        for sink in self.transcript_sinks:
+            sink.end_round(round_num)
+        self._notify("on_round_end", round_num, round_results)
+        if self.convergence is not None:
+            reason = self.convergence.observe(self, round_num, round_results)
+            if reason is not None:
+                self._stop(reason)
     
+    def discard_unreferenced_turns(self):
+        """从共享日志中丢弃所有智能体的对话历史都不再引用的回应（context["history"]直接持有自己保留的回应）"""
+        histories = [agent.conversation_history for agent in self.agents
+                     if isinstance(agent.conversation_history, TurnHistory)]
+        if histories:
+            self.turn_log.discard_before(min(history.oldest_index() for history in histories))
+
+    def _notify(self, event: str, *args):
+        for subscriber in self.subscribers:
+            getattr(subscriber, event)(*args)
+
+    @contextmanager
+    def _observing_calls(self):
+        """运行期间为发起的LLM调用打上本世界的标记，并把带有该标记的调用记录转发给实现了on_call的订阅者。
+
+        按标记而不是智能体名字过滤，同一进程中同时运行、角色同名的多个世界不会收到彼此的调用。"""
+        observers = [subscriber for subscriber in self.subscribers
+                     if type(subscriber).on_call is not Subscriber.on_call]
+        with world_scope(self.world_id):
+            if not observers:
+                yield
+                return
+
+            def forward(record: CallRecord):
+                if record.world == self.world_id:
+                    for subscriber in observers:
+                        subscriber.on_call(record)
+
+            metrics.subscribe(forward)
+            try:
+                yield
+            finally:
+                metrics.unsubscribe(forward)
+
+    def _after_round(self):
+        """一轮完全结束（包括时钟推进）后调用：按需压缩旧轮次、自动写检查点"""
+        if self.compactor is not None and self.compactor.should_compact(self):
+            self.compactor.compact(self)
+        if self.checkpoint_every and self.rounds % self.checkpoint_every == 0:
+            self.checkpoint(self.checkpoint_path)
+
     def _get_recent_history(self) -> List[Dict[str, Any]]:
         """获取最近几轮的对话历史"""
         start_idx = max(0, len(self.context["history"]) - self.memory_window)
@@ -67,15 +418,286 @@ class TinyWorld:
     
  
     def save_conversation_to_file(self, filename: str = "conversation_log.txt"):
-        """将对话记录保存为文本文件"""
+        """将对话记录保存为文本文件（keep_full_history为False时只包含保留的最近几轮，完整记录请使用TextTranscriptSink）"""
         with open(filename, "w", encoding="utf-8") as f:
             f.write(f"场景：{self.scene}\n")
             f.write(f"总对话轮数：{self.rounds}\n\n")
             
             for round_data in self.context["history"]:
-                f.write(f"{'='*20} 第{round_data['round']}轮 {'='*20}\n")
+                f.write(format_round_header(round_data['round']))
                 for result in round_data["results"]:
-                    f.write(f"[{result['agent']}的思考]\n{result['thought']}\n")
-                    f.write(f"[{result['agent']}的对话]\n{result['speech']}\n\n")
-                    f.write(f"[{result['agent']}的行为]\n{result['action']}\n\n")
-                f.write("\n")
\ No newline at end of file
+                    f.write(format_turn(result))
+                f.write("\n")
+
+    def checkpoint(self, path: str):
+        """把世界和所有智能体的状态写入gzip压缩的JSON检查点文件，先写临时文件再替换，中途崩溃不会损坏旧检查点"""
+        state = {
+            "version": 1,
+            "world": {
+                "type": f"{type(self).__module__}:{type(self).__qualname__}",
+                "scene": self.scene,
+                "memory_window": self.memory_window,
+                "scheduler": self.scheduler,
+                "max_concurrency": self.max_concurrency,
+                "keep_full_history": self.keep_full_history,
+                "checkpoint_every": self.checkpoint_every,
+                "verbose": self.verbose,
+                # 输出端和订阅者无法序列化，只记录类名，恢复时据此提醒重新传入
+                "transcript_sinks": [type(sink).__name__ for sink in self.transcript_sinks],
+                "subscribers": [type(subscriber).__name__
+                                for subscriber in self.subscribers[1 if self.verbose else 0:]],
+                "context_builder": vars(self.context_builder),
+                "clock": self.clock.to_dict(),
+                "turn_policy": self.turn_policy.to_dict(),
+                "topology": self.topology.to_dict(),
+                "compactor": self.compactor.to_dict() if self.compactor is not None else None,
+                "convergence": self.convergence.to_dict() if self.convergence is not None else None,
+                "stop_reason": self.stop_reason,
+                "rounds": self.rounds,
+                "context": self.context,
+                "turn_log": self.turn_log.to_dict(),
+            },
+            "agents": [self._agent_state(agent) for agent in self.agents],
+        }
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+            json.dump(state, f, ensure_ascii=False, separators=(",", ":"), default=_json_default)
+        os.replace(tmp_path, path)
+
+    def _agent_state(self, agent: BaseAgent) -> Dict[str, Any]:
+        """智能体的检查点状态；对话历史在世界共享的日志中时只保存下标，回应随日志保存一次"""
+        data = agent.to_dict()
+        history = agent.conversation_history
+        if isinstance(history, TurnHistory) and history.log is self.turn_log:
+            data["conversation_history"] = []
+            data["turn_indices"] = history.indices()
+        return data
+
+    @classmethod
+    def resume(cls, path: str, api_client: Optional[OpenAI] = None,
+               async_api_client: Optional[AsyncOpenAI] = None, **kwargs) -> "TinyWorld":
+        """从检查点恢复世界，之后调用run会从检查点所在轮次的下一轮继续。
+
+        kwargs会传给构造函数，可用于覆盖检查点中的参数（例如verbose、checkpoint_path）。
+        transcript_sinks和subscribers不保存在检查点中，需要通过kwargs重新传入，否则恢复后的世界没有这些输出端；
+        通过kwargs传入convergence（例如带goal或embedder的监控）时，检查点中的监控状态会载入其中。"""
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            state = json.load(f)
+        world_state = state["world"]
+        agents = [_load_class(data["type"]).from_dict(data, api_client=api_client,
+                                                      async_api_client=async_api_client)
+                  for data in state["agents"]]
+        options = {
+            "memory_window": world_state["memory_window"],
+            "scheduler": world_state["scheduler"],
+            "max_concurrency": world_state["max_concurrency"],
+            "keep_full_history": world_state["keep_full_history"],
+            "verbose": world_state.get("verbose", True),
+            "context_builder": ContextBuilder(**world_state["context_builder"]),
+            "clock": clock_from_dict(world_state["clock"]) if "clock" in world_state else None,
+            "turn_policy": turn_policy_from_dict(world_state["turn_policy"]) if "turn_policy" in world_state else None,
+            "topology": topology_from_dict(world_state["topology"]) if "topology" in world_state else None,
+            "compactor": compactor_from_dict(world_state["compactor"]) if world_state.get("compactor") else None,
+            "convergence": (ConvergenceMonitor.from_dict(world_state["convergence"])
+                            if world_state.get("convergence") else None),
+        }
+        if world_state.get("checkpoint_every"):
+            options.update(checkpoint_every=world_state["checkpoint_every"], checkpoint_path=path)
+        options.update(kwargs)
+        for option in ("transcript_sinks", "subscribers"):
+            if world_state.get(option) and option not in kwargs:
+                warnings.warn(f"检查点中的世界使用了{option}（{', '.join(world_state[option])}），"
+                              f"恢复时没有重新传入，恢复后的世界不会再输出到这些{option}")
+        world = cls(agents, world_state["scene"], **options)
+        world.rounds = world_state["rounds"]
+        world.stop_reason = world_state.get("stop_reason")
+        world.context = world_state["context"]
+        if world_state.get("convergence") and kwargs.get("convergence") is not None:
+            world.convergence.load_state(world_state["convergence"].get("state", {}))
+        if "turn_log" in world_state:
+            world.turn_log = TurnLog.from_dict(world_state["turn_log"])
+            for agent, data in zip(agents, state["agents"]):
+                if "turn_indices" in data and isinstance(agent.conversation_history, TurnHistory):
+                    agent.conversation_history.restore(world.turn_log, data["turn_indices"])
+        # context["history"]与对话历史引用同一批回应对象，和保存前一样只占一份内存
+        logged = {(turn["agent"], turn.get("round")): turn for turn in world.turn_log}
+        for round_data in world.context["history"]:
+            round_data["results"] = [logged.get((turn["agent"], turn.get("round"))) or Turn.from_dict(turn)
+                                     for turn in round_data["results"]]
+        return world
+
+    def close(self):
+        """关闭所有对话记录输出端和订阅者"""
+        for sink in self.transcript_sinks:
+            sink.close()
+        for subscriber in self.subscribers:
+            subscriber.close()
+
+
+def _json_default(value: Any) -> Any:
+    return value.to_dict() if isinstance(value, Turn) else str(value)
+
+
+def _load_class(path: str):
+    """按"模块:类名"加载检查点中记录的类"""
+    module_name, _, qualname = path.partition(":")
+    target = importlib.import_module(module_name)
+    for part in qualname.split("."):
+        target = getattr(target, part)
+    return target
+
+
+class AsyncTinyWorld(TinyWorld):
+    """基于asyncio的对话世界模拟器，run为协程。
+
+    智能体通过aact调用异步LLM客户端，可以在同一个事件循环中同时运行大量模拟；
+    全局并发上限通过baseagent.set_async_concurrency_limit设置。"""
+
+    async def run(self, num_rounds: int) -> List[Dict[str, Any]]:
+        """运行指定轮数的对话"""
+        results = []
+
+        self.stop_reason = None
+        with self._observing_calls():
+            for round_num in self._round_numbers(num_rounds):
+                speakers = self._active_speakers(round_num, await self.turn_policy.aselect(self, round_num))
+                if self.stop_reason is not None:
+                    break
+                current_context = self._begin_round(round_num)
+
+                if self.scheduler == "parallel":
+                    round_results = await self._run_round_parallel_async(round_num, current_context, speakers)
+                else:
+                    round_results = await self._run_round_sequential_async(round_num, current_context, speakers)
+
+                self._finish_round(round_num, round_results)
+                results.extend(round_results)
+                await self.clock.apace()
+                await asyncio.to_thread(self._after_round)  # 压缩和写检查点是阻塞操作，放到线程中执行
+                if self.stop_reason is not None:
+                    break
+
+        return results
+
+    async def _run_round_sequential_async(self, round_num: int, current_context: Dict[str, Any],
+                                          speakers: List[BaseAgent]) -> List[Dict[str, Any]]:
+        """_run_round_sequential的异步版本，互不可见的各组作为协程同时执行，max_concurrency限制同时执行的智能体数"""
+        groups = self.topology.components(speakers)
+        if len(groups) <= 1:
+            round_results = []
+            for agent in speakers:
+                response = await agent.aact(round_num, self.scene, self._agent_context(agent, current_context))
+                round_results.append(response)
+                self._record_response(agent, round_num, response)
+            return round_results
+
+        semaphore = asyncio.Semaphore(self.max_concurrency) if self.max_concurrency else None
+
+        async def run_group(group: List[BaseAgent]) -> List[Dict[str, Any]]:
+            responses = []
+            for agent in group:
+                if semaphore is None:
+                    response = await agent.aact(round_num, self.scene, self._agent_context(agent, current_context))
+                else:
+                    async with semaphore:
+                        response = await agent.aact(round_num, self.scene, self._agent_context(agent, current_context))
+                self._remember_response(agent, round_num, response)
+                responses.append(response)
+            return responses
+
+        group_results = await asyncio.gather(*(run_group(group) for group in groups))
+        return self._publish_grouped(speakers, groups, list(group_results))
+
+    async def _run_round_parallel_async(self, round_num: int, current_context: Dict[str, Any],
+                                        speakers: List[BaseAgent]) -> List[Dict[str, Any]]:
+        """_run_round_parallel的异步版本，max_concurrency限制本世界内同时执行的智能体数"""
+        snapshot = dict(current_context, shared_memory=dict(current_context["shared_memory"]))
+        semaphore = asyncio.Semaphore(self.max_concurrency) if self.max_concurrency else None
+
+        async def act(agent: BaseAgent) -> Dict[str, Any]:
+            if semaphore is None:
+                return await agent.aact(round_num, self.scene, self._agent_context(agent, snapshot))
+            async with semaphore:
+                return await agent.aact(round_num, self.scene, self._agent_context(agent, snapshot))
+
+        round_results = await asyncio.gather(*(act(agent) for agent in speakers))
+        for agent, response in zip(speakers, round_results):
+            self._record_response(agent, round_num, response)
+        return list(round_results)
+
+    async def stream(self, num_rounds: int) -> AsyncIterator[WorldEvent]:
+        """TinyWorld.stream的异步版本，逐段产出WorldEvent(agent, field, delta)"""
+        self.stop_reason = None
+        with self._observing_calls():
+            for round_num in self._round_numbers(num_rounds):
+                speakers = self._active_speakers(round_num, await self.turn_policy.aselect(self, round_num))
+                if self.stop_reason is not None:
+                    break
+                current_context = self._begin_round(round_num)
+                round_results = [None] * len(speakers)
+
+                if self.scheduler == "parallel":
+                    async for event in self._stream_round_parallel_async(round_num, current_context, speakers,
+                                                                         round_results):
+                        yield event
+                else:
+                    for index, agent in enumerate(speakers):
+                        async for field, delta in agent.aact_stream(round_num, self.scene,
+                                                                    self._agent_context(agent, current_context)):
+                            if field == "response":
+                                round_results[index] = delta
+                                self._record_response(agent, round_num, delta)
+                            else:
+                                yield WorldEvent(agent.name, field, delta)
+
+                self._finish_round(round_num, round_results)
+                await self.clock.apace()
+                await asyncio.to_thread(self._after_round)
+                if self.stop_reason is not None:
+                    break
+
+    async def _stream_round_parallel_async(self, round_num: int, current_context: Dict[str, Any],
+                                           speakers: List[BaseAgent],
+                                           round_results: List[Optional[Dict[str, Any]]]) -> AsyncIterator[WorldEvent]:
+        """_stream_round_parallel的异步版本，本轮各智能体的响应按顺序写入round_results"""
+        snapshot = dict(current_context, shared_memory=dict(current_context["shared_memory"]))
+        semaphore = asyncio.Semaphore(self.max_concurrency) if self.max_concurrency else None
+        events = asyncio.Queue()
+
+        async def act(index: int, agent: BaseAgent):
+            try:
+                if semaphore is not None:
+                    await semaphore.acquire()
+                try:
+                    async for field, delta in agent.aact_stream(round_num, self.scene,
+                                                                self._agent_context(agent, snapshot)):
+                        events.put_nowait((index, field, delta))
+                finally:
+                    if semaphore is not None:
+                        semaphore.release()
+            except Exception as e:
+                events.put_nowait((index, "error", e))
+            finally:
+                events.put_nowait((index, None, None))
+
+        tasks = [asyncio.ensure_future(act(index, agent)) for index, agent in enumerate(speakers)]
+        try:
+            pending = len(tasks)
+            while pending:
+                index, field, delta = await events.get()
+                if field is None:
+                    pending -= 1
+                elif field == "error":
+                    raise delta
+                elif field == "response":
+                    round_results[index] = delta
+                else:
+                    yield WorldEvent(speakers[index].name, field, delta)
+        finally:
+            for task in tasks:
+                task.cancel()
+        for agent, response in zip(speakers, round_results):
+            self._record_response(agent, round_num, response)
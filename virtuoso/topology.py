@@ -0,0 +1,172 @@
+from typing import List, Dict, Any, Optional, Tuple
+from .baseagent import BaseAgent
+from .contextbuilder import parse_shared_key
+
+MAX_INBOX = 20  # 每个智能体最多保留的未读消息数，超出时丢弃最早的
+
+
+class Topology:
+    """TinyWorld的交互拓扑：决定每个智能体能看到哪些智能体的发言，以及哪些智能体互不影响、可以同时模拟。
+
+    默认所有智能体都能看到所有人的发言（原有行为）。"""
+    sparse = False  # 为True时世界按visible过滤每个智能体的上下文
+
+    def visible(self, agent_name: str) -> Optional[List[str]]:
+        """该智能体能看到其发言的智能体（包括自己），None表示所有人"""
+        return None
+
+    def members(self, group: str) -> Optional[List[str]]:
+        """房间等分组中的智能体，不是分组名时返回None"""
+        return None
+
+    def components(self, agents: List[BaseAgent]) -> List[List[BaseAgent]]:
+        """把本轮的发言人划分为互相看不到对方发言的组，不同组可以同时执行；组内保持原有顺序"""
+        return [list(agents)]
+
+    def messages(self, round_results: List[Dict[str, Any]]) -> List[Tuple[List[str], Dict[str, str]]]:
+        """一轮结束后需要转发的消息，返回(收件人列表, {"from", "text"})的列表"""
+        return []
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"type": "full"}
+
+
+class GraphTopology(Topology):
+    """邻居图：每个智能体只看到自己和邻居的发言。
+
+    edges为{智能体名: [邻居名, ...]}；directed为False时边是双向的，为True时表示该智能体能看到哪些人的发言。
+    图中没有出现的智能体只能看到自己。"""
+    sparse = True
+
+    def __init__(self, edges: Dict[str, List[str]], directed: bool = False):
+        self.edges = {name: list(neighbors) for name, neighbors in edges.items()}
+        self.directed = directed
+        self._visible: Dict[str, List[str]] = {}
+        for name, neighbors in self.edges.items():
+            self._link(name, name)
+            for neighbor in neighbors:
+                self._link(name, neighbor)
+                if not directed:
+                    self._link(neighbor, name)
+
+    def _link(self, name: str, neighbor: str):
+        visible = self._visible.setdefault(name, [name])
+        if neighbor not in visible:
+            visible.append(neighbor)
+
+    def visible(self, agent_name: str) -> Optional[List[str]]:
+        return self._visible.get(agent_name, [agent_name])
+
+    def components(self, agents: List[BaseAgent]) -> List[List[BaseAgent]]:
+        # 只按本轮发言人之间的边合并（不发言的人本轮不产生回应，不会把两个组连起来）
+        parent = {agent.name: agent.name for agent in agents}
+
+        def find(name: str) -> str:
+            while parent[name] != name:
+                parent[name] = parent[parent[name]]
+                name = parent[name]
+            return name
+
+        for agent in agents:
+            for neighbor in self.visible(agent.name):
+                if neighbor in parent:
+                    parent[find(neighbor)] = find(agent.name)
+        groups: Dict[str, List[BaseAgent]] = {}
+        for agent in agents:
+            groups.setdefault(find(agent.name), []).append(agent)
+        return list(groups.values())
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"type": "graph", "edges": self.edges, "directed": self.directed}
+
+
+class RoomTopology(Topology):
+    """房间：每个智能体只看到同一房间中的发言，不同房间同时模拟。
+
+    rooms为{房间名: [智能体名, ...]}，一个智能体只能属于一个房间，不属于任何房间的智能体只能看到自己。
+    relays为{房间名: [目标房间名, ...]}，每轮结束后把该房间的发言作为消息转给目标房间的所有人。"""
+    sparse = True
+
+    def __init__(self, rooms: Dict[str, List[str]], relays: Optional[Dict[str, List[str]]] = None):
+        self.rooms = {room: list(names) for room, names in rooms.items()}
+        self.relays = {room: list(targets) for room, targets in (relays or {}).items()}
+        self._room_of: Dict[str, str] = {}
+        for room, names in self.rooms.items():
+            for name in names:
+                if name in self._room_of:
+                    raise ValueError(f"智能体{name}同时属于房间{self._room_of[name]}和{room}")
+                self._room_of[name] = room
+        unknown = (set(self.relays) | {target for targets in self.relays.values() for target in targets}) - set(self.rooms)
+        if unknown:
+            raise ValueError(f"relays中未知的房间: {sorted(unknown)}")
+
+    def room_of(self, agent_name: str) -> Optional[str]:
+        return self._room_of.get(agent_name)
+
+    def visible(self, agent_name: str) -> Optional[List[str]]:
+        room = self._room_of.get(agent_name)
+        return self.rooms[room] if room is not None else [agent_name]
+
+    def members(self, group: str) -> Optional[List[str]]:
+        return self.rooms.get(group)
+
+    def components(self, agents: List[BaseAgent]) -> List[List[BaseAgent]]:
+        groups: Dict[Any, List[BaseAgent]] = {}
+        for agent in agents:
+            groups.setdefault(self._room_of.get(agent.name, ("", agent.name)), []).append(agent)
+        return list(groups.values())
+
+    def messages(self, round_results: List[Dict[str, Any]]) -> List[Tuple[List[str], Dict[str, str]]]:
+        relayed = []
+        for turn in round_results:
+            room = self._room_of.get(turn["agent"])
+            for target in self.relays.get(room, []):
+                relayed.append((self.rooms[target], {"from": f"{turn['agent']}（{room}）", "text": turn["speech"]}))
+        return relayed
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"type": "rooms", "rooms": self.rooms, "relays": self.relays}
+
+
+def topology_from_dict(data: Dict[str, Any]) -> Topology:
+    """根据Topology.to_dict的结果重建拓扑，用于从检查点恢复"""
+    if data["type"] == "graph":
+        return GraphTopology(data["edges"], data.get("directed", False))
+    if data["type"] == "rooms":
+        return RoomTopology(data["rooms"], data.get("relays"))
+    return Topology()
+
+
+class ContextIndex:
+    """一轮内按作者索引的shared_memory条目和recent_history回应。
+
+    按可见集合过滤上下文时只访问可见作者的条目，每个智能体的开销与邻居数成正比，而不是与世界人数成正比。"""
+    def __init__(self, context: Dict[str, Any]):
+        self.unparsed: Dict[str, Any] = {}  # 无法解析出作者的条目对所有人可见
+        self.shared: Dict[str, Dict[str, Any]] = {}
+        for key, value in context["shared_memory"].items():
+            self.add(key, value)
+        self.history: List[Tuple[Dict[str, Any], Dict[str, List[Tuple[int, Any]]]]] = []
+        for round_data in context["recent_history"]:
+            by_agent: Dict[str, List[Tuple[int, Any]]] = {}
+            for position, turn in enumerate(round_data["results"]):
+                by_agent.setdefault(turn["agent"], []).append((position, turn))
+            self.history.append((round_data, by_agent))
+
+    def add(self, key: str, value: Any):
+        parsed = parse_shared_key(key)
+        if parsed is None:
+            self.unparsed[key] = value
+        else:
+            self.shared.setdefault(parsed[0], {})[key] = value
+
+    def view(self, context: Dict[str, Any], visible: List[str]) -> Dict[str, Any]:
+        """只包含visible中智能体的条目和回应的上下文"""
+        shared_memory = dict(self.unparsed)
+        for name in visible:
+            shared_memory.update(self.shared.get(name, {}))
+        recent_history = []
+        for round_data, by_agent in self.history:
+            turns = sorted((item for name in visible for item in by_agent.get(name, [])), key=lambda item: item[0])
+            recent_history.append(dict(round_data, results=[turn for _, turn in turns]))
+        return dict(context, shared_memory=shared_memory, recent_history=recent_history)
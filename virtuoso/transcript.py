@@ -0,0 +1,138 @@
+from typing import List, Dict, Any, Iterator
+import os
+import json
+import time
+from abc import ABC, abstractmethod
+
+
+def format_round_header(round_num: int) -> str:
+    return f"{'='*20} 第{round_num}轮 {'='*20}\n"
+
+
+def format_turn(turn: Dict[str, Any]) -> str:
+    """按records/*.txt的格式输出单个智能体的一次回应"""
+    return (f"[{turn['agent']}的思考]\n{turn['thought']}\n"
+            f"[{turn['agent']}的对话]\n{turn['speech']}\n\n"
+            f"[{turn['agent']}的行为]\n{turn['action']}\n\n")
+
+
+class TranscriptSink(ABC):
+    """对话记录输出端的基类（抽象类），TinyWorld每完成一个回应调用write_turn，每轮结束调用end_round"""
+    def begin(self, scene: str):
+        pass
+
+    @abstractmethod
+    def write_turn(self, turn: Dict[str, Any]):
+        """写入一个回应"""
+        pass
+
+    def end_round(self, round_num: int):
+        pass
+
+    def close(self):
+        pass
+
+
+class _AppendFile:
+    """以追加方式写入的文件：每次写入后flush便于tail，每fsync_every次写入或fsync_interval秒执行一次fsync"""
+    def __init__(self, path: str, fsync_every: int, fsync_interval: float):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.file = open(path, "a", encoding="utf-8")
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self._pending = 0
+        self._last_fsync = time.monotonic()
+
+    @property
+    def is_empty(self) -> bool:
+        return self.file.tell() == 0
+
+    def write(self, text: str):
+        self.file.write(text)
+        self.file.flush()
+        self._pending += 1
+        if self._pending >= self.fsync_every or time.monotonic() - self._last_fsync >= self.fsync_interval:
+            self.sync()
+
+    def sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self._pending = 0
+        self._last_fsync = time.monotonic()
+
+    def close(self):
+        if not self.file.closed:
+            self.sync()
+            self.file.close()
+
+
+class JsonlTranscriptSink(TranscriptSink):
+    """把每个回应追加为一行JSON，可边运行边tail，也可用read_transcript读回"""
+    def __init__(self, path: str, fsync_every: int = 20, fsync_interval: float = 5.0):
+        self.path = path
+        self._file = _AppendFile(path, fsync_every, fsync_interval)
+
+    def begin(self, scene: str):
+        if self._file.is_empty:
+            self._write({"type": "scene", "scene": scene})
+
+    def write_turn(self, turn: Dict[str, Any]):
+        self._write(dict(turn, type="turn"))
+
+    def end_round(self, round_num: int):
+        self._write({"type": "round_end", "round": round_num})
+
+    def _write(self, record: Dict[str, Any]):
+        self._file.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+
+    def close(self):
+        self._file.close()
+
+
+class TextTranscriptSink(TranscriptSink):
+    """以records/*.txt的文本格式逐个回应追加写入"""
+    def __init__(self, path: str, fsync_every: int = 20, fsync_interval: float = 5.0):
+        self.path = path
+        self._file = _AppendFile(path, fsync_every, fsync_interval)
+        self._current_round = None
+
+    def begin(self, scene: str):
+        if self._file.is_empty:
+            self._file.write(f"场景：{scene}\n\n")
+
+    def write_turn(self, turn: Dict[str, Any]):
+        if turn["round"] != self._current_round:
+            self._current_round = turn["round"]
+            self._file.write(format_round_header(turn["round"]))
+        self._file.write(format_turn(turn))
+
+    def end_round(self, round_num: int):
+        self._file.write("\n")
+
+    def close(self):
+        self._file.close()
+
+
+def read_transcript(path: str) -> Iterator[Dict[str, Any]]:
+    """逐条读取JsonlTranscriptSink写入的回应记录，忽略进程崩溃时可能写了一半的最后一行"""
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                break
+            if record.get("type") == "turn":
+                record.pop("type")
+                yield record
+
+
+def rounds_from_transcript(path: str) -> List[Dict[str, Any]]:
+    """把JSONL对话记录还原为TinyWorld.context["history"]的结构"""
+    rounds: List[Dict[str, Any]] = []
+    for turn in read_transcript(path):
+        if not rounds or rounds[-1]["round"] != turn["round"]:
+            rounds.append({"round": turn["round"], "results": []})
+        rounds[-1]["results"].append(turn)
+    return rounds
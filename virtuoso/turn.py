@@ -0,0 +1,211 @@
+from typing import List, Dict, Any, Optional, Iterator, Callable
+import sys
+import threading
+from array import array
+from collections.abc import MutableMapping
+
+_MISSING = object()
+
+
+class Turn(MutableMapping):
+    """智能体的一次回应。
+
+    用__slots__保存固定字段，比普通字典小得多；智能体名字经过sys.intern，所有回应共享同一个字符串。
+    同时实现了映射接口（turn["speech"]、turn.get、dict(turn)等），repr与等价的字典一致，
+    现有按字典使用回应的代码和提示词文本都不受影响。errors、timestamp为可选字段，其他键存放在extra中。"""
+    __slots__ = ("agent", "round", "thought", "speech", "action", "errors", "timestamp", "extra")
+    FIELDS = ("agent", "round", "thought", "speech", "action", "errors", "timestamp")
+
+    def __init__(self, agent: str, round: int, thought: str, speech: str, action: str,
+                 errors: Any = _MISSING, timestamp: Any = _MISSING, **extra):
+        self.agent = sys.intern(agent)
+        self.round = round
+        self.thought = thought
+        self.speech = speech
+        self.action = action
+        self.errors = errors
+        self.timestamp = timestamp
+        self.extra = extra or None
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "Turn":
+        return data if isinstance(data, cls) else cls(**data)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return dict(self.items())
+
+    def __getitem__(self, key: str) -> Any:
+        if key in self.FIELDS:
+            value = getattr(self, key)
+            if value is not _MISSING:
+                return value
+        elif self.extra and key in self.extra:
+            return self.extra[key]
+        raise KeyError(key)
+
+    def __setitem__(self, key: str, value: Any):
+        if key in self.FIELDS:
+            setattr(self, key, sys.intern(value) if key == "agent" else value)
+        else:
+            if self.extra is None:
+                self.extra = {}
+            self.extra[key] = value
+
+    def __delitem__(self, key: str):
+        if key in ("errors", "timestamp") and getattr(self, key) is not _MISSING:
+            setattr(self, key, _MISSING)
+        elif self.extra and key in self.extra:
+            del self.extra[key]
+        else:
+            raise KeyError(key)
+
+    def __iter__(self) -> Iterator[str]:
+        for key in self.FIELDS:
+            if getattr(self, key) is not _MISSING:
+                yield key
+        if self.extra:
+            yield from self.extra
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def __repr__(self) -> str:
+        return repr(self.to_dict())
+
+
+class TurnLog:
+    """按发生顺序保存回应的共享日志，同一个世界中的所有智能体共用一个日志，各自的对话历史只保存下标。
+
+    discard_before丢弃较早的回应以释放内存，下标保持不变，被丢弃的下标读取结果为None。
+    parallel调度和按拓扑分组执行时多个线程同时追加，读写都在锁内进行。"""
+    def __init__(self):
+        self._turns: List[Optional[Turn]] = []
+        self._offset = 0
+        self._lock = threading.Lock()
+
+    def append(self, turn: Turn) -> int:
+        with self._lock:
+            self._turns.append(turn)
+            return self._offset + len(self._turns) - 1
+
+    def get(self, index: int) -> Optional[Turn]:
+        with self._lock:
+            position = index - self._offset
+            return self._turns[position] if 0 <= position < len(self._turns) else None
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._offset + len(self._turns)
+
+    def __iter__(self) -> Iterator[Turn]:
+        """仍保留的回应"""
+        with self._lock:
+            turns = list(self._turns)
+        return (turn for turn in turns if turn is not None)
+
+    def discard_before(self, index: int):
+        with self._lock:
+            count = min(max(0, index - self._offset), len(self._turns))
+            del self._turns[:count]
+            self._offset += count
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            offset, turns = self._offset, list(self._turns)
+        return {"offset": offset, "turns": [turn.to_dict() if turn is not None else None for turn in turns]}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "TurnLog":
+        """根据to_dict的结果重建日志，下标与保存时一致"""
+        log = cls()
+        log._offset = data["offset"]
+        log._turns = [Turn.from_dict(turn) if turn is not None else None for turn in data["turns"]]
+        return log
+
+
+class TurnHistory:
+    """智能体的对话历史：TurnLog中下标的环形缓冲区（array存储），limit为None时不限制长度。
+
+    提供列表的只读接口（迭代、len、下标和切片），append追加一个回应。"""
+    def __init__(self, limit: Optional[int] = None, log: Optional[TurnLog] = None):
+        self.limit = limit
+        self.log = log or TurnLog()
+        self._indices = array("q")
+        self._start = 0  # 达到limit后，_indices作为环形缓冲区使用，_start指向最旧的位置
+
+    def append(self, turn: Any):
+        index = self.log.append(Turn.from_dict(turn))
+        if self.limit is None or len(self._indices) < self.limit:
+            self._indices.append(index)
+        elif self.limit > 0:
+            self._indices[self._start] = index
+            self._start = (self._start + 1) % self.limit
+
+    def extend(self, turns):
+        for turn in turns:
+            self.append(turn)
+
+    def _ordered_indices(self) -> array:
+        return self._indices[self._start:] + self._indices[:self._start]
+
+    def __iter__(self) -> Iterator[Turn]:
+        for index in self._ordered_indices():
+            turn = self.log.get(index)
+            if turn is not None:
+                yield turn
+
+    def __len__(self) -> int:
+        # 日志只丢弃所有对话历史都不再引用的回应（见TinyWorld.discard_unreferenced_turns），引用的下标都有效
+        return len(self._indices)
+
+    def _turn_at(self, position: int) -> Turn:
+        """按时间顺序的第position个回应，直接在环形缓冲区中定位"""
+        return self.log.get(self._indices[(self._start + position) % len(self._indices)])
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return [self._turn_at(position) for position in range(*item.indices(len(self._indices)))]
+        if item < 0:
+            item += len(self._indices)
+        if not 0 <= item < len(self._indices):
+            raise IndexError("TurnHistory index out of range")
+        return self._turn_at(item)
+
+    def __bool__(self) -> bool:
+        return len(self._indices) > 0
+
+    def attach(self, log: TurnLog):
+        """改用另一个（例如世界共享的）日志，已有的回应迁移过去"""
+        if log is self.log:
+            return
+        turns = list(self)
+        self.log = log
+        self._indices, self._start = array("q"), 0
+        self.extend(turns)
+
+    def retain(self, predicate: Callable[[Turn], bool]):
+        """只保留满足predicate的回应"""
+        kept = [index for index in self._ordered_indices()
+                if self.log.get(index) is not None and predicate(self.log.get(index))]
+        self._indices, self._start = array("q", kept), 0
+
+    def indices(self) -> List[int]:
+        """按时间顺序排列的日志下标，与日志一起保存到检查点"""
+        return list(self._ordered_indices())
+
+    def restore(self, log: TurnLog, indices: List[int]):
+        """直接引用log中的这些下标（从检查点恢复），超出limit时只保留最新的"""
+        if self.limit is not None:
+            indices = indices[len(indices) - self.limit:] if self.limit > 0 else []
+        self.log = log
+        self._indices, self._start = array("q", indices), 0
+
+    def oldest_index(self) -> int:
+        """仍被引用的最旧回应在日志中的下标（下标单调递增，最旧的即最小的），没有回应时为日志长度"""
+        return self._indices[self._start] if self._indices else len(self.log)
+
+    def to_list(self) -> List[Dict[str, Any]]:
+        return [turn.to_dict() for turn in self]
+
+    def __repr__(self) -> str:
+        return repr(list(self))
@@ -0,0 +1,202 @@
+from typing import List, Dict, Any, Optional
+import re
+import json
+import random
+from openai import OpenAI, AsyncOpenAI
+from .baseagent import BaseAgent
+from .llmclient import get_client, get_async_client, create_chat_completion, acreate_chat_completion
+
+
+class TurnPolicy:
+    """TinyWorld的发言人选择策略：每轮开始时决定本轮由哪些智能体行动，返回的智能体按world.agents的顺序排列。
+
+    每轮的LLM调用数与选中的发言人数成正比，而不是与智能体总数成正比。"""
+    def select(self, world, round_num: int) -> List[BaseAgent]:
+        return list(world.agents)
+
+    async def aselect(self, world, round_num: int) -> List[BaseAgent]:
+        return self.select(world, round_num)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"type": "round_robin", "speakers_per_round": None}
+
+
+def _last_turns(world) -> List[Dict[str, Any]]:
+    """最近一轮有人发言的回应"""
+    for round_data in reversed(world.context["history"]):
+        if round_data["results"]:
+            return round_data["results"]
+    return []
+
+
+def _name_pattern(name: str) -> re.Pattern:
+    """拉丁字母名字按单词边界匹配（避免Ann匹配到Anna），其他名字按子串匹配"""
+    return re.compile(rf"(?<![A-Za-z]){re.escape(name)}(?![A-Za-z])", re.IGNORECASE)
+
+
+def mentioned_agents(turns: List[Dict[str, Any]], agents: List[BaseAgent]) -> List[BaseAgent]:
+    """在其他智能体的发言中被点名的智能体"""
+    patterns = [(agent, _name_pattern(agent.name)) for agent in agents]
+    return [agent for agent, pattern in patterns
+            if any(turn["agent"] != agent.name and pattern.search(turn.get("speech") or "") for turn in turns)]
+
+
+class RoundRobinPolicy(TurnPolicy):
+    """轮流发言：speakers_per_round为None时每轮所有智能体都行动（默认行为），否则每轮依次轮换speakers_per_round个"""
+    def __init__(self, speakers_per_round: Optional[int] = None):
+        self.speakers_per_round = speakers_per_round
+
+    def select(self, world, round_num: int) -> List[BaseAgent]:
+        agents = list(world.agents)
+        if self.speakers_per_round is None or self.speakers_per_round >= len(agents):
+            return agents
+        start = (round_num - 1) * self.speakers_per_round % len(agents)
+        chosen = {(start + offset) % len(agents) for offset in range(self.speakers_per_round)}
+        return [agent for index, agent in enumerate(agents) if index in chosen]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"type": "round_robin", "speakers_per_round": self.speakers_per_round}
+
+
+class AddressedPolicy(TurnPolicy):
+    """只让上一轮发言中被点名的智能体行动；没有人被点名（包括第一轮）时使用fallback，默认每轮轮换一人"""
+    def __init__(self, max_speakers: Optional[int] = None, fallback: Optional[TurnPolicy] = None):
+        self.max_speakers = max_speakers
+        self.fallback = fallback or RoundRobinPolicy(1)
+
+    def select(self, world, round_num: int) -> List[BaseAgent]:
+        speakers = mentioned_agents(_last_turns(world), world.agents)
+        if not speakers:
+            return self.fallback.select(world, round_num)
+        return speakers[:self.max_speakers] if self.max_speakers else speakers
+
+    async def aselect(self, world, round_num: int) -> List[BaseAgent]:
+        speakers = mentioned_agents(_last_turns(world), world.agents)
+        if not speakers:
+            return await self.fallback.aselect(world, round_num)
+        return speakers[:self.max_speakers] if self.max_speakers else speakers
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"type": "addressed", "max_speakers": self.max_speakers, "fallback": self.fallback.to_dict()}
+
+
+class ActivityPolicy(TurnPolicy):
+    """按活跃度随机选择发言人，每轮期望约expected_speakers人。
+
+    活跃度按最近window轮计算：自己发言一次加1，被别人点名一次加mention_weight，越早的轮次权重越低；
+    floor保证沉默的智能体也有机会发言。随机数由seed和轮次决定，从检查点恢复后结果不变。"""
+    def __init__(self, expected_speakers: float = 2.0, window: int = 3, mention_weight: float = 2.0,
+                 floor: float = 0.5, seed: int = 0):
+        self.expected_speakers = expected_speakers
+        self.window = window
+        self.mention_weight = mention_weight
+        self.floor = floor
+        self.seed = seed
+
+    def weights(self, world) -> List[float]:
+        scores = {agent.name: self.floor for agent in world.agents}
+        recent = world.context["history"][-self.window:] if self.window > 0 else []
+        for age, round_data in enumerate(reversed(recent)):
+            decay = 0.5 ** age
+            for turn in round_data["results"]:
+                if turn["agent"] in scores:
+                    scores[turn["agent"]] += decay
+            for agent in mentioned_agents(round_data["results"], world.agents):
+                scores[agent.name] += self.mention_weight * decay
+        return [scores[agent.name] for agent in world.agents]
+
+    def select(self, world, round_num: int) -> List[BaseAgent]:
+        agents = list(world.agents)
+        if not agents:
+            return []
+        weights = self.weights(world)
+        total = sum(weights)
+        rng = random.Random(f"{self.seed}:{round_num}")
+        speakers = [agent for agent, weight in zip(agents, weights)
+                    if rng.random() < min(1.0, self.expected_speakers * weight / total)]
+        # 保证每轮至少有一人发言，选活跃度最高的
+        return speakers or [agents[max(range(len(agents)), key=weights.__getitem__)]]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"type": "activity", "expected_speakers": self.expected_speakers, "window": self.window,
+                "mention_weight": self.mention_weight, "floor": self.floor, "seed": self.seed}
+
+
+class ModeratorPolicy(TurnPolicy):
+    """由一个便宜的主持人模型根据上一轮的发言选出本轮最应该发言的人（每轮一次短调用）；
+    调用失败或没有选出有效的人时使用fallback"""
+    def __init__(self, model: str = "qwen-turbo", max_speakers: int = 3, api_client: Optional[OpenAI] = None,
+                 async_api_client: Optional[AsyncOpenAI] = None, fallback: Optional[TurnPolicy] = None):
+        self.model = model
+        self.max_speakers = max_speakers
+        self.api_client = api_client
+        self.async_api_client = async_api_client
+        self.fallback = fallback or RoundRobinPolicy(1)
+
+    def _request_params(self, world) -> Dict[str, Any]:
+        roster = "\n".join(f"- {agent.name}：{agent.role}" for agent in world.agents)
+        turns = _last_turns(world)
+        recent = "\n".join(f"{turn['agent']}：{turn['speech']}" for turn in turns) or "（还没有人发言）"
+        prompt = f"""你是一场多人对话的主持人。当前场景是：{world.scene}
+        参与者：
+{roster}
+
+        上一轮的发言：
+{recent}
+
+        请选出接下来最应该发言的最多{self.max_speakers}位参与者（例如被提问、被点名或与话题最相关的人），
+        以JSON对象输出：{{"speakers": ["名字", ...]}}"""
+        return {
+            "model": self.model,
+            "messages": [{"role": "user", "content": prompt}],
+            "temperature": 0.0,
+            "max_tokens": 100,
+            "response_format": {"type": "json_object"},
+        }
+
+    def _parse(self, world, content: Optional[str]) -> List[BaseAgent]:
+        try:
+            names = json.loads(content or "{}").get("speakers", [])
+        except (json.JSONDecodeError, AttributeError):
+            return []
+        if not isinstance(names, list):
+            return []
+        wanted = {str(name).strip() for name in names}
+        return [agent for agent in world.agents if agent.name in wanted][:self.max_speakers]
+
+    def select(self, world, round_num: int) -> List[BaseAgent]:
+        try:
+            response = create_chat_completion(self.api_client or get_client(), method="select_speakers",
+                                              round_num=round_num, **self._request_params(world))
+            speakers = self._parse(world, response.choices[0].message.content)
+        except Exception:
+            speakers = []
+        return speakers or self.fallback.select(world, round_num)
+
+    async def aselect(self, world, round_num: int) -> List[BaseAgent]:
+        try:
+            response = await acreate_chat_completion(self.async_api_client or get_async_client(),
+                                                     method="select_speakers", round_num=round_num,
+                                                     **self._request_params(world))
+            speakers = self._parse(world, response.choices[0].message.content)
+        except Exception:
+            speakers = []
+        return speakers or await self.fallback.aselect(world, round_num)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"type": "moderator", "model": self.model, "max_speakers": self.max_speakers,
+                "fallback": self.fallback.to_dict()}
+
+
+def turn_policy_from_dict(data: Dict[str, Any]) -> TurnPolicy:
+    """根据TurnPolicy.to_dict的结果重建发言策略，用于从检查点恢复（注入的LLM客户端不会保存）"""
+    options = {key: value for key, value in data.items() if key != "type"}
+    if "fallback" in options:
+        options["fallback"] = turn_policy_from_dict(options["fallback"])
+    if data["type"] == "addressed":
+        return AddressedPolicy(**options)
+    if data["type"] == "activity":
+        return ActivityPolicy(**options)
+    if data["type"] == "moderator":
+        return ModeratorPolicy(**options)
+    return RoundRobinPolicy(options.get("speakers_per_round"))